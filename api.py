@@ -0,0 +1,355 @@
+"""
+Headless trigger API: fire an alert for a stored profile without a browser
+session, from panic buttons, wearables or other services.
+
+    SOS_API_KEYS=secret python -m api serve --port 8503
+    curl -H 'Authorization: Bearer secret' -d '{"profile": "default", "latitude": 28.61, "longitude": 77.2}' \\
+        http://127.0.0.1:8503/v1/alerts
+    python -m api trigger --profile default --latitude 28.61 --longitude 77.2
+    python -m api status <incident_id>
+
+The trigger, status and reset commands are clients of a running server.
+"""
+import argparse
+import asyncio
+import hmac
+import importlib
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+
+from delivery import get_status_index
+from dispatch import credentials_missing
+from escalation import get_escalator
+import incident_log
+from incident_log import log_event
+from incidents import build_messages, dispatch_incident, normalize_contacts, queue_incident
+from metrics import current_trace_id, record_alert
+from outbox import get_outbox
+from profiles import get_profile_store
+from state import STATE_BACKEND, claim_trigger, incident_owner, record_incident_owner, release_trigger
+from tracking import describe_fix
+
+API_HOST = os.environ.get('SOS_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('SOS_API_PORT', '8503'))
+# Threads that run dispatches; each waits for its alerts' results within the channel budgets
+API_WORKERS = int(os.environ.get('SOS_API_WORKERS', '256'))
+MAX_BODY = 64 * 1024
+# What sending an alert imports on first use
+SEND_MODULES = ('twilio.rest', 'requests')
+
+
+def parse_api_keys(value):
+    """{key: profile_id or None} from comma-separated keys, each optionally written key:profile"""
+    keys = {}
+    for entry in value.split(','):
+        key, _, profile_id = entry.strip().partition(':')
+        if key:
+            keys[key] = profile_id or None
+    return keys
+
+
+# Keys the API accepts as bearer tokens; a key bound to a profile may only trigger that profile
+API_KEYS = parse_api_keys(os.environ.get('SOS_API_KEYS', ''))
+# Where the trigger, status and reset commands find the server, and the key they use
+API_URL = os.environ.get('SOS_API_URL', f"http://{API_HOST}:{API_PORT}")
+API_KEY = os.environ.get('SOS_API_KEY') or next(iter(API_KEYS), '')
+
+REASONS = {200: 'OK', 201: 'Created', 202: 'Accepted', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden',
+           404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 422: 'Unprocessable Entity',
+           500: 'Internal Server Error'}
+
+
+class AlertError(Exception):
+    """A trigger that can't be dispatched, with the HTTP status that describes why"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def profile_settings(profile_id):
+    """(credentials, contacts, user_name) of a stored profile"""
+    profile = get_profile_store().get(profile_id)
+    if not profile:
+        raise AlertError(404, f"unknown profile {profile_id!r}")
+    credentials = {key: profile.get(key, '') for key in
+                   ('twilio_account_sid', 'twilio_auth_token', 'twilio_phone_number')}
+    return credentials, normalize_contacts(profile.get('emergency_contacts', [])), profile.get('user_name', '')
+
+
+def trigger_alert(profile_id, source="API", latitude=None, longitude=None, accuracy=None, wait=True):
+    """
+    Alert a profile's contacts from wherever the caller is: the same path as
+    the SOS button, with the location given by the caller instead of the
+    browser. Returns the incident with a result for every call and SMS, or,
+    without wait, once they are safely queued for the outbox worker to send.
+    """
+    credentials, contacts, user_name = profile_settings(profile_id)
+    if credentials_missing(credentials):
+        raise AlertError(422, "the profile has no Twilio credentials")
+    if not contacts:
+        raise AlertError(422, "the profile has no emergency contacts")
+    if latitude is not None and longitude is not None:
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise AlertError(400, "latitude or longitude out of range")
+        fix = (time.time(), latitude, longitude, accuracy or 0.0)
+    else:
+        fix = None
+
+    incident_id = uuid.uuid4().hex
+    owner = claim_trigger(profile_id, incident_id)
+    log_event('triggered', owner, profile_id, source=source, duplicate=owner != incident_id)
+    if owner != incident_id:
+        # A trigger for this profile is already being handled: join it rather than alert again
+        return {'incident_id': owner, 'duplicate': True, 'location': None, 'channels': []}
+    record_incident_owner(incident_id, profile_id)
+
+    trace_token = current_trace_id.set(incident_id)
+    record_alert(source)
+    try:
+        location = describe_fix(fix)
+        call_message, sms_message = build_messages(user_name, location)
+        if wait:
+            channels = [asdict(result) for result in
+                        dispatch_incident(incident_id, credentials, contacts, call_message, sms_message, location)]
+        else:
+            queue_incident(incident_id, credentials, contacts, call_message, sms_message, location, handoff_grace=0)
+            channels = [{'channel': channel, 'target': contact['number'], 'queued': True}
+                        for contact in contacts for channel in ('call', 'sms')]
+    finally:
+        current_trace_id.reset(trace_token)
+    return {'incident_id': incident_id, 'duplicate': False, 'location': location, 'channels': channels}
+
+
+def reset_alert(profile_id, incident_id):
+    """Stop escalating an incident and let the profile trigger again straight away"""
+    log_event('reset', incident_id, profile_id)
+    get_escalator().acknowledge(incident_id)
+    release_trigger(profile_id, incident_id)
+
+
+def alert_status(incident_id):
+    """Every alert of an incident in the outbox, with its latest Twilio status when one was reported"""
+    statuses = get_status_index().incident(incident_id)
+    alerts = []
+    for channel, target, status, attempts, sid, last_error in get_outbox().statuses(incident_id):
+        delivery = statuses.get((channel, target))
+        alerts.append({'channel': channel, 'target': target, 'status': status, 'attempts': attempts,
+                       'sid': sid, 'error': last_error, 'delivery': delivery[0] if delivery else None})
+    if not alerts:
+        raise AlertError(404, f"unknown incident {incident_id!r}")
+    return {'incident_id': incident_id, 'alerts': alerts}
+
+
+class ApiServer:
+    """
+    HTTP/1.1 with keep-alive on asyncio streams, so thousands of open
+    connections cost no threads. Dispatches run on a thread pool, since the
+    outbox and the Twilio client block; the event loop only parses requests
+    and writes responses.
+    """
+
+    def __init__(self, keys=None, workers=API_WORKERS):
+        self.keys = API_KEYS if keys is None else keys
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sos-api')
+
+    def authorize(self, headers):
+        """The profile the request's key is bound to (None for any), or raise AlertError"""
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        if scheme.lower() == 'bearer':
+            for key, profile_id in self.keys.items():
+                if hmac.compare_digest(token.encode(), key.encode()):
+                    return profile_id
+        raise AlertError(401, "missing or invalid API key")
+
+    async def route(self, method, path, headers, body):
+        bound_profile = self.authorize(headers)
+        parts = path.strip('/').split('/')
+        if parts[:2] != ['v1', 'alerts']:
+            raise AlertError(404, "not found")
+        loop = asyncio.get_running_loop()
+        if len(parts) >= 3 and bound_profile is not None:
+            # Another profile's incidents look the same as ones that don't exist
+            if await loop.run_in_executor(self._executor, incident_owner, parts[2]) != bound_profile:
+                raise AlertError(404, f"unknown incident {parts[2]!r}")
+        if len(parts) == 3 and method == 'GET':
+            return 200, await loop.run_in_executor(self._executor, alert_status, parts[2])
+
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            raise AlertError(400, "invalid JSON")
+        if not isinstance(payload, dict):
+            raise AlertError(400, "expected a JSON object")
+        profile_id = payload.get('profile') or bound_profile
+        if not isinstance(profile_id, str):
+            raise AlertError(400, "profile is required")
+        if bound_profile is not None and profile_id != bound_profile:
+            raise AlertError(403, "this API key can't trigger that profile")
+
+        if len(parts) == 2 and method == 'POST':
+            try:
+                latitude, longitude, accuracy = (None if payload.get(field) is None else float(payload[field])
+                                                 for field in ('latitude', 'longitude', 'accuracy'))
+            except (TypeError, ValueError):
+                raise AlertError(400, "latitude, longitude and accuracy must be numbers")
+            source = f"API: {payload['source'][:64]}" if isinstance(payload.get('source'), str) else "API"
+            wait = payload.get('wait', True) is not False
+            result = await loop.run_in_executor(self._executor, trigger_alert, profile_id, source,
+                                                latitude, longitude, accuracy, wait)
+            return (200 if result['duplicate'] else 201 if wait else 202), result
+        if len(parts) == 4 and parts[3] == 'reset' and method == 'POST':
+            await loop.run_in_executor(self._executor, reset_alert, profile_id, parts[2])
+            return 200, {'incident_id': parts[2], 'reset': True}
+        raise AlertError(405, "method not allowed")
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    status, payload = 413, {'error': "request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    keep_alive = (headers.get('connection', '').lower() != 'close'
+                                  and not version.startswith('HTTP/1.0'))
+                    try:
+                        status, payload = await self.route(method, target.split('?', 1)[0], headers, body)
+                    except AlertError as e:
+                        status, payload = e.status, {'error': str(e)}
+                    except Exception as e:
+                        print(f"API error: {e}")
+                        status, payload = 500, {'error': "internal error"}
+                data = json.dumps(payload, default=str).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                    .encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=API_HOST, port=API_PORT, ready=None, reuse_port=False):
+        # Load the sending dependencies before the first request: worker
+        # threads importing them at once can see half-initialised modules
+        for module in SEND_MODULES:
+            importlib.import_module(module)
+        server = await asyncio.start_server(self.handle, host, port, backlog=4096, reuse_port=reuse_port)
+        print(f"SOS API listening on http://{host}:{port} (pid {os.getpid()})")
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+
+def request(url, key, method, path, payload=None):
+    """Call the API server and return its JSON answer; exits with the server's error message"""
+    data = None if payload is None else json.dumps(payload).encode()
+    headers = {'Authorization': f"Bearer {key}", 'Content-Type': 'application/json'}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url.rstrip('/') + path, data, headers, method=method)) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.load(e)['error']
+        except (ValueError, KeyError):
+            message = f"HTTP {e.code}"
+        sys.exit(f"Error: {message}")
+    except urllib.error.URLError as e:
+        sys.exit(f"Error: can't reach the SOS API at {url} ({e.reason}); start it with python -m api serve")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="run the HTTP API")
+    serve.add_argument('--host', default=API_HOST)
+    serve.add_argument('--port', type=int, default=API_PORT)
+    serve.add_argument('--processes', type=int, default=1,
+                       help="server processes sharing the port; needs a shared SOS_STATE_BACKEND above 1")
+    serve.add_argument('--sidecar', action='store_true',
+                       help="also run the sidecar here, to receive Twilio status callbacks for these alerts")
+    trigger = commands.add_parser('trigger', help="alert a profile's contacts and print the results")
+    trigger.add_argument('--profile', required=True)
+    trigger.add_argument('--latitude', type=float)
+    trigger.add_argument('--longitude', type=float)
+    trigger.add_argument('--accuracy', type=float)
+    trigger.add_argument('--source', help="what triggered the alert, e.g. a device name")
+    status = commands.add_parser('status', help="print the alerts of an incident")
+    status.add_argument('incident_id')
+    reset = commands.add_parser('reset', help="stop escalating an incident")
+    reset.add_argument('--profile', required=True)
+    reset.add_argument('incident_id')
+    for command in (trigger, status, reset):
+        command.add_argument('--url', default=API_URL, help="the running API server (default %(default)s)")
+        command.add_argument('--key', default=API_KEY, help="API key (default SOS_API_KEY, or the first of SOS_API_KEYS)")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if not API_KEYS:
+            sys.exit("Set SOS_API_KEYS before serving the API")
+        if args.processes > 1 and STATE_BACKEND == 'memory':
+            sys.exit("Set SOS_STATE_BACKEND to sqlite:// or redis:// so all processes deduplicate triggers together")
+        if args.processes > 1 and args.sidecar:
+            sys.exit("--sidecar tracks delivery for one process only; run a single process with it")
+        if args.sidecar:
+            import sidecar
+            sidecar.ensure_started()
+        # The Python work per trigger is bound by one core; more processes
+        # share the port through SO_REUSEPORT. Fork before any threads start.
+        index = 0
+        for child in range(1, args.processes):
+            if os.fork() == 0:
+                index = child
+                break
+        # An incident log has a single writer (its index chains are kept in
+        # memory), so each process keeps its own, apart from the app's
+        if incident_log.INCIDENT_LOG:
+            incident_log.INCIDENT_LOG += f".api{index or ''}"
+        # Resume alerts and escalations a previous process left unfinished
+        get_outbox()
+        get_escalator()
+        asyncio.run(ApiServer().serve(args.host, args.port, reuse_port=args.processes > 1))
+        return
+
+    # The CLI goes through the running server, which owns the outbox and the
+    # incident log; a second sender on the same files would resend alerts
+    if args.command == 'trigger':
+        source = f"CLI: {args.source}" if args.source else "CLI"
+        result = request(args.url, args.key, 'POST', '/v1/alerts',
+                         {'profile': args.profile, 'latitude': args.latitude, 'longitude': args.longitude,
+                          'accuracy': args.accuracy, 'source': source})
+    elif args.command == 'status':
+        result = request(args.url, args.key, 'GET', f"/v1/alerts/{args.incident_id}")
+    else:
+        result = request(args.url, args.key, 'POST', f"/v1/alerts/{args.incident_id}/reset",
+                         {'profile': args.profile})
+    print(json.dumps(result, indent=2))
+    if args.command == 'trigger' and not result['duplicate']:
+        sys.exit(0 if any(channel['ok'] for channel in result['channels']) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,36 @@
+import time
+rerun_started = time.perf_counter()
+import profiler
+# Sample this script run's stacks when profiling is on (SOS_PROFILE_RATE)
+profiler.start_run()
+import startup
 import streamlit as st
 import streamlit.components.v1 as components
-import base64
-import time
+from streamlit.errors import StreamlitAPIException
+import functools
+import json
 import os
-import pickle
-from twilio.rest import Client
-import random
-# Near the beginning of your app, after imports
-import streamlit.web.server.server as server
-
-# Check for voice emergency POST requests
-try:
-    request = server.get_request()
-    if request is not None and request.method == "POST":
-        form = request.form
-        if "emergency_trigger" in form and form["emergency_trigger"] == "true":
-            keyword = form.get("voice_keyword", "unknown")
-            st.session_state.sos_triggered = True
-            st.session_state.trigger_source = f"Voice Command: '{keyword}'"
-            st.session_state.sos_triggered_action_completed = False
-except Exception as e:
-    # Just log the error and continue
-    print(f"Error processing POST request: {e}")
-
+import uuid
+from escalation import get_escalator
+from incident_log import get_incident_log, incident_summary
+from live_updates import get_live_updates
+from dispatch import credentials_missing, place_call, send_sms
+from metrics import current_trace_id, record_alert, rerun_duration, span
+from keywords import DEFAULT_KEYWORDS, get_keyword_spotter
+from outbox import get_outbox, register_credentials
+from profiles import DEFAULT_PROFILE, access_allowed, get_profile_store, new_access_key
+from twilio_pool import get_twilio_pool
+import assets
+import sidecar
+from incidents import (build_messages, dispatch_incident, nearby_help, new_delivery_status, normalize_contacts,
+                       panel_status, update_delivery_status)
+from tracking import FLUSH_SECONDS, current_location
+from triggers import get_trigger_registry
+
+# Seconds between SOS panel refreshes, which show incidents started by the
+# sidecar and their delivery progress; 0 turns the refresh off
+SOS_PANEL_REFRESH = float(os.environ.get('SOS_PANEL_REFRESH', '2')) or None
+startup.checkpoint('imports', rerun_started)
 # Page configuration
 st.set_page_config(
     page_title="SOS Emergency App",
@@ -31,132 +39,67 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Path for saving credentials
-CREDENTIALS_FILE = "sos_credentials.pkl"
+# Start the sidecar that serves static assets next to Streamlit
+sidecar.ensure_started()
+# Load pandas, the Twilio SDK and the geocoding indexes in the background
+startup.prewarm()
+startup.checkpoint('sidecar')
 
-# Load saved credentials if they exist
-def load_credentials():
-    if os.path.exists(CREDENTIALS_FILE):
-        try:
-            with open(CREDENTIALS_FILE, 'rb') as f:
-                return pickle.load(f)
-        except Exception as e:
-            st.error(f"Error loading credentials: {e}")
+# Load the saved settings for this session's profile
+def load_credentials(profile_id):
+    try:
+        return get_profile_store().get(profile_id)
+    except Exception as e:
+        st.error(f"Error loading credentials: {e}")
     return {}
 
 # Save credentials
 def save_credentials():
+    # The first save protects the profile with an access key, kept in the page's address
+    access_key = None
+    if not st.session_state.access_key_hash:
+        access_key, access_key_hash = new_access_key()
+    else:
+        access_key_hash = st.session_state.access_key_hash
     credentials = {
         'twilio_account_sid': st.session_state.twilio_account_sid,
         'twilio_auth_token': st.session_state.twilio_auth_token,
         'twilio_phone_number': st.session_state.twilio_phone_number,
-        'emergency_contact': st.session_state.emergency_contact,
-        'user_name': st.session_state.user_name
+        'emergency_contacts': get_contacts(),
+        'user_name': st.session_state.user_name,
+        'custom_keywords': st.session_state.custom_keywords,
+        'access_key_hash': access_key_hash
     }
     try:
-        with open(CREDENTIALS_FILE, 'wb') as f:
-            pickle.dump(credentials, f)
+        get_profile_store().put(st.session_state.profile_id, credentials)
+        if access_key is not None:
+            st.session_state.access_key_hash = access_key_hash
+            st.query_params['profile'] = st.session_state.profile_id
+            st.query_params['key'] = access_key
+            st.info("This profile is now protected by an access key, which has been added to this page's "
+                    "address. Bookmark the page: the profile can't be opened without it.")
         return True
     except Exception as e:
         st.error(f"Error saving credentials: {e}")
         return False
 
-# CSS for styling
-st.markdown("""
-<style>
-    .main {
-        background-color: #f8f9fa;
-    }
-    .sos-button {
-        background-color: #dc3545;
-        color: white;
-        border: none;
-        border-radius: 50%;
-        width: 200px;
-        height: 200px;
-        font-size: 32px;
-        font-weight: bold;
-        cursor: pointer;
-        box-shadow: 0 8px 16px rgba(0,0,0,0.2);
-        transition: transform 0.3s, box-shadow 0.3s;
-        margin: 0 auto;
-        display: block;
-    }
-    .sos-button:hover {
-        transform: scale(1.05);
-        box-shadow: 0 12px 20px rgba(0,0,0,0.3);
-    }
-    .title {
-        text-align: center;
-        color: #343a40;
-        margin-bottom: 30px;
-    }
-    .container {
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-        justify-content: center;
-        padding: 30px;
-    }
-    .settings-container {
-        margin-top: 40px;
-        padding: 20px;
-        border-radius: 10px;
-        background-color: #ffffff;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        width: 100%;
-    }
-    .header-section {
-        padding: 20px;
-        background-color: #dc3545;
-        color: white;
-        border-radius: 10px;
-        margin-bottom: 30px;
-    }
-    .footer {
-        margin-top: 50px;
-        text-align: center;
-        color: #6c757d;
-        font-size: 14px;
-    }
-    .listening-indicator {
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        gap: 10px;
-        margin: 20px 0;
-    }
-    .mic-icon {
-        color: #dc3545;
-        font-size: 24px;
-        animation: pulse 1.5s infinite;
-    }
-    @keyframes pulse {
-        0% { opacity: 1; }
-        50% { opacity: 0.3; }
-        100% { opacity: 1; }
-    }
-    .siren-active {
-        border: 3px solid #dc3545;
-        animation: siren-border 1s infinite;
-        padding: 10px;
-        border-radius: 5px;
-        margin-bottom: 15px;
-    }
-    @keyframes siren-border {
-        0% { border-color: #dc3545; }
-        50% { border-color: #ffc107; }
-        100% { border-color: #dc3545; }
-    }
-</style>
-""", unsafe_allow_html=True)
-def insert_voice_js():
+# CSS for styling, minified once per process
+st.markdown(assets.STYLE_HTML, unsafe_allow_html=True)
+startup.checkpoint('style')
+@functools.lru_cache(maxsize=256)
+def voice_js_html(custom_keywords):
+    """Voice recognition component, built once per set of custom keywords"""
     html = """
     <div id="voice-status" style="margin-top: 10px; padding: 10px; border-radius: 5px; background-color: #fff3cd; color: #856404;">
         Initializing voice recognition...
     </div>
     <script>
-    function triggerSOSDirectly(keyword) {
+    // Keywords come from the server-side keyword engine (keywords.py); they
+    // are only matched here when the sidecar can't be reached
+    const keywords = %(keywords)s;
+    const allKeywords = Object.values(keywords).flat().map(k => k.normalize('NFC').toLowerCase());
+    
+    function showDetected(keyword) {
         console.log("Emergency keyword detected: " + keyword);
         
         const voiceStatus = document.getElementById('voice-status');
@@ -165,9 +108,13 @@ def insert_voice_js():
             voiceStatus.style.color = '#721c24';
             voiceStatus.innerHTML = `<strong>EMERGENCY DETECTED: "${keyword}"</strong><br>Triggering SOS...`;
         }
+    }
+    
+    function triggerSOSDirectly(keyword) {
+        showDetected(keyword);
         
-        if (typeof window.triggerEmergencyDirectly === 'function') {
-            window.triggerEmergencyDirectly(keyword);
+        if (typeof window.parent.triggerEmergencyDirectly === 'function') {
+            window.parent.triggerEmergencyDirectly(keyword);
         } else {
             localStorage.setItem('sos_voice_trigger', keyword);
             localStorage.setItem('sos_voice_time', new Date().getTime());
@@ -198,16 +145,10 @@ def insert_voice_js():
                 recognition.interimResults = true;
                 recognition.maxAlternatives = 3;
                 
-                // Keywords with more variations
-                const keywords = {
-                    'en-US': ['help', 'emergency', 'sos', 'danger', 'accident', 'save me', 'help me'],
-                    'hi-IN': ['मदद', 'आपातकाल', 'खतरा', 'बचाओ', 'सहायता', 'मुझे बचाओ'],
-                    'ta-IN': ['உதவி', 'அவசரம்', 'ஆபத்து', 'காப்பாற்று', 'என்னை காப்பாற்று']
-                };
-
                 const languages = ['en-US', 'hi-IN', 'ta-IN'];
                 let currentLanguageIndex = 0;
                 let isProcessing = false;
+                let lastScanTime = 0;
 
                 function updateStatus(message, type = 'info') {
                     if (voiceStatus) {
@@ -221,7 +162,7 @@ def insert_voice_js():
                     if (isProcessing) return;
                     
                     recognition.lang = languages[currentLanguageIndex];
-                    currentLanguageIndex = (currentLanguageIndex + 1) % languages.length;
+                    currentLanguageIndex = (currentLanguageIndex + 1) %% languages.length;
                     
                     const langName = recognition.lang === 'en-US' ? 'English' : 
                                     recognition.lang === 'hi-IN' ? 'Hindi' : 'Tamil';
@@ -241,22 +182,48 @@ def insert_voice_js():
                     console.log('Recognition started for', recognition.lang);
                 };
 
+                function matchLocally(transcripts) {
+                    for (const transcript of transcripts) {
+                        const text = transcript.normalize('NFC').toLowerCase();
+                        const keyword = allKeywords.find(k => text.includes(k));
+                        if (keyword) return keyword;
+                    }
+                    return null;
+                }
+                
+                function scanTranscripts(transcripts) {
+                    const fallback = () => {
+                        const keyword = matchLocally(transcripts);
+                        if (keyword) triggerSOSDirectly(keyword);
+                    };
+                    // The sidecar matches every language at once and
+                    // triggers the alert itself when a keyword is found
+                    if (typeof window.parent.scanTranscripts !== 'function') {
+                        fallback();
+                        return;
+                    }
+                    window.parent.scanTranscripts(transcripts)
+                        .then(keyword => { if (keyword) showDetected(keyword); })
+                        .catch(fallback);
+                }
+                
                 recognition.onresult = (event) => {
+                    const transcripts = [];
+                    let hasFinal = false;
                     for (let i = event.resultIndex; i < event.results.length; i++) {
                         const result = event.results[i];
-                        if (result.isFinal) {
-                            const transcript = result[0].transcript.toLowerCase();
-                            console.log('Recognized:', transcript);
-                            
-                            const currentKeywords = keywords[recognition.lang];
-                            for (const keyword of currentKeywords) {
-                                if (transcript.includes(keyword.toLowerCase())) {
-                                    triggerSOSDirectly(keyword);
-                                    return;
-                                }
-                            }
+                        hasFinal = hasFinal || result.isFinal;
+                        for (let j = 0; j < result.length; j++) {
+                            transcripts.push(result[j].transcript);
                         }
                     }
+                    console.log('Recognized:', transcripts);
+                    
+                    // Interim results are sent at most every 300 ms, final ones straight away
+                    const now = Date.now();
+                    if (!hasFinal && now - lastScanTime < 300) return;
+                    lastScanTime = now;
+                    scanTranscripts(transcripts);
                 };
 
                 recognition.onend = () => {
@@ -297,7 +264,13 @@ def insert_voice_js():
     setTimeout(setupVoiceRecognition, 500);
     </script>
     """
-    components.html(html, height=150)
+    keywords = {language: list(phrases) for language, phrases in DEFAULT_KEYWORDS.items()}
+    keywords['custom'] = list(custom_keywords)
+    return html % {'keywords': json.dumps(keywords, ensure_ascii=False)}
+
+def insert_voice_js():
+    # The same HTML on every rerun keeps the iframe, and the listener in it, alive
+    components.html(voice_js_html(tuple(st.session_state.custom_keywords)), height=150)
 # In your main app logic
 def check_voice_trigger_source():
     """Check if a voice trigger source exists in localStorage"""
@@ -318,6 +291,11 @@ def check_voice_emergency():
 
 # Function to embed and play siren audio
 def play_siren_audio():
+    """
+    Play the siren from the sidecar's cached asset endpoint. The page only
+    carries the URL; the browser caches the audio and streams it with Range
+    requests instead of receiving a base64 copy on every rerun.
+    """
     audio_html = """
     <div class="siren-active">
         <strong>🚨 EMERGENCY SIREN ACTIVE 🚨</strong>
@@ -325,7 +303,11 @@ def play_siren_audio():
     <script>
         document.addEventListener('DOMContentLoaded', function() {{
             try {{
-                const audioElement = new Audio('data:audio/mpeg;base64,{0}');
+                // Use the low-bitrate copy on slow or data-saving connections
+                const sirenUrls = {0};
+                const connection = navigator.connection || {{}};
+                const slow = connection.saveData || ['slow-2g', '2g', '3g'].includes(connection.effectiveType);
+                const audioElement = new Audio(slow ? sirenUrls.low : sirenUrls.full);
                 audioElement.volume = 0.8;  // Set volume to 80%
                 audioElement.loop = true;   // Loop the audio
                 
@@ -358,84 +340,105 @@ def play_siren_audio():
     </script>
     """
     
-    # Try to load siren from file
-    try:
-        with open("siren.mp3", "rb") as f:
-            audio_bytes = f.read()
-            audio_b64 = base64.b64encode(audio_bytes).decode()
-            components.html(audio_html.format(audio_b64), height=80)
-            return True
-    except Exception as e:
-        # Fallback to visual alert only if audio fails
-        fallback_html = """
-        <div class="siren-active" style="padding: 20px; font-size: 18px;">
-            <strong>🚨 EMERGENCY ALERT ACTIVE 🚨</strong>
-        </div>
-        """
-        components.html(fallback_html, height=80)
-        st.warning(f"Using visual alert only. Could not load siren audio: {e}")
-        return False
+    if assets.siren is not None and sidecar.ensure_started() is not None:
+        with span('siren_render'):
+            components.html(audio_html.format(assets.siren_urls_js()), height=80)
+        return True
+    
+    # Fallback to visual alert only if audio is unavailable
+    fallback_html = """
+    <div class="siren-active" style="padding: 20px; font-size: 18px;">
+        <strong>🚨 EMERGENCY ALERT ACTIVE 🚨</strong>
+    </div>
+    """
+    components.html(fallback_html, height=80)
+    st.warning("Using visual alert only. Could not load siren audio.")
+    return False
 
 
-# Fixed hard-coded location
-def get_location():
+def get_location(wait=True):
     """
-    Simulate a more realistic location fetching process
-    with dynamic coordinates and address
+    Current location from this session's track: the smoothed best fix the
+    browser has uploaded, or the default location until the first fix arrives.
+    Reading it never waits on the browser; without wait, it doesn't wait on
+    the network for the address either.
     """
-    # Base coordinates for Delhi with some randomization
-    base_latitude = 28.5796481
-    base_longitude = 76.9759274
-    
-    # Add small random variation to make location more dynamic
-    latitude = base_latitude + random.uniform(-0.05, 0.05)
-    longitude = base_longitude + random.uniform(-0.05, 0.05)
-    
-    # Simulate location fetching delay
-    with st.spinner("Fetching precise location..."):
-        time.sleep(2)  # 2-second delay to simulate fetching
+    with span('get_location'):
+        return current_location(st.session_state.session_id, wait=wait)
+
+@functools.lru_cache(maxsize=1024)
+def location_tracker_html(sidecar_url, session_id):
+    """Hidden component that watches the device position and uploads fixes in batches"""
+    return """
+    <script>
+    const SIDECAR_URL = %(sidecar_url)s;
+    const SESSION_ID = %(session_id)s;
+    const FLUSH_MS = %(flush_ms)d;
+    let pending = [];
+    let sentFirst = false;
     
-    # Try to get a more precise address using reverse geocoding
-    try:
-        url = f"https://nominatim.openstreetmap.org/reverse?format=jsonv2&lat={latitude}&lon={longitude}"
-        response = requests.get(url, headers={'User-Agent': 'SOSEmergencyApp/1.0'})
-        
-        if response.status_code == 200:
-            location_data = response.json()
-            formatted_address = location_data.get('display_name', 'National Highways Authority of India, Dabri, Sector 10 Dwarka, Dwarka, New Delhi, Delhi 110075, India')
-        else:
-            formatted_address = 'National Highways Authority of India, Dabri, Sector 10 Dwarka, Dwarka, New Delhi, Delhi 110075, India'
-    except:
-        formatted_address = 'National Highways Authority of India, Dabri, Sector 10 Dwarka, Dwarka, New Delhi, Delhi 110075, India'
+    function payload() {
+        const body = JSON.stringify({session_id: SESSION_ID, fixes: pending});
+        pending = [];
+        return body;
+    }
     
-    # Create Google Maps link with precise coordinates
-    maps_link = f"https://maps.google.com/?q={latitude},{longitude}"
+    function flush() {
+        if (!pending.length) return;
+        fetch(SIDECAR_URL + '/locations', {
+            method: 'POST',
+            headers: {'Content-Type': 'text/plain'},
+            body: payload(),
+            keepalive: true
+        }).catch(error => console.error('Location upload failed:', error));
+    }
     
+    if (navigator.geolocation) {
+        navigator.geolocation.watchPosition(
+            position => {
+                pending.push([position.timestamp / 1000, position.coords.latitude,
+                              position.coords.longitude, position.coords.accuracy]);
+                // Send the first fix straight away so an alert never uses the default location
+                if (!sentFirst) {
+                    sentFirst = true;
+                    flush();
+                }
+            },
+            error => console.error('Location unavailable:', error.message),
+            {enableHighAccuracy: true, maximumAge: 5000, timeout: 20000}
+        );
+        setInterval(flush, FLUSH_MS);
+        window.parent.addEventListener('pagehide', () => {
+            if (pending.length) navigator.sendBeacon(SIDECAR_URL + '/locations', payload());
+        });
+    }
+    </script>
+    """ % {
+        'sidecar_url': sidecar_url,
+        'session_id': json.dumps(session_id),
+        'flush_ms': int(FLUSH_SECONDS * 1000),
+    }
+
+def add_location_tracker_component():
+    components.html(location_tracker_html(sidecar.public_url_js(), st.session_state.session_id), height=0)
+
+def twilio_credentials():
+    """Snapshot the Twilio settings so they can be used outside the script thread"""
     return {
-        'latitude': round(latitude, 6),
-        'longitude': round(longitude, 6),
-        'address': formatted_address,
-        'google_maps_link': maps_link
+        'twilio_account_sid': st.session_state.twilio_account_sid,
+        'twilio_auth_token': st.session_state.twilio_auth_token,
+        'twilio_phone_number': st.session_state.twilio_phone_number
     }
 
 def send_emergency_sms(to_number, message):
     """Send emergency SMS using Twilio"""
     try:
-        if not st.session_state.twilio_account_sid or not st.session_state.twilio_auth_token or not st.session_state.twilio_phone_number:
+        credentials = twilio_credentials()
+        if credentials_missing(credentials):
             st.error("Twilio credentials are missing. Please configure them in settings.")
             return False
-            
-        client = Client(st.session_state.twilio_account_sid, st.session_state.twilio_auth_token)
-        
-        # Create a simple message with no formatting that might cause issues
-        clean_message = message.replace('\n', ' ').strip()
-        
-        message = client.messages.create(
-            body=clean_message,
-            from_=st.session_state.twilio_phone_number,
-            to=to_number
-        )
-        
+
+        send_sms(credentials, to_number, message)
         return True
     except Exception as e:
         st.error(f"Error sending SMS: {e}")
@@ -444,119 +447,147 @@ def send_emergency_sms(to_number, message):
 def make_emergency_call(to_number, message):
     """Make emergency call using Twilio"""
     try:
-        if not st.session_state.twilio_account_sid or not st.session_state.twilio_auth_token or not st.session_state.twilio_phone_number:
+        credentials = twilio_credentials()
+        if credentials_missing(credentials):
             st.error("Twilio credentials are missing. Please configure them in settings.")
             return False
-            
-        client = Client(st.session_state.twilio_account_sid, st.session_state.twilio_auth_token)
-        
-        # Creating TwiML for the call with repeated message - simpler version
-        twiml = f"""
-        <?xml version="1.0" encoding="UTF-8"?>
-        <Response>
-            <Say voice="woman" language="en-US">Emergency alert. {message}</Say>
-            <Pause length="1"/>
-            <Say voice="woman" language="en-US">This is an automated emergency call. Please respond immediately.</Say>
-            <Pause length="1"/>
-            <Redirect/>
-        </Response>
-        """
-        
-        call = client.calls.create(
-            twiml=twiml,
-            from_=st.session_state.twilio_phone_number,
-            to=to_number
-        )
-        
+
+        place_call(credentials, to_number, message)
         return True
     except Exception as e:
         st.error(f"Error making call: {e}")
         return False
 
-def add_voice_trigger_component():
-    """Add a hidden component that can trigger SOS without page reload"""
-    from streamlit.components.v1 import html
-    
-    component_html = """
+@functools.lru_cache(maxsize=1024)
+def voice_trigger_html(sidecar_url, session_id):
+    """Hidden trigger component for one session, built once"""
+    return """
     <div id="voice-trigger-component" style="display:none;"></div>
     <script>
-    // Store the last message to prevent duplicates
-    let lastMessage = '';
-    
-    // This function will be called by the voice recognition code
-    window.triggerEmergencyDirectly = function(keyword) {
-        // Create a unique message
-        const message = keyword + '_' + new Date().getTime();
-        if (message === lastMessage) return; // Prevent duplicates
-        lastMessage = message;
-        
-        // Create a form to submit
-        const form = document.createElement('form');
-        form.method = 'POST';
-        form.action = '';
-        
-        // Add the keyword as a hidden field
-        const input = document.createElement('input');
-        input.type = 'hidden';
-        input.name = 'voice_keyword';
-        input.value = keyword;
-        form.appendChild(input);
-        
-        // Add a flag to identify this is an emergency
-        const flag = document.createElement('input');
-        flag.type = 'hidden';
-        flag.name = 'emergency_trigger';
-        flag.value = 'true';
-        form.appendChild(flag);
+    const SIDECAR_URL = %(sidecar_url)s;
+    const SESSION_ID = %(session_id)s;
+    
+    // Ignore repeats of the same keyword while a trigger is in flight
+    let lastTriggerTime = 0;
+    
+    // Fallback: hand the trigger to the app through the URL (full rerun)
+    function triggerThroughPage(keyword) {
+        const url = new URL(window.parent.location.href);
+        url.searchParams.set('voice_triggered', 'true');
+        url.searchParams.set('voice_keyword', keyword);
+        window.parent.location.href = url.toString();
+    }
+    
+    // Send speech results to the server-side keyword engine; resolves to the
+    // matched keyword (the server has already triggered) or null
+    window.parent.scanTranscripts = function(transcripts) {
+        return fetch(SIDECAR_URL + '/transcripts', {
+            method: 'POST',
+            headers: {'Content-Type': 'text/plain'},
+            body: JSON.stringify({session_id: SESSION_ID, transcripts: transcripts})
+        })
+            .then(response => {
+                if (!response.ok) throw new Error('HTTP ' + response.status);
+                return response.json();
+            })
+            .then(result => result.keyword);
+    };
+    
+    // Called by the voice recognition component in the sibling iframe.
+    // Posts to the sidecar trigger endpoint, which acknowledges immediately
+    // and starts dispatch on the server; text/plain avoids a CORS preflight.
+    window.parent.triggerEmergencyDirectly = function(keyword) {
+        const now = Date.now();
+        if (now - lastTriggerTime < 5000) return;
+        lastTriggerTime = now;
         
-        // Add to document and submit
-        document.body.appendChild(form);
-        form.submit();
+        fetch(SIDECAR_URL + '/trigger', {
+            method: 'POST',
+            headers: {'Content-Type': 'text/plain'},
+            body: JSON.stringify({session_id: SESSION_ID, keyword: keyword, source: 'voice'}),
+            keepalive: true
+        })
+            .then(response => {
+                if (!response.ok) throw new Error('HTTP ' + response.status);
+                return response.json();
+            })
+            .then(ack => console.log('SOS trigger acknowledged:', ack.incident_id))
+            .catch(error => {
+                console.error('Trigger endpoint unavailable, reloading instead:', error);
+                triggerThroughPage(keyword);
+            });
     };
     </script>
-    """
-    
-    html(component_html, height=0)
+    """ % {
+        'sidecar_url': sidecar_url,
+        'session_id': json.dumps(session_id),
+    }
 
+def add_voice_trigger_component():
+    """Add a hidden component that can trigger SOS without page reload"""
+    components.html(voice_trigger_html(sidecar.public_url_js(), st.session_state.session_id), height=0)
+
+def get_contacts():
+    """Emergency contacts for this session, highest priority (lowest number) first"""
+    return normalize_contacts(st.session_state.emergency_contacts)
 
 def trigger_sos(trigger_type="button"):
-    """Trigger SOS alert with all emergency actions in specified sequence"""
+    """Trigger SOS alert, fanning out calls and SMS to every emergency contact at once"""
+    trace_token = None
     with st.spinner("🚨 Activating SOS emergency response..."):
         try:
-            # Get hardcoded location
             location = get_location()
             
+            # Open the incident in the server-side registry; if a voice trigger
+            # already started one through the sidecar, or another tab or
+            # replica is handling one for this user, follow it instead of
+            # dispatching a second round
+            incident, created = get_trigger_registry().start(
+                st.session_state.session_id,
+                st.session_state.get('trigger_source', "SOS Button"),
+                st.session_state.get('incident_id'),
+                user_id=st.session_state.profile_id)
+            st.session_state.incident_id = incident['incident_id']
+            if incident['duplicate'] or (not created and incident['delivery_status']):
+                st.session_state.sos_triggered_action_completed = True
+                return False, False, location
+            # Spans recorded while dispatching carry the incident id as their trace id
+            trace_token = current_trace_id.set(incident['incident_id'])
+            record_alert(incident['source'])
+            
             # Prepare emergency message for call and SMS
-            call_message = (
-                f"{st.session_state.user_name} needs immediate assistance. "
-                f"Location: {location['address']}. "
-                f"Coordinates: {location['latitude']}, {location['longitude']}"
-            )
-            sms_message = (
-                f"EMERGENCY SOS ALERT! {st.session_state.user_name} needs immediate help. "
-                f"Location: {location['address']}. "
-                f"Google Maps: {location['google_maps_link']}"
-            )
+            call_message, sms_message = build_messages(st.session_state.user_name, location)
             
-            # 1. First make emergency call with 2 second delay
-            st.info("Step 1: Initiating emergency call...")
-            time.sleep(2)  # 2 second delay
-            call_made = make_emergency_call(
-                st.session_state.emergency_contact,
-                call_message
-            )
+            credentials = twilio_credentials()
+            if credentials_missing(credentials):
+                st.error("Twilio credentials are missing. Please configure them in settings.")
+                st.session_state.sos_triggered_action_completed = True
+                return False, False, location
             
-            # 2. Then send SMS with 3 second delay
-            st.info("Step 2: Sending emergency SMS...")
-            time.sleep(2)  # 3 second delay
-            sms_sent = send_emergency_sms(
-                st.session_state.emergency_contact, 
-                sms_message
-            )
+            contacts = get_contacts()
+            if not contacts:
+                st.error("No emergency contacts configured. Please add them in settings.")
+                st.session_state.sos_triggered_action_completed = True
+                return False, False, location
             
-            # 3. Play siren with 3 second delay (this will be handled in the main code)
-            st.info("Step 3: Activating emergency siren...")
-            time.sleep(1)  # 3 second delay
+            incident['delivery_status'] = delivery_status = new_delivery_status(contacts)
+            progress = st.progress(0.0, text=f"Alerting {len(contacts)} emergency contact(s)...")
+            status_table = st.empty()
+            sms_sent = call_made = False
+            # Every alert goes through the durable outbox; contacts are alerted
+            # in parallel, highest priority first, and each result is reported
+            # as soon as it arrives instead of waiting for the slowest channel
+            total = 2 * len(contacts)
+            follow = (st.session_state.session_id, st.session_state.user_name)
+            for done, result in enumerate(dispatch_incident(st.session_state.incident_id, credentials, contacts,
+                                                            call_message, sms_message, location, follow),
+                                          start=1):
+                update_delivery_status(delivery_status, result)
+                sms_sent = sms_sent or (result.channel == 'sms' and result.ok)
+                call_made = call_made or (result.channel == 'call' and result.ok)
+                progress.progress(min(1.0, done / total), text=f"{done}/{total} alerts handed to Twilio")
+                status_table.table(list(delivery_status.values()))
+            incident['completed'] = True
             
             # Mark as completed to prevent duplicate calls
             st.session_state.sos_triggered_action_completed = True
@@ -565,11 +596,49 @@ def trigger_sos(trigger_type="button"):
         except Exception as e:
             st.error(f"Error during SOS process: {e}")
             return False, False, get_location()
+        finally:
+            if trace_token is not None:
+                current_trace_id.reset(trace_token)
+
+def register_trigger_session(location):
+    """
+    Share this session's settings and location with the sidecar trigger
+    endpoints. Runs at the end of the Settings fragment so edits are
+    included as soon as they are made.
+    """
+    get_keyword_spotter().set_custom_keywords(st.session_state.profile_id,
+                                              st.session_state.custom_keywords)
+    get_trigger_registry().register_session(st.session_state.session_id, {
+        'profile_id': st.session_state.profile_id,
+        'user_name': st.session_state.user_name,
+        'credentials': twilio_credentials(),
+        'contacts': get_contacts(),
+        'location': location,
+    })
+
+def adopt_server_incident():
+    """Switch to the emergency view if the sidecar started an incident since the last rerun"""
+    # Runs on every panel refresh, which also shows the registry the page is still open
+    get_trigger_registry().touch(st.session_state.session_id)
+    incident = get_trigger_registry().incident(st.session_state.session_id)
+    if incident is not None and not st.session_state.sos_triggered:
+        st.session_state.sos_triggered = True
+        st.session_state.sos_triggered_action_completed = True
+        st.session_state.trigger_source = incident['source']
+        st.session_state.incident_id = incident['incident_id']
 
 # Initialize session state variables
 if 'initialized' not in st.session_state:
+    # Each user has their own profile, chosen with ?profile=<id> in the URL
+    st.session_state.profile_id = st.query_params.get('profile', DEFAULT_PROFILE)
+    
     # Load saved credentials
-    credentials = load_credentials()
+    credentials = load_credentials(st.session_state.profile_id)
+    # A saved profile only opens with its access key (&key=<access key> in the URL)
+    if not access_allowed(credentials, st.query_params.get('key')):
+        st.error("This profile is protected. Open it with the bookmarked link that includes its access key.")
+        st.stop()
+    st.session_state.access_key_hash = credentials.get('access_key_hash', "")
     
     # Set session state variables from loaded credentials or defaults
     st.session_state.sos_triggered = False
@@ -578,10 +647,27 @@ if 'initialized' not in st.session_state:
     st.session_state.twilio_account_sid = credentials.get('twilio_account_sid', "")
     st.session_state.twilio_auth_token = credentials.get('twilio_auth_token', "")
     st.session_state.twilio_phone_number = credentials.get('twilio_phone_number', "")
-    st.session_state.emergency_contact = credentials.get('emergency_contact', "")
+    # Older settings files only have a single emergency_contact
+    contacts = credentials.get('emergency_contacts')
+    if contacts is None and credentials.get('emergency_contact'):
+        contacts = [{'name': "", 'number': credentials['emergency_contact'], 'priority': 1}]
+    st.session_state.emergency_contacts = normalize_contacts(contacts or [])
     st.session_state.user_name = credentials.get('user_name', "User")
+    st.session_state.custom_keywords = credentials.get('custom_keywords', [])
+    
+    # Open the Twilio connection now so the first alert doesn't pay for the handshake
+    get_twilio_pool().warm_up(twilio_credentials())
+    # Let the outbox worker resume alerts left pending for this account
+    register_credentials(twilio_credentials())
+    get_outbox()
+    # Rebuild escalation timers left by a previous process
+    get_escalator()
+    
+    # Identifies this browser session to the sidecar trigger endpoint
+    st.session_state.session_id = uuid.uuid4().hex
     
     st.session_state.initialized = True
+startup.checkpoint('session_init')
 
 # Process form submissions from JavaScript
 if 'voice_detected' in st.session_state:
@@ -608,10 +694,14 @@ if st.query_params:
             # Reset the action completion flag to ensure the flow runs
             st.session_state.sos_triggered_action_completed = False
     
-    # Clear query parameters to prevent reprocessing
-    st.query_params.clear()
+    # Clear the trigger parameters to prevent reprocessing, keeping the profile
+    for param in ("voice_triggered", "voice_keyword"):
+        if param in st.query_params:
+            del st.query_params[param]
 
 add_voice_trigger_component()
+add_location_tracker_component()
+startup.checkpoint('components')
 # Add main page content
 # Main app layout
 st.markdown("<div class='header-section'><h1 class='title'>🆘 Emergency SOS Alert System</h1></div>", unsafe_allow_html=True)
@@ -619,30 +709,20 @@ st.markdown("<div class='header-section'><h1 class='title'>🆘 Emergency SOS Al
 # Check voice emergency
 check_voice_emergency()
 
-# App tabs
-tab1, tab2 = st.tabs(["SOS Alert", "Settings"])
+# The SOS panel and Settings are fragments: their widgets rerun only their own
+# fragment, so a Settings edit doesn't rebuild the page, re-geocode or reload
+# the voice listener. The SOS panel also refreshes itself to pick up incidents
+# started by the sidecar and their delivery progress.
+def rerun_panel():
+    """Rerun only the calling fragment during a fragment rerun, the whole app otherwise"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
-with tab1:
-    st.markdown("<div class='container'>", unsafe_allow_html=True)
-    
-    # Show location status with hardcoded location
-    st.subheader("Location Status")
-    location = get_location()
-    st.success(f"Location: {location['address']}")
-    st.info(f"Coordinates: {location['latitude']}, {location['longitude']}")
-    st.info(f"Google Maps: {location['google_maps_link']}")
-    
-    st.subheader("Voice Monitoring Status")
-    insert_voice_js()
-    
-
-    # Show active monitoring indicator
-    st.markdown("""
-    <div class="listening-indicator">
-        <span class="mic-icon">🎤</span>
-        <span>Always listening for emergency keywords in English, Hindi, and Tamil</span>
-    </div>
-    """, unsafe_allow_html=True)
+@st.fragment(run_every=SOS_PANEL_REFRESH)
+def sos_panel():
+    adopt_server_incident()
     
     # Single consistent UI for both trigger methods
     if not st.session_state.sos_triggered:
@@ -655,7 +735,7 @@ with tab1:
             st.session_state.sos_triggered = True
             st.session_state.trigger_source = st.session_state.get('trigger_source', "SOS Button")
             st.session_state.sos_triggered_action_completed = False
-            st.rerun()
+            rerun_panel()
     else:
          # Show emergency state (same UI regardless of trigger method)
         # First check if the emergency sequence has been run
@@ -665,25 +745,48 @@ with tab1:
             
             # Run the unified emergency sequence
             sms_sent, call_made, location = trigger_sos()
+            st.session_state.location = location
             
             # Play the siren
-            siren_played = play_siren_audio()
+            play_siren_audio()
             
             # Force a rerun to update UI
-            st.rerun()
+            rerun_panel()
         else:
-            # Show ongoing emergency info (same for both button and voice)
-            st.success("SOS alert has been triggered. Help is on the way!")
+            # Per-contact delivery from the outbox, updated by Twilio's status
+            # callbacks when they are configured
+            incident = get_trigger_registry().incident(st.session_state.session_id)
+            level, message, rows = panel_status(incident)
+            getattr(st, level)(message)
             
             # Show what triggered the alert
             if hasattr(st.session_state, 'trigger_source'):
                 st.info(f"Triggered by: {st.session_state.trigger_source}")
             
+            if incident is not None:
+                if incident['duplicate']:
+                    st.info("An alert for this profile was already in progress, so no new calls or messages were sent.")
+                if incident['error']:
+                    st.error(incident['error'])
+                if rows:
+                    st.table(rows)
+                escalation = get_escalator().status(incident['incident_id'])
+                if escalation is not None and escalation[0] == 'active':
+                    step_text = {'call_again': "calling unanswered contacts again",
+                                 'sms_again': "re-sending the SMS",
+                                 'widen': "alerting the escalation contacts"}[escalation[1]]
+                    st.caption(f"No one has answered yet: {step_text} in {escalation[2]:.0f} s")
+                live = get_live_updates().status(incident['incident_id'])
+                if live is not None:
+                    updates, sent_at = live
+                    st.caption(f"Sharing your live location with your contacts: {updates} update(s) sent, "
+                               f"last {max(0, int(time.time() - sent_at))} s ago")
+            
             # Play the siren
-            siren_played = play_siren_audio()
+            play_siren_audio()
             
-            # Show location info
-            location = get_location()
+            # Show the location the alert was sent with
+            location = st.session_state.location
             st.info(f"Location: {location['address']}")
             st.info(f"Google Maps: {location['google_maps_link']}")
             
@@ -692,36 +795,70 @@ with tab1:
                 st.session_state.sos_triggered = False
                 st.session_state.voice_trigger_detected = False
                 st.session_state.sos_triggered_action_completed = False
+                st.session_state.incident_id = None
+                get_trigger_registry().clear(st.session_state.session_id)
                 if hasattr(st.session_state, 'trigger_source'):
                     delattr(st.session_state, 'trigger_source')
-                st.rerun()
-    
-    st.markdown("</div>", unsafe_allow_html=True)
+                rerun_panel()
 
-with tab2:
+@st.fragment
+def settings_panel():
+    with span('settings_fragment'):
+        render_settings()
+        register_trigger_session(st.session_state.location)
+
+def render_settings():
     st.markdown("<div class='settings-container'>", unsafe_allow_html=True)
     st.subheader("User Information")
+    st.caption(f"Profile: {st.session_state.profile_id}")
     
     # User info
     user_name = st.text_input("Your Name", value=st.session_state.user_name)
     if user_name != st.session_state.user_name:
         st.session_state.user_name = user_name
     
-    emergency_contact = st.text_input("Emergency Contact Number (with country code)", value=st.session_state.emergency_contact, 
-                                   placeholder="+1234567890")
-    if emergency_contact != st.session_state.emergency_contact:
-        st.session_state.emergency_contact = emergency_contact
+    st.markdown("Emergency Contacts (with country code; priority 1 is alerted first)")
+    if 'contacts_editor_data' not in st.session_state:
+        # pandas is imported here rather than at startup so the SOS tab paints first
+        import pandas as pd
+        # The contacts editor edits a fixed copy; its output replaces emergency_contacts
+        st.session_state.contacts_editor_data = pd.DataFrame(st.session_state.emergency_contacts,
+                                                             columns=['name', 'number', 'priority'])
+    edited_contacts = st.data_editor(
+        st.session_state.contacts_editor_data,
+        num_rows="dynamic",
+        use_container_width=True,
+        key="contacts_editor",
+        column_config={
+            'name': st.column_config.TextColumn("Name"),
+            'number': st.column_config.TextColumn("Phone Number", help="e.g. +1234567890"),
+            'priority': st.column_config.NumberColumn("Priority", min_value=1, step=1),
+        },
+    )
+    st.session_state.emergency_contacts = normalize_contacts(edited_contacts.to_dict('records'))
+    
+    # Extra trigger phrases on top of the built-in English, Hindi and Tamil ones
+    with st.expander("Custom Voice Keywords"):
+        custom_keywords = st.text_area("Additional emergency keywords (one per line, any language)",
+                                       value="\n".join(st.session_state.custom_keywords))
+        custom_keywords = [line.strip() for line in custom_keywords.splitlines() if line.strip()]
+        if custom_keywords != st.session_state.custom_keywords:
+            st.session_state.custom_keywords = custom_keywords
     
     # API Settings with expanders
     with st.expander("Twilio API Settings"):
         twilio_account_sid = st.text_input("Twilio Account SID", value=st.session_state.twilio_account_sid, 
                                         type="password")
         if twilio_account_sid != st.session_state.twilio_account_sid:
+            get_twilio_pool().invalidate(st.session_state.twilio_account_sid)
             st.session_state.twilio_account_sid = twilio_account_sid
         
-        twilio_auth_token = st.text_input("Twilio Auth Token", value=st.session_state.twilio_auth_token, 
-                                       type="password")
-        if twilio_auth_token != st.session_state.twilio_auth_token:
+        # The stored token is never sent back to the browser; typing a new one replaces it
+        twilio_auth_token = st.text_input("Twilio Auth Token", type="password",
+                                          placeholder="Saved; type a new token to replace it"
+                                          if st.session_state.twilio_auth_token else "")
+        if twilio_auth_token and twilio_auth_token != st.session_state.twilio_auth_token:
+            get_twilio_pool().invalidate(st.session_state.twilio_account_sid)
             st.session_state.twilio_auth_token = twilio_auth_token
         
         twilio_phone_number = st.text_input("Twilio Phone Number", value=st.session_state.twilio_phone_number, 
@@ -731,24 +868,86 @@ with tab2:
     
     # Siren audio upload
     with st.expander("Emergency Siren Settings"):
-        st.info("Upload an MP3 file named 'siren.mp3' to your Streamlit app folder to enable the emergency siren.")
+        st.info("Upload an MP3 file named 'siren.mp3' to your Streamlit app folder and restart the app to enable the emergency siren.")
         
-        # Check if siren file exists
-        siren_exists = os.path.exists("siren.mp3")
-        if siren_exists:
+        # The siren is loaded once when the app starts
+        if assets.siren is not None:
             st.success("Siren audio file found and ready to use!")
         else:
             st.warning("No siren.mp3 file found. Please upload one to enable the siren feature.")
     
+    # Past incidents of this profile, newest first, from the incident log
+    incident_log = get_incident_log()
+    if incident_log is not None:
+        with st.expander("Incident History"):
+            incidents = incident_log.incidents(st.session_state.profile_id)
+            if incidents:
+                st.table([incident_summary(incident_id, records) for incident_id, records in incidents])
+            else:
+                st.info("No incidents yet.")
+    
     # Save settings button
     if st.button("Save Settings", use_container_width=True):
         if save_credentials():
+            get_twilio_pool().warm_up(twilio_credentials())
+            register_credentials(twilio_credentials())
             st.success("Settings saved successfully and will be remembered when you restart the app!")
         else:
             st.error("Failed to save settings permanently. They will work for this session only.")
     
     st.markdown("</div>", unsafe_allow_html=True)
 
+@st.fragment(run_every=SOS_PANEL_REFRESH)
+def location_status():
+    location = st.session_state.location = get_location(wait=False)
+    st.success(f"Location: {location['address']}")
+    st.info(f"Coordinates: {location['latitude']}, {location['longitude']}")
+    if location['fixed_at'] is None:
+        st.warning("Waiting for this device's location; allow location access in the browser.")
+    else:
+        age = max(0, int(time.time() - location['fixed_at']))
+        st.caption(f"Accuracy ±{location['accuracy']} m, updated {age} s ago")
+    st.info(f"Google Maps: {location['google_maps_link']}")
+    nearby = nearby_help(location)
+    if nearby:
+        st.info(f"Nearest help: {nearby}")
+
+# App tabs
+tab1, tab2 = st.tabs(["SOS Alert", "Settings"])
+
+with tab1:
+    st.markdown("<div class='container'>", unsafe_allow_html=True)
+    
+    # Location from the browser's uploaded fixes, refreshed on its own
+    st.subheader("Location Status")
+    location_status()
+    startup.checkpoint('location_status')
+    
+    st.subheader("Voice Monitoring Status")
+    insert_voice_js()
+    
+
+    # Show active monitoring indicator
+    st.markdown("""
+    <div class="listening-indicator">
+        <span class="mic-icon">🎤</span>
+        <span>Always listening for emergency keywords in English, Hindi, and Tamil</span>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    sos_panel()
+    startup.checkpoint('sos_panel')
+    
+    st.markdown("</div>", unsafe_allow_html=True)
+
+with tab2:
+    settings_panel()
+startup.checkpoint('settings_panel')
+
+rerun_duration.observe(time.perf_counter() - rerun_started)
+profiler.finish_run()
+startup.finish_first_render()
+
 
 # Modify your main Streamlit app to include these functions
 def main_sos_app():
@@ -767,4 +966,4 @@ def main_sos_app():
         st.rerun()
 
 # You would call this in your main app script
-# main_sos_app()
\ No newline at end of file
+# main_sos_app()
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import re
+from email.utils import formatdate
+
+import sidecar
+
+SIREN_FILE = "siren.mp3"
+# Optional low-bitrate mono copy for clients on slow connections, e.g.
+#   ffmpeg -i siren.mp3 -ac 1 -b:a 48k siren_low.mp3
+SIREN_LOW_FILE = "siren_low.mp3"
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+APP_CSS = """
+    .main {
+        background-color: #f8f9fa;
+    }
+    .sos-button {
+        background-color: #dc3545;
+        color: white;
+        border: none;
+        border-radius: 50%;
+        width: 200px;
+        height: 200px;
+        font-size: 32px;
+        font-weight: bold;
+        cursor: pointer;
+        box-shadow: 0 8px 16px rgba(0,0,0,0.2);
+        transition: transform 0.3s, box-shadow 0.3s;
+        margin: 0 auto;
+        display: block;
+    }
+    .sos-button:hover {
+        transform: scale(1.05);
+        box-shadow: 0 12px 20px rgba(0,0,0,0.3);
+    }
+    .title {
+        text-align: center;
+        color: #343a40;
+        margin-bottom: 30px;
+    }
+    .container {
+        display: flex;
+        flex-direction: column;
+        align-items: center;
+        justify-content: center;
+        padding: 30px;
+    }
+    .settings-container {
+        margin-top: 40px;
+        padding: 20px;
+        border-radius: 10px;
+        background-color: #ffffff;
+        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
+        width: 100%;
+    }
+    .header-section {
+        padding: 20px;
+        background-color: #dc3545;
+        color: white;
+        border-radius: 10px;
+        margin-bottom: 30px;
+    }
+    .footer {
+        margin-top: 50px;
+        text-align: center;
+        color: #6c757d;
+        font-size: 14px;
+    }
+    .listening-indicator {
+        display: flex;
+        align-items: center;
+        justify-content: center;
+        gap: 10px;
+        margin: 20px 0;
+    }
+    .mic-icon {
+        color: #dc3545;
+        font-size: 24px;
+        animation: pulse 1.5s infinite;
+    }
+    @keyframes pulse {
+        0% { opacity: 1; }
+        50% { opacity: 0.3; }
+        100% { opacity: 1; }
+    }
+    .siren-active {
+        border: 3px solid #dc3545;
+        animation: siren-border 1s infinite;
+        padding: 10px;
+        border-radius: 5px;
+        margin-bottom: 15px;
+    }
+    @keyframes siren-border {
+        0% { border-color: #dc3545; }
+        50% { border-color: #ffc107; }
+        100% { border-color: #dc3545; }
+    }
+"""
+
+
+def minify_css(css):
+    css = re.sub(r'\s+', ' ', css)
+    return re.sub(r'\s*([{}:;,])\s*', r'\1', css).replace(';}', '}').strip()
+
+
+# Sent with every full rerun, so it is built once per process rather than per run
+STYLE_HTML = f"<style>{minify_css(APP_CSS)}</style>"
+
+
+class StaticAsset:
+    """A file held in memory and served with ETag, Cache-Control and Range support"""
+
+    def __init__(self, path, content_type):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.content_type = content_type
+        self.etag = '"%s"' % hashlib.sha256(self.data).hexdigest()[:32]
+        self.last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+
+    @property
+    def version(self):
+        return self.etag.strip('"')[:12]
+
+    def respond(self, request):
+        headers = {
+            'Content-Type': self.content_type,
+            'ETag': self.etag,
+            'Last-Modified': self.last_modified,
+            'Accept-Ranges': 'bytes',
+            # URLs carry the content version, so the browser never has to revalidate
+            'Cache-Control': 'public, max-age=31536000, immutable',
+        }
+        if request.headers.get('If-None-Match') == self.etag:
+            return 304, headers, b''
+
+        size = len(self.data)
+        range_header = request.headers.get('Range')
+        if range_header and request.headers.get('If-Range', self.etag) == self.etag:
+            match = _RANGE_RE.match(range_header.strip())
+            start = end = None
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = int(match.group(2)) if match.group(2) else size - 1
+                else:
+                    # Suffix range: the last N bytes
+                    start = max(0, size - int(match.group(2)))
+                    end = size - 1
+                end = min(end, size - 1)
+            if start is None or start > end:
+                headers['Content-Range'] = f"bytes */{size}"
+                return 416, headers, b''
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+            return 206, headers, self.data[start:end + 1]
+
+        return 200, headers, self.data
+
+
+def _load(path, content_type):
+    try:
+        return StaticAsset(path, content_type)
+    except OSError:
+        return None
+
+
+# Loaded once per process; every session and rerun reuses these bytes
+siren = _load(SIREN_FILE, 'audio/mpeg')
+siren_low = _load(SIREN_LOW_FILE, 'audio/mpeg')
+
+
+@sidecar.route('GET', '/assets/siren.mp3')
+def _serve_siren(request):
+    if siren is None:
+        return 404, {'Content-Type': 'text/plain'}, b'No siren audio'
+    return siren.respond(request)
+
+
+@sidecar.route('GET', '/assets/siren-low.mp3')
+def _serve_siren_low(request):
+    asset = siren_low or siren
+    if asset is None:
+        return 404, {'Content-Type': 'text/plain'}, b'No siren audio'
+    return asset.respond(request)
+
+
+def siren_urls_js():
+    """JavaScript object literal with the full and low-bitrate siren URLs"""
+    base = sidecar.public_url_js()
+    full = f"{base} + '/assets/siren.mp3?v={siren.version}'"
+    low = full
+    if siren_low is not None:
+        low = f"{base} + '/assets/siren-low.mp3?v={siren_low.version}'"
+    return f"{{full: {full}, low: {low}}}"
@@ -0,0 +1,118 @@
+"""
+Throughput of the headless trigger API against local fake Twilio and Nominatim.
+
+Every request triggers a different profile, so none is swallowed by trigger
+deduplication, and waits for its per-channel results as a real client
+would (or, with --no-wait, only until its alerts are queued). Clients hold
+keep-alive connections and send back to back; the harness reports requests
+per second and response time percentiles.
+
+    python -m benchmarks.api_throughput --requests 5000 --connections 200
+    python -m benchmarks.api_throughput --no-wait
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+
+from benchmarks.time_to_alert import RESULTS_DIR, current_commit, start_environment, summarize
+
+API_KEY = 'benchmark-key'
+
+
+async def client(port, profiles, latencies, statuses, wait):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        for profile_id, _ in profiles:
+            body = json.dumps({'profile': profile_id, 'latitude': 28.61, 'longitude': 77.2,
+                               'accuracy': 15, 'source': 'benchmark', 'wait': wait}).encode()
+            started = time.perf_counter()
+            writer.write(f"POST /v1/alerts HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer {API_KEY}\r\n"
+                         f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode().partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def drive(port, profiles, connections, wait):
+    latencies, statuses = [], {}
+    shares = [profiles[i::connections] for i in range(connections)]
+    started = time.perf_counter()
+    await asyncio.gather(*(client(port, share, latencies, statuses, wait) for share in shares if share))
+    return time.perf_counter() - started, latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--no-wait', dest='wait', action='store_false',
+                        help="return once alerts are queued instead of waiting for Twilio")
+    parser.add_argument('--api-port', type=int, default=18504)
+    parser.add_argument('--twilio-latency', type=float, default=0.1)
+    parser.add_argument('--twilio-jitter', type=float, default=0.05)
+    parser.add_argument('--twilio-error-rate', type=float, default=0.0)
+    parser.add_argument('--geocode-latency', type=float, default=0.2)
+    parser.add_argument('--geocode-jitter', type=float, default=0.1)
+    parser.add_argument('--geocode-error-rate', type=float, default=0.0)
+    parser.add_argument('--sidecar-port', type=int, default=18505)
+    parser.add_argument('--output', help="results file (default benchmarks/results/api-<commit>.json)")
+    args = parser.parse_args()
+    args.contacts = 1
+    twilio, _ = start_environment(args)
+    os.environ['SOS_API_KEYS'] = API_KEY
+
+    from api import ApiServer
+    from benchmarks.loadtest import seed_profiles
+    profiles = seed_profiles(args.requests)
+    ready = threading.Event()
+    threading.Thread(target=asyncio.run, args=(ApiServer({API_KEY: None}).serve('127.0.0.1', args.api_port, ready),),
+                     daemon=True).start()
+    ready.wait()
+
+    cpu_before = time.process_time()
+    elapsed, latencies, statuses = asyncio.run(drive(args.api_port, profiles, args.connections, args.wait))
+    # Queued alerts are still being sent; wait for them before counting
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and len(twilio.received()) < 2 * len(latencies):
+        time.sleep(0.1)
+    cpu = time.process_time() - cpu_before
+    alerts = [r for r in twilio.received() if r[2].endswith(('/Messages.json', '/Calls.json'))]
+    results = {
+        'commit': current_commit(),
+        'timestamp': time.time(),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'response_time': summarize(latencies),
+        'statuses': statuses,
+        'alerts_at_twilio': len(alerts),
+        'cpu_ms_per_request': round(cpu / max(1, len(latencies)) * 1000, 3),
+    }
+    print(f"\nAPI @ {results['commit']}: {results['requests_per_second']} requests/s over "
+          f"{args.connections} connections, p50 {results['response_time'].get('p50_ms')} ms, "
+          f"p99 {results['response_time'].get('p99_ms')} ms, statuses {statuses}, "
+          f"{len(alerts)} alerts at Twilio, {results['cpu_ms_per_request']} ms CPU/request")
+    output = args.output or os.path.join(RESULTS_DIR, f"api-{results['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeService:
+    """
+    Local HTTP stand-in with injected latency and errors. Every request is
+    recorded as (perf_counter timestamp, method, path, form) so benchmarks
+    can tell exactly when an alert reached the "provider".
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def reset(self):
+        with self._lock:
+            self.requests = []
+
+    def received(self, path_suffix=''):
+        with self._lock:
+            return [r for r in self.requests if r[2].endswith(path_suffix)]
+
+    def respond(self, method, path, query, form):
+        raise NotImplementedError
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this, Nagle's
+            # algorithm holds the body back for the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def _handle(self, method):
+                received_at = time.perf_counter()
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode() if length else ''
+                form = {k: v[0] for k, v in parse_qs(body).items()}
+                with service._lock:
+                    service.requests.append((received_at, method, url.path, form))
+
+                delay = service.latency + random.uniform(0, service.jitter)
+                if delay:
+                    time.sleep(delay)
+                if random.random() < service.error_rate:
+                    status, payload = 500, {'code': 20500, 'message': 'Injected failure', 'status': 500}
+                else:
+                    status, payload = service.respond(method, url.path,
+                                                      {k: v[0] for k, v in parse_qs(url.query).items()}, form)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class FakeTwilio(FakeService):
+    """Answers the Twilio REST calls the app makes: account fetch, Messages and Calls"""
+
+    def respond(self, method, path, query, form):
+        if method == 'POST' and path.endswith('/Messages.json'):
+            return 201, {'sid': 'SM' + uuid.uuid4().hex, 'status': 'queued',
+                         'to': form.get('To'), 'from': form.get('From'), 'body': form.get('Body')}
+        if method == 'POST' and path.endswith('/Calls.json'):
+            return 201, {'sid': 'CA' + uuid.uuid4().hex, 'status': 'queued',
+                         'to': form.get('To'), 'from': form.get('From')}
+        if method == 'GET' and path.endswith('.json'):
+            return 200, {'sid': path.rsplit('/', 1)[-1][:-5], 'status': 'active'}
+        return 404, {'code': 20404, 'message': 'Not found', 'status': 404}
+
+
+class FakeNominatim(FakeService):
+    """Answers /reverse with a display_name built from the coordinates"""
+
+    def respond(self, method, path, query, form):
+        if path.endswith('/reverse'):
+            return 200, {'display_name': f"Test Address near {query.get('lat')}, {query.get('lon')}, New Delhi, India"}
+        return 404, {'error': 'Not found'}
@@ -0,0 +1,250 @@
+"""
+Load test: many concurrent SOS sessions against local fake Twilio and Nominatim.
+
+Every simulated session is a Streamlit AppTest of app.py with its own profile
+and emergency contact, so alerts arriving at the fake Twilio can be traced back
+to the session that triggered them. For each concurrency level the harness
+opens that many sessions at once, triggers SOS in them at the given rate (by
+pressing the button, or through the sidecar as a voice trigger would) and
+records:
+  - time from trigger to the session's first alert at Twilio (p50/p95/p99)
+  - alert throughput
+  - wall time and CPU time per script run
+  - resident memory per open session
+Levels increase until p95 time-to-first-alert misses the target, which is
+reported as the breaking point.
+
+AppTest installs a process-wide Streamlit runtime for each script run, so
+script runs are serialized here; a button press waits behind the other
+sessions' runs, much as it would on a server whose cores are all busy. Voice
+triggers go straight to the sidecar and arrive fully concurrently.
+
+    python -m benchmarks.loadtest --levels 1,5,10,25,50 --trigger-rate 10
+    python -m benchmarks.loadtest --mode voice --target-ms 1000 --twilio-latency 0.3
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.time_to_alert import RESULTS_DIR, REPO_ROOT, current_commit, start_environment, summarize
+
+
+# AppTest can't run two scripts in one process at the same time
+_script_lock = threading.Lock()
+
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak rather than current where /proc isn't available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class SimulatedSession:
+    """One browser session: an AppTest of the app bound to its own profile and contact number"""
+
+    def __init__(self, index, profile_id, contact_number):
+        from streamlit.testing.v1 import AppTest
+        self.index = index
+        self.contact_number = contact_number
+        self.app = AppTest.from_file(os.path.join(REPO_ROOT, 'app.py'), default_timeout=120)
+        self.app.query_params['profile'] = profile_id
+        self.run_times = []
+        self.triggered_at = None
+
+    def run(self):
+        with _script_lock:
+            started = time.perf_counter()
+            self.app.run()
+            self.run_times.append(time.perf_counter() - started)
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].value)
+
+    def press_sos(self):
+        self.app.button(key='sos_button').click()
+        # Time from the press, including any wait for another session's run
+        self.triggered_at = time.perf_counter()
+        self.run()
+
+    def say_keyword(self, sidecar_port):
+        body = json.dumps({'session_id': self.app.session_state['session_id'],
+                           'transcripts': ['help me please']}).encode()
+        request = urllib.request.Request(f"http://127.0.0.1:{sidecar_port}/transcripts", data=body,
+                                         headers={'Content-Type': 'text/plain'})
+        self.triggered_at = time.perf_counter()
+        urllib.request.urlopen(request, timeout=30).read()
+
+
+def seed_profiles(count):
+    """
+    Give each simulated user a profile with one contact of their own. Every
+    level gets fresh users, since a user's repeat trigger within the dedup
+    window joins their earlier incident rather than alerting again.
+    """
+    from profiles import ProfileStore
+    store = ProfileStore(os.environ['SOS_PROFILES_DB'])
+    profiles = []
+    for i in range(count):
+        number = f"+1556{i:07d}"
+        store.put(f"load-{i}", {
+            'twilio_account_sid': 'ACloadtest',
+            'twilio_auth_token': 'loadtest-token',
+            'twilio_phone_number': '+15550000000',
+            'user_name': f"Load User {i}",
+            'emergency_contacts': [{'name': "Contact", 'number': number, 'priority': 1}],
+        })
+        profiles.append((f"load-{i}", number))
+    return profiles
+
+
+def first_arrivals(twilio):
+    """Earliest alert arrival at the fake Twilio for each recipient number"""
+    first = {}
+    for received_at, method, path, form in twilio.received():
+        if path.endswith(('/Messages.json', '/Calls.json')):
+            to = form.get('To')
+            if to not in first or received_at < first[to]:
+                first[to] = received_at
+    return first
+
+
+def run_level(args, twilio, profiles, level):
+    twilio.reset()
+    gc.collect()
+    rss_before = rss_bytes()
+    cpu_before = time.process_time()
+
+    # Open every session at once, like a burst of page loads
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        sessions = list(pool.map(lambda i: SimulatedSession(i, *profiles[i]), range(level)))
+        list(pool.map(SimulatedSession.run, sessions))
+    open_cpu = time.process_time() - cpu_before
+    rss_per_session = (rss_bytes() - rss_before) / level
+
+    # Trigger at the requested rate across all sessions
+    interval = 1.0 / args.trigger_rate if args.trigger_rate > 0 else 0.0
+    started = time.perf_counter()
+    cpu_before = time.process_time()
+    errors = []
+
+    def trigger(session):
+        delay = started + session.index * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            if args.mode == 'voice':
+                session.say_keyword(args.sidecar_port)
+            else:
+                session.press_sos()
+        except Exception as e:
+            errors.append(str(e))
+
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        list(pool.map(trigger, sessions))
+
+    expected = {session.contact_number for session in sessions}
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline and not expected <= set(first_arrivals(twilio)):
+        time.sleep(0.01)
+    trigger_cpu = time.process_time() - cpu_before
+    first = first_arrivals(twilio)
+
+    time_to_alert = [first[s.contact_number] - s.triggered_at
+                     for s in sessions if s.triggered_at is not None and s.contact_number in first]
+    alerts = [r for r in twilio.received() if r[2].endswith(('/Messages.json', '/Calls.json'))]
+    span = (max(r[0] for r in alerts) - started) if alerts else 0.0
+    runs = [t for s in sessions for t in s.run_times]
+    run_count = max(1, len(runs))
+    result = {
+        'sessions': level,
+        'time_to_first_alert': summarize(time_to_alert),
+        'missed': len(expected) - len(time_to_alert),
+        'errors': errors[:5],
+        'alerts': len(alerts),
+        'alerts_per_second': round(len(alerts) / span, 2) if span else 0.0,
+        'script_run': summarize(runs),
+        'cpu_ms_per_run': round((open_cpu + trigger_cpu) / run_count * 1000, 2),
+        'rss_per_session_kb': round(rss_per_session / 1024, 1),
+    }
+    del sessions
+    return result
+
+
+def print_level(result, target_ms):
+    tta = result['time_to_first_alert']
+    p95 = tta.get('p95_ms')
+    status = "ok" if p95 is not None and p95 <= target_ms and not result['missed'] else "MISSED"
+    print(f"  {result['sessions']:>5} sessions  tta p50 {tta.get('p50_ms', '-'):>9} ms  "
+          f"p95 {p95 if p95 is not None else '-':>9} ms  missed {result['missed']:>3}  "
+          f"{result['alerts_per_second']:>8} alerts/s  run p50 {result['script_run'].get('p50_ms', '-'):>8} ms  "
+          f"cpu/run {result['cpu_ms_per_run']:>7} ms  rss/session {result['rss_per_session_kb']:>8} KB  {status}")
+    return status == "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', default='1,5,10,25,50,100', help="comma-separated session counts")
+    parser.add_argument('--mode', choices=('button', 'voice'), default='button')
+    parser.add_argument('--trigger-rate', type=float, default=20.0, help="triggers per second; 0 fires all at once")
+    parser.add_argument('--target-ms', type=float, default=2000.0, help="p95 time-to-first-alert target")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds to wait for alerts per level")
+    parser.add_argument('--keep-going', action='store_true', help="run every level even after the target is missed")
+    parser.add_argument('--twilio-latency', type=float, default=0.1)
+    parser.add_argument('--twilio-jitter', type=float, default=0.05)
+    parser.add_argument('--twilio-error-rate', type=float, default=0.0)
+    parser.add_argument('--geocode-latency', type=float, default=0.2)
+    parser.add_argument('--geocode-jitter', type=float, default=0.1)
+    parser.add_argument('--geocode-error-rate', type=float, default=0.0)
+    parser.add_argument('--sidecar-port', type=int, default=18503)
+    parser.add_argument('--output', help="results file (default benchmarks/results/loadtest-<commit>.json)")
+    args = parser.parse_args()
+    # start_environment seeds this many contacts on the default profile
+    args.contacts = 1
+
+    levels = [int(level) for level in args.levels.split(',')]
+    twilio, _ = start_environment(args)
+    profiles = seed_profiles(sum(levels))
+    # Import the app and warm its caches so the first level isn't charged for them
+    from profiles import DEFAULT_PROFILE
+    SimulatedSession(0, DEFAULT_PROFILE, None).run()
+    results = {
+        'commit': current_commit(),
+        'timestamp': time.time(),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'levels': [],
+        'breaking_point': None,
+    }
+
+    print(f"\nLoad test @ {results['commit']}  mode={args.mode}  target p95 {args.target_ms:.0f} ms")
+    for level in levels:
+        result = run_level(args, twilio, profiles[:level], level)
+        profiles = profiles[level:]
+        results['levels'].append(result)
+        if not print_level(result, args.target_ms) and results['breaking_point'] is None:
+            results['breaking_point'] = level
+            if not args.keep_going:
+                break
+
+    if results['breaking_point'] is None:
+        print(f"\nTarget met at every level up to {levels[-1]} sessions")
+    else:
+        print(f"\nTarget first missed at {results['breaking_point']} concurrent sessions")
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{results['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""
+End-to-end time-to-alert benchmark.
+
+Drives the app through Streamlit's AppTest against local fake Twilio and
+Nominatim servers and reports:
+  - time from pressing SOS / saying a keyword until the first and the last
+    alert reach Twilio (p50/p95/p99)
+  - a per-stage breakdown (reverse geocode, Twilio client setup, SMS, call)
+  - bytes sent to the browser per rerun (idle page, post-alert page with siren)
+
+Results are written to benchmarks/results/<commit>.json; pass --compare with
+an earlier results file to see the change per metric.
+
+    python -m benchmarks.time_to_alert --iterations 20 --twilio-latency 0.15
+    python -m benchmarks.time_to_alert --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+
+
+def summarize(samples):
+    """p50/p95/p99, mean and extremes in milliseconds"""
+    if not samples:
+        return {'n': 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'n': len(ordered),
+        'p50_ms': round(pct(50), 2),
+        'p95_ms': round(pct(95), 2),
+        'p99_ms': round(pct(99), 2),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 2),
+        'min_ms': round(ordered[0] * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2),
+    }
+
+
+def current_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         cwd=REPO_ROOT, text=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=REPO_ROOT) != 0
+        return commit + ('-dirty' if dirty else '')
+    except Exception:
+        return 'unknown'
+
+
+def start_environment(args):
+    """
+    Start the fake services and point the app at them. Must run before any
+    app module is imported, since they read their settings at import time.
+    """
+    from benchmarks.fakes import FakeNominatim, FakeTwilio
+
+    twilio = FakeTwilio(args.twilio_latency, args.twilio_jitter, args.twilio_error_rate).start()
+    nominatim = FakeNominatim(args.geocode_latency, args.geocode_jitter, args.geocode_error_rate).start()
+    workdir = tempfile.mkdtemp(prefix='sos-bench-')
+    os.environ.update({
+        'SOS_TWILIO_BASE_URL': twilio.url,
+        'SOS_NOMINATIM_URL': nominatim.url + '/reverse',
+        'SOS_OUTBOX_DB': os.path.join(workdir, 'outbox.db'),
+        'SOS_PROFILES_DB': os.path.join(workdir, 'profiles.db'),
+        'SOS_INCIDENT_LOG': os.path.join(workdir, 'incidents.log'),
+        'SOS_SIDECAR_HOST': '127.0.0.1',
+        'SOS_SIDECAR_PORT': str(args.sidecar_port),
+        'SOS_TWILIO_SMS_PER_SECOND': '1000',
+        'SOS_TWILIO_CALLS_PER_SECOND': '1000',
+    })
+    os.chdir(REPO_ROOT)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    from profiles import DEFAULT_PROFILE
+    seed_profile(DEFAULT_PROFILE, args.contacts)
+    return twilio, nominatim
+
+
+def seed_profile(profile_id, contacts):
+    """Store a benchmark profile with this many emergency contacts"""
+    from profiles import ProfileStore
+    ProfileStore(os.environ['SOS_PROFILES_DB']).put(profile_id, {
+        'twilio_account_sid': 'ACbenchmark',
+        'twilio_auth_token': 'benchmark-token',
+        'twilio_phone_number': '+15550000000',
+        'user_name': 'Benchmark User',
+        'emergency_contacts': [
+            {'name': f"Contact {i}", 'number': f"+1555000{i:04d}", 'priority': i + 1}
+            for i in range(contacts)
+        ],
+    })
+    return profile_id
+
+
+def page_bytes(at):
+    """Serialized size of every element on the page: what a rerun sends to the browser"""
+    total = 0
+    stack = [at._tree]
+    while stack:
+        node = stack.pop()
+        proto = getattr(node, 'proto', None)
+        if proto is not None and hasattr(proto, 'ByteSize'):
+            total += proto.ByteSize()
+        stack.extend(getattr(node, 'children', {}).values())
+    return total
+
+
+def new_session(profile_id=None):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(REPO_ROOT, 'app.py'), default_timeout=60)
+    if profile_id is not None:
+        at.query_params['profile'] = profile_id
+    return at.run()
+
+
+def check_samples(scenario, samples, iterations):
+    """Stop the run when some triggers never reached Twilio: percentiles over the rest would mislead"""
+    if len(samples) < iterations:
+        sys.exit(f"{scenario}: only {len(samples)} of {iterations} triggers reached the fake Twilio")
+
+
+def wait_for_alerts(twilio, expected, started, timeout=30):
+    """Return (first, last) arrival times of alert requests at the fake Twilio, relative to started"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        alerts = twilio.received('/Messages.json') + twilio.received('/Calls.json')
+        if len(alerts) >= expected:
+            break
+        time.sleep(0.001)
+    alerts = twilio.received('/Messages.json') + twilio.received('/Calls.json')
+    if not alerts:
+        return None, None
+    arrivals = sorted(a[0] - started for a in alerts)
+    return arrivals[0], arrivals[min(len(arrivals), expected) - 1]
+
+
+def bench_button(args, twilio, results):
+    first, last, rerun_bytes, alert_bytes, post_bytes, post_time = [], [], [], [], [], []
+    for i in range(args.iterations):
+        # A fresh user per iteration: a repeat trigger within the dedup
+        # window joins the earlier incident instead of alerting again
+        at = new_session(seed_profile(f"bench-button-{i}", args.contacts))
+        rerun_bytes.append(page_bytes(at))
+        twilio.reset()
+        started = time.perf_counter()
+        at.button(key='sos_button').click().run()
+        f, l = wait_for_alerts(twilio, 2 * args.contacts, started)
+        if f is not None:
+            first.append(f)
+            last.append(l)
+        alert_bytes.append(page_bytes(at))
+        # A rerun of the post-alert view, with the siren on screen
+        rerun_started = time.perf_counter()
+        at.run()
+        post_time.append(time.perf_counter() - rerun_started)
+        post_bytes.append(page_bytes(at))
+    check_samples('button', first, args.iterations)
+    results['scenarios']['button'] = {
+        'time_to_first_alert': summarize(first),
+        'time_to_all_alerts': summarize(last),
+    }
+    results['stages']['post_alert_rerun'] = summarize(post_time)
+    results['bytes_per_rerun'] = {
+        'idle_page': max(rerun_bytes),
+        'alert_page': max(alert_bytes),
+        'post_alert_page': max(post_bytes),
+    }
+
+
+def bench_voice(args, twilio, results):
+    first, last, ack = [], [], []
+    url = f"http://127.0.0.1:{args.sidecar_port}/transcripts"
+    for i in range(args.iterations):
+        at = new_session(seed_profile(f"bench-voice-{i}", args.contacts))
+        twilio.reset()
+        body = json.dumps({'session_id': at.session_state['session_id'],
+                           'transcripts': ['please help me']}).encode()
+        request = urllib.request.Request(url, data=body, headers={'Content-Type': 'text/plain'})
+        started = time.perf_counter()
+        urllib.request.urlopen(request).read()
+        ack.append(time.perf_counter() - started)
+        f, l = wait_for_alerts(twilio, 2 * args.contacts, started)
+        if f is not None:
+            first.append(f)
+            last.append(l)
+    check_samples('voice', first, args.iterations)
+    results['scenarios']['voice'] = {
+        'ack': summarize(ack),
+        'time_to_first_alert': summarize(first),
+        'time_to_all_alerts': summarize(last),
+    }
+
+
+def bench_stages(args, results):
+    from dispatch import place_call, send_sms
+    from gazetteer import GAZETTEER_CSV, load_gazetteer
+    from geocode import ReverseGeocoder
+    from services import get_emergency_services
+    from twilio_pool import TwilioClientPool, get_twilio_pool
+
+    credentials = {
+        'twilio_account_sid': 'ACbenchmark',
+        'twilio_auth_token': 'benchmark-token',
+        'twilio_phone_number': '+15550000000',
+    }
+    geocoder = ReverseGeocoder(min_interval=0)
+    gazetteer = load_gazetteer(GAZETTEER_CSV)
+    services = get_emergency_services()
+    cold, warm, offline, nearby, client_setup, sms, call = [], [], [], [], [], [], []
+    for i in range(args.iterations):
+        latitude, longitude = 28.5 + i * 0.01, 77.0
+        started = time.perf_counter()
+        geocoder.lookup(latitude, longitude)
+        cold.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        geocoder.lookup(latitude, longitude)
+        warm.append(time.perf_counter() - started)
+        if gazetteer is not None:
+            started = time.perf_counter()
+            gazetteer.describe(latitude, longitude)
+            offline.append(time.perf_counter() - started)
+        if services is not None:
+            started = time.perf_counter()
+            services.nearby(latitude, longitude)
+            nearby.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with TwilioClientPool().lease(credentials):
+            pass
+        client_setup.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        send_sms(credentials, '+15550009999', "Benchmark message")
+        sms.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        place_call(credentials, '+15550009999', "Benchmark message")
+        call.append(time.perf_counter() - started)
+    get_twilio_pool().invalidate(credentials['twilio_account_sid'])
+    if gazetteer is not None:
+        results['gazetteer'] = {'places': len(gazetteer), 'index_bytes': gazetteer.nbytes,
+                                'build_ms': round(gazetteer.build_seconds * 1000, 2),
+                                'load_ms': round(gazetteer.load_seconds * 1000, 2)}
+
+    results['stages'].update({
+        'reverse_geocode_miss': summarize(cold),
+        'reverse_geocode_hit': summarize(warm),
+        'reverse_geocode_offline': summarize(offline),
+        'nearest_services': summarize(nearby),
+        'twilio_client_setup': summarize(client_setup),
+        'messages_create': summarize(sms),
+        'calls_create': summarize(call),
+    })
+
+
+def flatten(results):
+    flat = {}
+    for section in ('scenarios', 'stages'):
+        for name, value in results.get(section, {}).items():
+            if 'p50_ms' in value:
+                flat[f"{name}.p50_ms"] = value['p50_ms']
+                flat[f"{name}.p95_ms"] = value['p95_ms']
+            else:
+                for metric, stats in value.items():
+                    if 'p50_ms' in stats:
+                        flat[f"{name}.{metric}.p50_ms"] = stats['p50_ms']
+                        flat[f"{name}.{metric}.p95_ms"] = stats['p95_ms']
+    for name, value in results.get('bytes_per_rerun', {}).items():
+        flat[f"bytes.{name}"] = value
+    for name, value in results.get('gazetteer', {}).items():
+        flat[f"gazetteer.{name}"] = value
+    return flat
+
+
+def print_report(results, baseline=None):
+    current = flatten(results)
+    previous = flatten(baseline) if baseline else {}
+    print(f"\nTime-to-alert benchmark @ {results['commit']}  ({results['config']})")
+    for name, value in current.items():
+        line = f"  {name:<45} {value:>12,.2f}"
+        if name in previous and previous[name]:
+            change = (value - previous[name]) / previous[name] * 100
+            line += f"   {previous[name]:>12,.2f}  {change:+7.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--contacts', type=int, default=3)
+    parser.add_argument('--twilio-latency', type=float, default=0.1, help="seconds per Twilio request")
+    parser.add_argument('--twilio-jitter', type=float, default=0.05)
+    parser.add_argument('--twilio-error-rate', type=float, default=0.0)
+    parser.add_argument('--geocode-latency', type=float, default=0.2, help="seconds per reverse geocode")
+    parser.add_argument('--geocode-jitter', type=float, default=0.1)
+    parser.add_argument('--geocode-error-rate', type=float, default=0.0)
+    parser.add_argument('--sidecar-port', type=int, default=18502)
+    parser.add_argument('--scenarios', default='button,voice,stages')
+    parser.add_argument('--output', help="results file (default benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    twilio, _ = start_environment(args)
+    results = {
+        'commit': current_commit(),
+        'timestamp': time.time(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'scenarios': {},
+        'stages': {},
+    }
+    scenarios = args.scenarios.split(',')
+    if 'button' in scenarios:
+        bench_button(args, twilio, results)
+    if 'voice' in scenarios:
+        bench_voice(args, twilio, results)
+    if 'stages' in scenarios:
+        bench_stages(args, results)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    print(f"\nResults written to {output}")
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
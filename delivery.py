@@ -0,0 +1,199 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+import sidecar
+from incident_log import log_event
+from metrics import status_callbacks
+
+# Public URL Twilio posts delivery status to: the sidecar's /twilio/status,
+# reachable from the internet (usually through the same reverse proxy as the
+# sidecar). Without one, alerts show only whether Twilio accepted them.
+STATUS_CALLBACK_URL = os.environ.get('SOS_STATUS_CALLBACK_URL', '') or (
+    sidecar.SIDECAR_PUBLIC_URL.rstrip('/') + '/twilio/status' if sidecar.SIDECAR_PUBLIC_URL else '')
+# Reject callbacks whose X-Twilio-Signature doesn't match (set to 0 only for local testing)
+VALIDATE_SIGNATURES = os.environ.get('SOS_VALIDATE_TWILIO_SIGNATURE', '1') != '0'
+MAX_TRACKED_ALERTS = int(os.environ.get('SOS_MAX_TRACKED_ALERTS', '100000'))
+# Call progress events to be told about, in addition to completion
+CALL_STATUS_EVENTS = ['initiated', 'ringing', 'answered', 'completed']
+
+# Callbacks can arrive out of order; a status never replaces a later one
+STATUS_RANK = {
+    'accepted': 0, 'scheduled': 0, 'queued': 0,
+    'initiated': 1, 'sending': 1,
+    'ringing': 2, 'sent': 2,
+    'in-progress': 3,
+    'delivered': 4, 'undelivered': 4, 'failed': 4, 'canceled': 4,
+    'completed': 4, 'busy': 4, 'no-answer': 4,
+    'read': 5,
+}
+ANSWERED = {'in-progress', 'completed'}
+DELIVERED = {'delivered', 'read'} | ANSWERED
+FAILED = {'undelivered', 'failed', 'canceled', 'busy', 'no-answer'}
+# Statuses that settle an alert's outcome, recorded in the incident log
+FINAL = {'delivered', 'completed'} | FAILED
+STATUS_MARKS = {
+    'queued': "📤 queued", 'accepted': "📤 queued", 'scheduled': "📤 queued",
+    'sending': "📤 sending", 'sent': "📨 sent to carrier",
+    'initiated': "📞 dialing", 'ringing': "📞 ringing",
+    'in-progress': "✅ answered", 'completed': "✅ answered",
+    'delivered': "✅ delivered", 'read': "✅ read",
+}
+
+
+class StatusIndex:
+    """
+    Latest Twilio status of every alert, keyed by message or call SID, with
+    the SIDs of each incident alongside. An update is one dict lookup under
+    a lock, so a storm of callbacks from a large fan-out stays cheap. The
+    oldest alerts are forgotten beyond max_alerts.
+    """
+
+    def __init__(self, max_alerts=MAX_TRACKED_ALERTS):
+        self.max_alerts = max_alerts
+        self._lock = threading.Lock()
+        self._alerts = OrderedDict()   # sid -> [incident_id, channel, target, status, error_code, updated_at]
+        self._incidents = {}           # incident_id -> [sid, ...]
+
+    def _entry(self, sid):
+        entry = self._alerts.get(sid)
+        if entry is None:
+            entry = self._alerts[sid] = [None, None, None, None, None, 0.0]
+            while len(self._alerts) > self.max_alerts:
+                old_sid, (incident_id, *_) = self._alerts.popitem(last=False)
+                sids = self._incidents.get(incident_id)
+                if sids is not None:
+                    sids.remove(old_sid)
+                    if not sids:
+                        del self._incidents[incident_id]
+        return entry
+
+    def register(self, sid, incident_id, channel, target):
+        """Record the alert a SID belongs to once Twilio has accepted it"""
+        if not sid:
+            return
+        with self._lock:
+            entry = self._entry(sid)
+            if entry[0] is None:
+                self._incidents.setdefault(incident_id, []).append(sid)
+            entry[0], entry[1], entry[2] = incident_id, channel, target
+            if entry[3] is None:
+                # The callback for this SID may already have arrived
+                entry[3], entry[5] = 'queued', time.time()
+
+    def update(self, sid, status, error_code=None):
+        """Apply a status callback; returns False if a later status is already known"""
+        with self._lock:
+            entry = self._entry(sid)
+            if entry[3] is not None and STATUS_RANK.get(status, 0) < STATUS_RANK.get(entry[3], 0):
+                return False
+            entry[3], entry[4], entry[5] = status, error_code or None, time.time()
+            return True
+
+    def status(self, sid):
+        with self._lock:
+            entry = self._alerts.get(sid)
+            return None if entry is None else tuple(entry[3:])
+
+    def alert(self, sid):
+        """(incident_id, channel, target) of a registered alert, or None"""
+        with self._lock:
+            entry = self._alerts.get(sid)
+            return None if entry is None or entry[0] is None else tuple(entry[:3])
+
+    def answered(self, incident_id):
+        """Numbers that picked up a call for the incident, in any escalation round"""
+        with self._lock:
+            return {entry[2] for entry in (self._alerts[sid] for sid in self._incidents.get(incident_id, ()))
+                    if entry[1] == 'call' and entry[3] in ANSWERED}
+
+    def incident(self, incident_id):
+        """{(channel, target): (status, error_code, updated_at)} for every alert of the incident"""
+        with self._lock:
+            return {(entry[1], entry[2]): tuple(entry[3:])
+                    for entry in (self._alerts[sid] for sid in self._incidents.get(incident_id, ()))}
+
+
+_index = StatusIndex()
+
+
+def get_status_index():
+    return _index
+
+
+def track_alert(sid, incident_id, channel, target):
+    """Follow an alert Twilio has accepted, if it was asked to post status callbacks for it"""
+    if STATUS_CALLBACK_URL:
+        _index.register(sid, incident_id, channel, target)
+
+
+def status_mark(status, error_code=None):
+    if status in FAILED:
+        return f"❌ {status}" + (f" (error {error_code})" if error_code else "")
+    return STATUS_MARKS.get(status, status)
+
+
+def live_delivery_status(incident_id, delivery_status):
+    """
+    The incident's delivery table with each channel's latest Twilio status
+    in place of the hand-off result, and a (delivered, failed, total) summary
+    """
+    statuses = _index.incident(incident_id)
+    rows, delivered, failed = [], 0, 0
+    for number, row in delivery_status.items():
+        row = dict(row)
+        for channel, column in (('call', 'Call'), ('sms', 'SMS')):
+            status = statuses.get((channel, number))
+            if status is None:
+                continue
+            row[column] = status_mark(status[0], status[1])
+            delivered += status[0] in DELIVERED
+            failed += status[0] in FAILED
+        rows.append(row)
+    return rows, (delivered, failed, len(statuses))
+
+
+def twilio_signature(auth_token, url, params):
+    """X-Twilio-Signature for a POST: HMAC-SHA1 of the URL followed by the sorted form parameters"""
+    payload = url + ''.join(f"{key}{value}" for key, value in sorted(params.items()))
+    digest = hmac.new(auth_token.encode(), payload.encode(), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode()
+
+
+def _auth_token(account_sid):
+    # Imported here: outbox imports dispatch, which imports this module
+    from outbox import registered_credentials
+    credentials = registered_credentials(account_sid)
+    return credentials.get('twilio_auth_token') if credentials else None
+
+
+@sidecar.route('POST', '/twilio/status')
+def _status_callback(request):
+    """Message and call status callbacks from Twilio (application/x-www-form-urlencoded)"""
+    params = dict(parse_qsl(request.body.decode('utf-8', 'replace')))
+    if VALIDATE_SIGNATURES:
+        auth_token = _auth_token(params.get('AccountSid'))
+        signature = request.headers.get('X-Twilio-Signature', '')
+        if not auth_token or not hmac.compare_digest(
+                signature, twilio_signature(auth_token, STATUS_CALLBACK_URL, params)):
+            return 403, {'Content-Type': 'text/plain'}, b'Invalid signature'
+    if 'MessageSid' in params:
+        sid, status, channel = params['MessageSid'], params.get('MessageStatus'), 'sms'
+    elif 'CallSid' in params:
+        sid, status, channel = params['CallSid'], params.get('CallStatus'), 'call'
+    else:
+        return 400, {'Content-Type': 'text/plain'}, b'No MessageSid or CallSid'
+    if not status:
+        return 400, {'Content-Type': 'text/plain'}, b'No status'
+    if _index.update(sid, status, params.get('ErrorCode')) and status in FINAL:
+        alert = _index.alert(sid)
+        if alert is not None:
+            log_event('status', alert[0], channel=alert[1], target=alert[2], status=status,
+                      error_code=params.get('ErrorCode'), delivered=status not in FAILED, failed=status in FAILED)
+    status_callbacks.inc(channel=channel, status=status)
+    return 204, {}, b''
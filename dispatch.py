@@ -0,0 +1,203 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from xml.sax.saxutils import escape
+
+from delivery import CALL_STATUS_EVENTS, STATUS_CALLBACK_URL
+from metrics import channel_failures, channel_latency, sms_segments, span
+from ratelimit import TokenBucket
+from sms import MessageTemplate, segments
+from twilio_pool import get_twilio_pool
+
+
+def positive_setting(name, default):
+    """A finite number above zero from the environment; anything else fails at startup, not on a send"""
+    value = os.environ.get(name) or default
+    try:
+        number = float(value)
+    except ValueError:
+        number = math.nan
+    if not 0 < number < math.inf:
+        raise ValueError(f"{name} must be a positive number, not {value!r}")
+    return number
+
+
+# Latency budget per channel in seconds. A channel that has not finished
+# within its budget is reported as timed out so the alert flow can move on,
+# while the request itself keeps running in the background.
+# Override with SOS_BUDGET_<CHANNEL>, e.g. SOS_BUDGET_CALL=5. Channels without
+# a budget of their own get DEFAULT_BUDGET.
+DEFAULT_BUDGET = 8.0
+DEFAULT_BUDGETS = {
+    'call': DEFAULT_BUDGET,
+    'sms': DEFAULT_BUDGET,
+}
+
+# Requests per second each Twilio account may make per channel. Match these to
+# the account's messages-per-second and calls-per-second limits.
+RATE_LIMITS = {
+    'sms': positive_setting('SOS_TWILIO_SMS_PER_SECOND', '10'),
+    'call': positive_setting('SOS_TWILIO_CALLS_PER_SECOND', '5'),
+}
+
+# The message is XML-escaped as it is filled in, so an address containing
+# "&" or "<" can't break the TwiML
+CALL_TWIML = MessageTemplate("""<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Say voice="woman" language="en-US">Emergency alert. {message}</Say>
+    <Pause length="1"/>
+    <Say voice="woman" language="en-US">This is an automated emergency call. Please respond immediately.</Say>
+    <Pause length="1"/>
+    <Redirect/>
+</Response>
+""", escape=escape)
+
+
+@dataclass
+class ChannelResult:
+    """Outcome of one channel (call or SMS) for one recipient"""
+    channel: str
+    target: str
+    ok: bool
+    elapsed: float
+    sid: str = None
+    error: str = None
+    timed_out: bool = False
+
+
+def credentials_missing(credentials):
+    """Return True if any of the Twilio settings needed to send is empty"""
+    return not (credentials.get('twilio_account_sid')
+                and credentials.get('twilio_auth_token')
+                and credentials.get('twilio_phone_number'))
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(account_sid, channel):
+    """Return the token bucket shared by every send on this account and channel"""
+    key = (account_sid, channel)
+    with _rate_limiters_lock:
+        bucket = _rate_limiters.get(key)
+        if bucket is None:
+            bucket = _rate_limiters[key] = TokenBucket(RATE_LIMITS[channel])
+        return bucket
+
+
+def status_callback_args(channel):
+    """Arguments asking Twilio to post the alert's delivery status back to the sidecar"""
+    if not STATUS_CALLBACK_URL:
+        return {}
+    if channel == 'call':
+        return {'status_callback': STATUS_CALLBACK_URL, 'status_callback_event': CALL_STATUS_EVENTS}
+    return {'status_callback': STATUS_CALLBACK_URL}
+
+
+def send_sms(credentials, to_number, message):
+    """Send an SMS through Twilio and return the message SID"""
+    get_rate_limiter(credentials['twilio_account_sid'], 'sms').acquire()
+
+    # Create a simple message with no formatting that might cause issues
+    clean_message = message.replace('\n', ' ').strip()
+    encoding, count = segments(clean_message)
+    sms_segments.inc(count, encoding=encoding)
+
+    with get_twilio_pool().lease(credentials) as client, span('messages_create'):
+        sms = client.messages.create(
+            body=clean_message,
+            from_=credentials['twilio_phone_number'],
+            to=to_number,
+            **status_callback_args('sms')
+        )
+    return sms.sid
+
+
+def place_call(credentials, to_number, message):
+    """Place a Twilio voice call reading out the message and return the call SID"""
+    get_rate_limiter(credentials['twilio_account_sid'], 'call').acquire()
+    with get_twilio_pool().lease(credentials) as client, span('calls_create'):
+        call = client.calls.create(
+            twiml=CALL_TWIML.render(message=message),
+            from_=credentials['twilio_phone_number'],
+            to=to_number,
+            **status_callback_args('call')
+        )
+    return call.sid
+
+
+class DispatchEngine:
+    """Runs alert channels concurrently on a shared thread pool"""
+
+    def __init__(self, max_workers=None, budgets=None):
+        if max_workers is None:
+            max_workers = int(os.environ.get('SOS_DISPATCH_WORKERS', '32'))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='sos-dispatch')
+        self.budgets = {channel: positive_setting(f"SOS_BUDGET_{channel.upper()}", str(budget))
+                        for channel, budget in DEFAULT_BUDGETS.items()}
+        if budgets:
+            self.budgets.update(budgets)
+
+    def budget_for(self, channel):
+        return self.budgets.get(channel, DEFAULT_BUDGET)
+
+    def _run(self, channel, target, fn, started):
+        try:
+            sid = fn()
+            result = ChannelResult(channel, target, ok=True,
+                                   elapsed=time.monotonic() - started, sid=sid)
+        except Exception as e:
+            result = ChannelResult(channel, target, ok=False,
+                                   elapsed=time.monotonic() - started, error=str(e))
+            channel_failures.inc(channel=channel)
+        channel_latency.observe(result.elapsed, channel=channel)
+        return result
+
+    def dispatch(self, tasks):
+        """
+        Start every (channel, target, fn) task at the same time and yield a
+        ChannelResult for each one as soon as it finishes or runs out of budget.
+        Tasks are submitted in the order given, so list higher priorities first.
+        """
+        started = time.monotonic()
+        futures = {}
+        for channel, target, fn in tasks:
+            # Run in a copy of the caller's context so spans keep the incident's trace id
+            future = self._executor.submit(contextvars.copy_context().run,
+                                           self._run, channel, target, fn, started)
+            futures[future] = (channel, target, started + self.budget_for(channel))
+
+        pending = set(futures)
+        while pending:
+            next_deadline = min(futures[f][2] for f in pending)
+            timeout = max(0.0, next_deadline - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+            now = time.monotonic()
+            for future in [f for f in pending if futures[f][2] <= now]:
+                pending.discard(future)
+                channel, target, _ = futures[future]
+                yield ChannelResult(channel, target, ok=False, elapsed=now - started,
+                                    error="latency budget exceeded", timed_out=True)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_dispatch_engine():
+    """Return the process-wide dispatch engine, shared by all sessions"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = DispatchEngine()
+    return _engine
@@ -0,0 +1,307 @@
+import itertools
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from delivery import STATUS_CALLBACK_URL, get_status_index
+from incident_log import log_event
+from outbox import OUTBOX_DB, get_outbox
+
+# Seconds an incident may go unacknowledged before each escalation step; 0
+# turns escalation off. A contact answering a call (reported by Twilio's
+# status callbacks) or the user resetting SOS acknowledges the incident, so
+# without status callbacks escalation is off unless set explicitly: nobody's
+# answer would be seen, and contacts who picked up would be called again.
+ESCALATE_AFTER = float(os.environ.get('SOS_ESCALATE_AFTER', '60' if STATUS_CALLBACK_URL else '0'))
+# Numbers alerted in the last step, beyond the user's own contacts, e.g. a
+# monitoring desk or local emergency number
+ESCALATION_CONTACTS = [number.strip() for number in os.environ.get('SOS_ESCALATION_CONTACTS', '').split(',')
+                       if number.strip()]
+# In order: call every contact who hasn't answered again, send the SMS
+# again, then alert ESCALATION_CONTACTS
+STEPS = ('call_again', 'sms_again', 'widen')
+
+WHEEL_TICK = 0.25
+WHEEL_SLOTS = 4096
+
+
+class _Timer:
+    __slots__ = ('id', 'slot', 'rounds', 'fn', 'args')
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel: `slots` buckets of `tick` seconds each. A timer goes
+    in the bucket its deadline falls in, with the number of full turns still
+    to wait, so scheduling and cancelling are O(1) however many timers are
+    pending. One thread advances the wheel a bucket per tick and hands due
+    callbacks to a small pool; no thread is held per timer.
+    """
+
+    def __init__(self, tick=WHEEL_TICK, slots=WHEEL_SLOTS, workers=2):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._started = time.monotonic()
+        self._ticks = 0   # buckets processed; bucket k is processed at _started + (k + 1) * tick
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sos-timer')
+        threading.Thread(target=self._run, name='sos-timer-wheel', daemon=True).start()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(slot) for slot in self._slots)
+
+    def schedule(self, delay, fn, *args):
+        """Call fn(*args) on the timer pool after delay seconds; returns a handle for cancel()"""
+        timer = _Timer()
+        timer.id = next(self._ids)
+        timer.fn, timer.args = fn, args
+        with self._lock:
+            due_tick = max(self._ticks, math.ceil((time.monotonic() + delay - self._started) / self.tick) - 1)
+            timer.slot = due_tick % len(self._slots)
+            timer.rounds = (due_tick - self._ticks) // len(self._slots)
+            self._slots[timer.slot][timer.id] = timer
+        return timer
+
+    def cancel(self, timer):
+        """Drop a pending timer; returns False if it already fired or was cancelled"""
+        with self._lock:
+            return self._slots[timer.slot].pop(timer.id, None) is not None
+
+    def _run(self):
+        while True:
+            delay = self._started + (self._ticks + 1) * self.tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                bucket = self._slots[self._ticks % len(self._slots)]
+                due = []
+                for timer in list(bucket.values()):
+                    if timer.rounds:
+                        timer.rounds -= 1
+                    else:
+                        due.append(bucket.pop(timer.id))
+                self._ticks += 1
+            for timer in due:
+                self._executor.submit(self._fire, timer)
+
+    @staticmethod
+    def _fire(timer):
+        try:
+            timer.fn(*timer.args)
+        except Exception as e:
+            print(f"Timer callback failed: {e}")
+
+
+class EscalationStore:
+    """Escalation state per incident, next to the outbox, so pending steps survive a restart"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS escalations (
+        incident_id TEXT PRIMARY KEY,
+        account_sid TEXT NOT NULL,
+        contacts TEXT NOT NULL,
+        call_message TEXT NOT NULL,
+        sms_message TEXT NOT NULL,
+        step INTEGER NOT NULL DEFAULT 0,
+        due_at REAL NOT NULL,
+        state TEXT NOT NULL DEFAULT 'active',
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS escalations_state ON escalations (state);
+    """
+
+    def __init__(self, path=OUTBOX_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def create(self, incident_id, account_sid, contacts, call_message, sms_message, due_at):
+        """Store a new escalation; returns False if the incident already has one"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO escalations (incident_id, account_sid, contacts, call_message,"
+                " sms_message, due_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (incident_id, account_sid, json.dumps(contacts), call_message, sms_message, due_at, time.time()))
+        return cursor.rowcount == 1
+
+    def get(self, incident_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT incident_id, account_sid, contacts, call_message, sms_message, step, due_at, state"
+                " FROM escalations WHERE incident_id = ?", (incident_id,)).fetchone()
+        return None if row is None else self._as_dict(row)
+
+    def active(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT incident_id, account_sid, contacts, call_message, sms_message, step, due_at, state"
+                " FROM escalations WHERE state = 'active'").fetchall()
+        return [self._as_dict(row) for row in rows]
+
+    def advance(self, incident_id, step, due_at):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE escalations SET step = ?, due_at = ?, updated_at = ? WHERE incident_id = ? AND state = 'active'",
+                (step, due_at, time.time(), incident_id))
+
+    def finish(self, incident_id, state):
+        """Mark an active escalation 'acknowledged' or 'done'; returns False if it wasn't active"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE escalations SET state = ?, updated_at = ? WHERE incident_id = ? AND state = 'active'",
+                (state, time.time(), incident_id))
+        return cursor.rowcount == 1
+
+    @staticmethod
+    def _as_dict(row):
+        incident_id, account_sid, contacts, call_message, sms_message, step, due_at, state = row
+        return {'incident_id': incident_id, 'account_sid': account_sid, 'contacts': json.loads(contacts),
+                'call_message': call_message, 'sms_message': sms_message, 'step': step,
+                'due_at': due_at, 'state': state}
+
+
+class Escalator:
+    """
+    Runs the escalation steps of every unacknowledged incident off one timer
+    wheel. Each step's alerts go through the outbox as a new round, so they
+    are durable and retried like the first alerts; the next step's due time
+    is stored before its timer is set, so a restart picks up where it stopped.
+    """
+
+    def __init__(self, store, wheel, after=ESCALATE_AFTER, escalation_contacts=ESCALATION_CONTACTS):
+        self.store = store
+        self.wheel = wheel
+        self.after = after
+        self.escalation_contacts = escalation_contacts
+        # Without escalation contacts there is no circle to widen
+        self.steps = STEPS if escalation_contacts else STEPS[:-1]
+        self._lock = threading.Lock()
+        self._timers = {}   # incident_id -> pending timer
+
+    def _schedule(self, incident_id, due_at):
+        timer = self.wheel.schedule(max(0.0, due_at - time.time()), self._fire, incident_id)
+        with self._lock:
+            previous = self._timers.pop(incident_id, None)
+            self._timers[incident_id] = timer
+        if previous is not None:
+            self.wheel.cancel(previous)
+
+    def start(self, incident_id, account_sid, contacts, call_message, sms_message):
+        """Begin escalating an incident whose first alerts were just sent; contacts are numbers, highest priority first"""
+        if self.after <= 0:
+            return
+        due_at = time.time() + self.after
+        if self.store.create(incident_id, account_sid, contacts, call_message, sms_message, due_at):
+            self._schedule(incident_id, due_at)
+
+    def acknowledge(self, incident_id):
+        """Stop escalating the incident"""
+        with self._lock:
+            timer = self._timers.pop(incident_id, None)
+        if timer is not None:
+            self.wheel.cancel(timer)
+        self.store.finish(incident_id, 'acknowledged')
+
+    def recover(self):
+        """Set timers for the escalations a previous process left active; overdue steps run straight away"""
+        escalations = self.store.active()
+        for escalation in escalations:
+            if self._step(escalation) is None:
+                # Saved under a longer list of steps, e.g. before SOS_ESCALATION_CONTACTS was emptied
+                self.store.finish(escalation['incident_id'], 'done')
+            else:
+                self._schedule(escalation['incident_id'], escalation['due_at'])
+        return len(escalations)
+
+    def _step(self, escalation):
+        """The escalation's next step, or None when it is past the last one"""
+        index = escalation['step']
+        return self.steps[index] if index < len(self.steps) else None
+
+    def status(self, incident_id):
+        """(state, next step or None, seconds until it) for the incident, or None without an escalation"""
+        escalation = self.store.get(incident_id)
+        if escalation is None:
+            return None
+        step = self._step(escalation) if escalation['state'] == 'active' else None
+        if escalation['state'] == 'active' and step is None:
+            return 'done', None, 0.0
+        return escalation['state'], step, max(0.0, escalation['due_at'] - time.time())
+
+    def _alerts(self, escalation, step, answered):
+        contacts = escalation['contacts']
+        if step == 'call_again':
+            return [('call', number, escalation['call_message']) for number in contacts if number not in answered]
+        if step == 'sms_again':
+            return [('sms', number, escalation['sms_message']) for number in contacts]
+        messages = []
+        for number in self.escalation_contacts:
+            messages.append(('call', number, escalation['call_message']))
+            messages.append(('sms', number, escalation['sms_message']))
+        return messages
+
+    def _fire(self, incident_id):
+        with self._lock:
+            self._timers.pop(incident_id, None)
+        escalation = self.store.get(incident_id)
+        if escalation is None or escalation['state'] != 'active':
+            return
+        answered = get_status_index().answered(incident_id)
+        if answered:
+            self.store.finish(incident_id, 'acknowledged')
+            log_event('acknowledged', incident_id, answered=sorted(answered))
+            return
+
+        index, step = escalation['step'], self._step(escalation)
+        if step is None:
+            self.store.finish(incident_id, 'done')
+            return
+        alerts = self._alerts(escalation, step, answered)
+        if alerts:
+            # Sent by the outbox worker straight away, with its retries; if
+            # no session has registered the account's credentials since a
+            # restart, they wait for one as the first alerts do
+            get_outbox().enqueue(incident_id, escalation['account_sid'], alerts, round=index + 1, handoff_grace=0)
+        log_event('escalated', incident_id, step=step, alerts=len(alerts))
+        if index + 1 < len(self.steps):
+            due_at = time.time() + self.after
+            self.store.advance(incident_id, index + 1, due_at)
+            self._schedule(incident_id, due_at)
+        else:
+            self.store.finish(incident_id, 'done')
+
+
+_wheel = None
+_wheel_lock = threading.Lock()
+_escalator = None
+_escalator_lock = threading.Lock()
+
+
+def get_timer_wheel():
+    """Return the process-wide timer wheel shared by escalation and live updates"""
+    global _wheel
+    if _wheel is None:
+        with _wheel_lock:
+            if _wheel is None:
+                _wheel = TimerWheel()
+    return _wheel
+
+
+def get_escalator():
+    """Return the process-wide escalator, rebuilding timers for persisted escalations on first use"""
+    global _escalator
+    if _escalator is None:
+        with _escalator_lock:
+            if _escalator is None:
+                escalator = Escalator(EscalationStore(), get_timer_wheel())
+                escalator.recover()
+                _escalator = escalator
+    return _escalator
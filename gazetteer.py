@@ -0,0 +1,180 @@
+import csv
+import math
+import os
+import time
+
+import numpy as np
+
+from metrics import span
+
+# CSV of named places (name, region, latitude, longitude). The k-d tree built
+# from it is saved next to it and memory-mapped on later starts.
+# Set SOS_GAZETTEER to another file, or to an empty value to turn offline
+# reverse geocoding off.
+GAZETTEER_CSV = os.environ.get('SOS_GAZETTEER', 'gazetteer.csv')
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 16
+
+
+def unit_vectors(latitudes, longitudes):
+    """Points on the unit sphere; straight-line distance between them orders like great-circle distance"""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def unit_vector(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return [math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)]
+
+
+def chord_to_km(squared_chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+
+class KDTree:
+    """
+    Implicit k-d tree over 3-D points. The points are stored in tree order in
+    one array and there are no node objects: the node for the range [lo, hi)
+    is the point at its midpoint, split on axis depth % 3, and ranges of
+    LEAF_SIZE points or fewer are scanned directly. That makes the array
+    itself the whole index, so it can be saved and memory-mapped as is.
+    """
+
+    def __init__(self, points):
+        # A plain ndarray view of a memory map indexes several times faster than the memmap
+        self.points = points.view(np.ndarray)
+
+    @staticmethod
+    def build_order(points):
+        """Permutation that puts the points in tree order"""
+        order = np.arange(len(points))
+        stack = [(0, len(points), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            mid = (lo + hi) // 2
+            segment = order[lo:hi]
+            order[lo:hi] = segment[np.argpartition(points[segment, depth % 3], mid - lo)]
+            stack.append((lo, mid, depth + 1))
+            stack.append((mid + 1, hi, depth + 1))
+        return order
+
+    def nearest(self, point):
+        """Return (index, squared distance) of the stored point closest to the given one"""
+        points = self.points
+        q = list(point)
+        best = [math.inf, -1]
+
+        def search(lo, hi, depth):
+            if hi - lo <= LEAF_SIZE:
+                for i, (x, y, z) in enumerate(points[lo:hi].tolist(), lo):
+                    distance = (x - q[0]) ** 2 + (y - q[1]) ** 2 + (z - q[2]) ** 2
+                    if distance < best[0]:
+                        best[0], best[1] = distance, i
+                return
+            mid = (lo + hi) // 2
+            node = points[mid].tolist()
+            distance = (node[0] - q[0]) ** 2 + (node[1] - q[1]) ** 2 + (node[2] - q[2]) ** 2
+            if distance < best[0]:
+                best[0], best[1] = distance, mid
+            diff = q[depth % 3] - node[depth % 3]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            search(near[0], near[1], depth + 1)
+            # Only cross the split if the other side could hold something closer
+            if diff * diff < best[0]:
+                search(far[0], far[1], depth + 1)
+
+        search(0, len(points), 0)
+        return best[1], best[0]
+
+
+class Gazetteer:
+    """Nearest-place lookups over a bundled gazetteer"""
+
+    def __init__(self, tree, labels, build_seconds=0.0, load_seconds=0.0):
+        self.tree = tree
+        self.labels = labels
+        self.build_seconds = build_seconds
+        self.load_seconds = load_seconds
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def nbytes(self):
+        return self.tree.points.nbytes + self.labels.nbytes
+
+    def nearest(self, latitude, longitude):
+        """Return (place, distance in km) for the closest named place"""
+        index, squared_chord = self.tree.nearest(unit_vector(latitude, longitude))
+        return str(self.labels[index]), chord_to_km(squared_chord)
+
+    def describe(self, latitude, longitude):
+        """An address-like description of the coordinates, e.g. 'Near Najafgarh, ... (1.2 km)'"""
+        place, distance = self.nearest(latitude, longitude)
+        return f"Near {place} ({distance:.1f} km)"
+
+
+def _read_csv(path):
+    labels, latitudes, longitudes = [], [], []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                latitude, longitude = float(row['latitude']), float(row['longitude'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            region = (row.get('region') or '').strip()
+            labels.append(f"{row['name'].strip()}, {region}" if region else row['name'].strip())
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+    return labels, latitudes, longitudes
+
+
+def _save(path, array):
+    # Write to a temporary file first so a concurrent start never maps a half-written index
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        np.save(f, array)
+    os.replace(temporary, path)
+
+
+def load_gazetteer(path=GAZETTEER_CSV):
+    """
+    Return a Gazetteer for the CSV at path, or None if there is none. The
+    index is built once and saved as <path>.index.npy and <path>.labels.npy;
+    later starts memory-map those instead of parsing the CSV again.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    index_path, labels_path = f"{path}.index.npy", f"{path}.labels.npy"
+    source_mtime = os.path.getmtime(path)
+
+    started = time.perf_counter()
+    if all(os.path.exists(p) and os.path.getmtime(p) >= source_mtime for p in (index_path, labels_path)):
+        try:
+            with span('gazetteer_load'):
+                points = np.load(index_path, mmap_mode='r')
+                labels = np.load(labels_path, mmap_mode='r')
+            if len(points) == len(labels):
+                return Gazetteer(KDTree(points), labels, load_seconds=time.perf_counter() - started)
+        except (OSError, ValueError) as e:
+            print(f"Rebuilding gazetteer index: {e}")
+
+    with span('gazetteer_build'):
+        labels, latitudes, longitudes = _read_csv(path)
+        if not labels:
+            return None
+        points = unit_vectors(latitudes, longitudes)
+        order = KDTree.build_order(points)
+        points = np.ascontiguousarray(points[order])
+        labels = np.array(labels)[order]
+    build_seconds = time.perf_counter() - started
+    try:
+        _save(index_path, points)
+        _save(labels_path, labels)
+    except OSError as e:
+        print(f"Could not save gazetteer index: {e}")
+    return Gazetteer(KDTree(points), labels, build_seconds=build_seconds)
@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from gazetteer import load_gazetteer
+from metrics import geocode_cache, span
+
+NOMINATIM_URL = os.environ.get('SOS_NOMINATIM_URL', 'https://nominatim.openstreetmap.org/reverse')
+USER_AGENT = 'SOSEmergencyApp/1.0'
+# With a gazetteer, refine offline answers with Nominatim in the background (set to 0 to stay offline)
+REFINE_ONLINE = os.environ.get('SOS_GEOCODE_REFINE', '1') != '0'
+# Most cells waiting for a background refinement; misses beyond it keep the gazetteer answer
+MAX_PENDING_REFINES = int(os.environ.get('SOS_GEOCODE_MAX_REFINES', '60'))
+
+
+class ReverseGeocoder:
+    """
+    Reverse geocoder with a process-wide cache in front of Nominatim.
+
+    Coordinates are snapped to a grid cell (3 decimals is roughly 110 m) and
+    the cell is the cache key, so nearby lookups share one entry. Entries are
+    evicted least-recently-used and expire after `ttl` seconds. Concurrent
+    lookups for the same cell wait on a single in-flight request. Repeated
+    failures open a circuit breaker, and while it is open we answer with the
+    stale entry for the cell, or else the coordinates themselves.
+
+    With an offline gazetteer, a cache miss is answered straight away with
+    the nearest named place, and the Nominatim address for the cell is
+    fetched in the background to replace it in the cache. Each cell has at
+    most one refinement pending, and at most `max_refines` are queued.
+    Lookups with wait=False use the same queue when there is no gazetteer.
+    """
+
+    def __init__(self, precision=3, max_entries=4096, ttl=6 * 3600,
+                 timeout=(2.0, 3.0), min_interval=1.0,
+                 failure_threshold=3, reset_after=30.0,
+                 offline=None, refine=True, max_refines=MAX_PENDING_REFINES):
+        self.precision = precision
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.timeout = timeout
+        # Nominatim's usage policy allows at most one request per second
+        self.min_interval = min_interval
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # cell -> (address, expires_at)
+        self._inflight = {}           # cell -> Future
+        self._session = None
+        self._last_request_at = 0.0
+        self._failures = 0
+        self._open_until = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.offline = offline
+        self.refine = refine
+        self.max_refines = max_refines
+        self._refines = 0             # refinements queued or running
+        # Nominatim allows one request a second, so a single refining thread is enough
+        self._refiner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='geocode-refine')
+
+    def cell(self, latitude, longitude):
+        return round(latitude, self.precision), round(longitude, self.precision)
+
+    def lookup(self, latitude, longitude, wait=True):
+        """
+        Return the address for the coordinates, from cache when possible.
+        Without wait, a miss never blocks on Nominatim: it is answered from the
+        gazetteer or _fallback, and the address is fetched in the background.
+        """
+        key = self.cell(latitude, longitude)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] > now:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                geocode_cache.inc(result='hit')
+                return entry[0]
+            self.misses += 1
+            geocode_cache.inc(result='miss')
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if self.offline is not None or not wait:
+            if owner:
+                with self._lock:
+                    # SOS_GEOCODE_REFINE only keeps gazetteer answers offline
+                    queue = (self.refine or self.offline is None) and self._refines < self.max_refines
+                    if queue:
+                        self._refines += 1
+                    else:
+                        self._inflight.pop(key, None)
+                if queue:
+                    self._refiner.submit(self._refine, key, latitude, longitude, future)
+            if self.offline is None:
+                return self._fallback(key, latitude, longitude)
+            with span('offline_geocode'):
+                return self.offline.describe(latitude, longitude)
+
+        if not owner:
+            try:
+                return future.result(timeout=sum(self.timeout))
+            except Exception:
+                return self._fallback(key, latitude, longitude)
+        return self._resolve(key, latitude, longitude, future)
+
+    def _refine(self, key, latitude, longitude, future):
+        # Background refinement can wait its turn instead of hitting the rate limit
+        try:
+            delay = self._last_request_at + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._resolve(key, latitude, longitude, future)
+        finally:
+            with self._lock:
+                self._refines -= 1
+
+    def _resolve(self, key, latitude, longitude, future):
+        address = None
+        try:
+            address = self._fetch(latitude, longitude)
+        except Exception:
+            address = None
+        finally:
+            with self._lock:
+                if address is not None:
+                    self._store(key, address)
+                self._inflight.pop(key, None)
+            if address is None:
+                address = self._fallback(key, latitude, longitude)
+            future.set_result(address)
+        return address
+
+    def _http(self):
+        """The HTTP session, created on the first request so startup doesn't import requests"""
+        if self._session is None:
+            import requests
+            session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+            with self._lock:
+                if self._session is None:
+                    self._session = session
+        return self._session
+
+    def _fetch(self, latitude, longitude):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                raise RuntimeError("reverse geocoding circuit is open")
+            if now - self._last_request_at < self.min_interval:
+                raise RuntimeError("reverse geocoding rate limit reached")
+            self._last_request_at = now
+
+        try:
+            with span('reverse_geocode_http'):
+                response = self._http().get(
+                    NOMINATIM_URL,
+                    params={'format': 'jsonv2', 'lat': latitude, 'lon': longitude},
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                address = response.json().get('display_name')
+            if not address:
+                raise ValueError("no address in reverse geocoding response")
+        except Exception:
+            with self._lock:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._open_until = time.monotonic() + self.reset_after
+            raise
+
+        with self._lock:
+            self._failures = 0
+            self._open_until = 0.0
+        return address
+
+    def _store(self, key, address):
+        self._cache[key] = (address, time.monotonic() + self.ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _fallback(self, key, latitude, longitude):
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is not None:
+            return entry[0]
+        if self.offline is not None:
+            return self.offline.describe(latitude, longitude)
+        # Never another cell's address: it may be another user's location
+        return f"{latitude:.5f}, {longitude:.5f}"
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    """Return the reverse geocoder shared by all sessions in this process"""
+    global _geocoder
+    if _geocoder is None:
+        with _geocoder_lock:
+            if _geocoder is None:
+                _geocoder = ReverseGeocoder(offline=load_gazetteer(), refine=REFINE_ONLINE)
+    return _geocoder
@@ -0,0 +1,297 @@
+import hashlib
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+# Append-only history of every incident: triggers, the location and alerts
+# sent, each send's outcome, delivery statuses, escalations and resets. An
+# empty value turns the log off.
+INCIDENT_LOG = os.environ.get('SOS_INCIDENT_LOG', 'sos_incidents.log')
+# Most records the writer thread writes in one go
+WRITE_BATCH = 1024
+
+# Each record is a frame: payload length and CRC-32, then compact JSON
+FRAME_HEADER = struct.Struct('<II')
+# Side index, one fixed-size entry per record in log order: user key, time,
+# offset of the frame in the log, and the entry index of the same user's
+# previous record (-1 for their first), so a user's records form a chain
+INDEX_ENTRY = np.dtype([('user', '<u8'), ('at', '<f8'), ('offset', '<i8'), ('previous', '<i8')])
+
+
+def user_key(user_id):
+    """64-bit key of a user in the index; 0 for records with no known user"""
+    if user_id is None:
+        return 0
+    return int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'little') or 1
+
+
+def encode_frame(record):
+    payload = json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode()
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_frame(buffer, offset):
+    """(record, offset of the next frame), or None for a torn or corrupt frame"""
+    if offset + FRAME_HEADER.size > len(buffer):
+        return None
+    length, crc = FRAME_HEADER.unpack_from(buffer, offset)
+    start = offset + FRAME_HEADER.size
+    payload = bytes(buffer[start:start + length])
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        return None
+    return json.loads(payload), start + length
+
+
+class IncidentLog:
+    """
+    Length-prefixed frames appended to one log file, with a fixed-size side
+    index. append() only queues the record, so the dispatch path never
+    waits on disk; a writer thread encodes and appends queued records in
+    batches. Queries map both files read-only: a user's history walks their
+    chain back from the newest entry, touching only their own records, and
+    a time range over all users is a binary search on the index.
+    """
+
+    def __init__(self, path=INCIDENT_LOG):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._count = 0      # index entries written and flushed
+        self._heads = {}     # user key -> index of their newest entry
+        self._last_at = 0.0  # index times never go backwards, so ranges can be bisected
+        self._users = {}     # incident_id -> user_id, for records logged without one
+        self._maps = None    # (index entries, log) mapped by the last query
+        self._recover()
+        self._log = open(self.path, 'ab')
+        self._index = open(self.index_path, 'ab')
+        threading.Thread(target=self._run, name='sos-incident-log', daemon=True).start()
+
+    def _recover(self):
+        """Drop torn frames and index entries a crash left behind, and index frames that missed the index"""
+        for path in (self.path, self.index_path):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+        log_size = os.path.getsize(self.path)
+        entries = np.fromfile(self.index_path, dtype=INDEX_ENTRY,
+                              count=os.path.getsize(self.index_path) // INDEX_ENTRY.itemsize)
+        # Entries past the end of the log point at frames that were never written
+        entries = entries[:np.searchsorted(entries['offset'], log_size)]
+        end = 0
+        missing = []
+        if log_size:
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while len(entries):
+                    decoded = decode_frame(data, int(entries['offset'][-1]))
+                    if decoded is not None:
+                        end = decoded[1]
+                        break
+                    entries = entries[:-1]
+                # Only the frames after the last indexed one are read
+                while True:
+                    decoded = decode_frame(data, end)
+                    if decoded is None:
+                        break
+                    missing.append((decoded[0], end))
+                    end = decoded[1]
+        with open(self.path, 'r+b') as f:
+            f.truncate(end)
+        with open(self.index_path, 'r+b') as f:
+            f.truncate(len(entries) * INDEX_ENTRY.itemsize)
+
+        self._count = len(entries)
+        if len(entries):
+            self._last_at = float(entries['at'][-1])
+            # Last occurrence of each user key is the head of their chain
+            keys, first_from_end = np.unique(entries['user'][::-1], return_index=True)
+            self._heads = dict(zip(keys.tolist(), (len(entries) - 1 - first_from_end).tolist()))
+        if missing:
+            entries, heads = self._index_entries(missing)
+            with open(self.index_path, 'ab') as f:
+                f.write(entries.tobytes())
+            self._publish(entries, heads)
+
+    def _index_entries(self, records):
+        """Index entries for (record, offset) pairs that follow the current entries, and the new chain heads"""
+        entries = np.empty(len(records), dtype=INDEX_ENTRY)
+        heads = {}
+        for i, (record, offset) in enumerate(records):
+            key = user_key(record.get('user_id'))
+            self._last_at = max(self._last_at, record['at'])
+            entries[i] = (key, self._last_at, offset, heads.get(key, self._heads.get(key, -1)))
+            heads[key] = self._count + i
+        return entries, heads
+
+    def _publish(self, entries, heads):
+        with self._lock:
+            self._heads.update(heads)
+            self._count += len(entries)
+
+    def append(self, kind, incident_id, user_id=None, **fields):
+        """
+        Queue a record; never blocks. Records of an incident after its
+        'triggered' record may leave out user_id.
+        """
+        record = {'kind': kind, 'incident_id': incident_id, 'user_id': user_id, 'at': time.time()}
+        record.update(fields)
+        self._queue.put(record)
+
+    def wait(self, timeout=5.0):
+        """Block until every record queued so far is written, e.g. before a short-lived process exits"""
+        written = threading.Event()
+        self._queue.put(written)
+        return written.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            waiters = [item for item in batch if isinstance(item, threading.Event)]
+            try:
+                self._write([item for item in batch if not isinstance(item, threading.Event)])
+            except Exception as e:
+                print(f"Incident log write failed: {e}")
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch):
+        if not batch:
+            return
+        offset = self._log.tell()
+        frames, records = [], []
+        for record in batch:
+            if record['user_id'] is None:
+                record['user_id'] = self._users.get(record['incident_id'])
+            elif record['incident_id'] is not None:
+                self._users[record['incident_id']] = record['user_id']
+            frame = encode_frame(record)
+            frames.append(frame)
+            records.append((record, offset))
+            offset += len(frame)
+        while len(self._users) > 100000:
+            del self._users[next(iter(self._users))]
+        # The frames reach the log before their index entries, so a reader
+        # never finds an entry whose frame isn't there yet
+        self._log.write(b''.join(frames))
+        self._log.flush()
+        entries, heads = self._index_entries(records)
+        self._index.write(entries.tobytes())
+        self._index.flush()
+        self._publish(entries, heads)
+
+    def _mapped(self, count):
+        """Read-only maps of the first count index entries and the log, remapped only when they have grown"""
+        maps = self._maps
+        if maps is None or len(maps[0]) < count:
+            entries = np.memmap(self.index_path, dtype=INDEX_ENTRY, mode='r', shape=(count,))
+            with open(self.path, 'rb') as f:
+                log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # A plain ndarray view of a memory map indexes several times faster than the memmap
+            maps = self._maps = (entries.view(np.ndarray), log)
+        return maps[0][:count], maps[1]
+
+    def records(self, user_id=None, since=None, until=None, limit=None):
+        """
+        Records newest first, for one user or everyone, logged in
+        [since, until) when given
+        """
+        with self._lock:
+            count = self._count
+            head = self._heads.get(user_key(user_id), -1)
+        if count == 0:
+            return []
+        entries, log = self._mapped(count)
+        since = -np.inf if since is None else since
+        until = np.inf if until is None else until
+        if user_id is None:
+            times = entries['at']
+            positions = range(np.searchsorted(times, until) - 1, np.searchsorted(times, since) - 1, -1)
+        else:
+            positions = self._chain(entries, head, until)
+        results = []
+        for position in positions:
+            entry = entries[position]
+            if entry['at'] < since or (limit is not None and len(results) >= limit):
+                break
+            decoded = decode_frame(log, int(entry['offset']))
+            # Two users can share a key; the record itself says whose it is
+            if decoded is not None and (user_id is None or decoded[0].get('user_id') == user_id):
+                results.append(decoded[0])
+        return results
+
+    @staticmethod
+    def _chain(entries, position, until):
+        """Entry positions of one user's chain from position back, skipping entries from until on"""
+        while position >= 0:
+            if entries['at'][position] < until:
+                yield position
+            position = int(entries['previous'][position])
+
+    def incidents(self, user_id, since=None, until=None, limit=20):
+        """A user's incidents, newest first, each with its records oldest first"""
+        incidents = {}
+        for record in self.records(user_id, since, until):
+            incident = incidents.get(record['incident_id'])
+            if incident is None:
+                if len(incidents) >= limit:
+                    break
+                incident = incidents[record['incident_id']] = []
+            incident.append(record)
+        return [(incident_id, records[::-1]) for incident_id, records in incidents.items()]
+
+
+def incident_summary(incident_id, records):
+    """One history row for an incident from its records, oldest first"""
+    summary = {'Incident': incident_id[:8], 'Started': None, 'Trigger': None, 'Location': None, 'Alerts sent': 0, 'Delivered': 0,
+               'Failed': 0, 'Escalations': 0, 'Location updates': 0, 'Reset': None}
+    for record in records:
+        kind = record['kind']
+        if kind == 'triggered' and summary['Started'] is None:
+            summary['Started'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['at']))
+            summary['Trigger'] = record.get('source')
+        elif kind == 'dispatched' and record.get('location'):
+            summary['Location'] = record['location'].get('address')
+        elif kind == 'alert' and record.get('sid'):
+            summary['Alerts sent'] += 1
+        elif kind == 'status':
+            summary['Delivered'] += record.get('delivered', False)
+            summary['Failed'] += record.get('failed', False)
+        elif kind == 'escalated':
+            summary['Escalations'] += 1
+        elif kind == 'location_update':
+            summary['Location updates'] += 1
+        elif kind == 'reset':
+            summary['Reset'] = time.strftime('%H:%M:%S', time.localtime(record['at']))
+    return summary
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_incident_log():
+    """Return the process-wide incident log, or None when SOS_INCIDENT_LOG is empty"""
+    global _log
+    if _log is None and INCIDENT_LOG:
+        with _log_lock:
+            if _log is None:
+                _log = IncidentLog(INCIDENT_LOG)
+    return _log
+
+
+def log_event(kind, incident_id, user_id=None, **fields):
+    """Queue a record on the incident log, if there is one"""
+    incident_log = get_incident_log()
+    if incident_log is not None:
+        incident_log.append(kind, incident_id, user_id, **fields)
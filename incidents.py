@@ -0,0 +1,203 @@
+from delivery import STATUS_CALLBACK_URL, live_delivery_status
+from escalation import get_escalator
+from incident_log import log_event
+from live_updates import LIVE_UPDATES, get_live_updates
+from outbox import HANDOFF_GRACE, get_outbox, register_credentials
+from services import get_emergency_services
+from sms import MessageTemplate, SMS_SEGMENTS, fit_segments, shorter_addresses, to_gsm7
+
+CALL_MESSAGE = MessageTemplate(
+    "{user_name} needs immediate assistance. Location: {address}. Coordinates: {latitude}, {longitude}")
+SMS_MESSAGE = MessageTemplate(
+    "EMERGENCY SOS ALERT! {user_name} needs immediate help. Location: {address}. "
+    "Google Maps: {google_maps_link}{nearby}")
+# Used when the full alert would take more than SMS_SEGMENTS segments
+COMPACT_SMS_MESSAGE = MessageTemplate("SOS! {user_name} needs help at {address} {google_maps_link}{nearby}")
+MINIMAL_SMS_MESSAGE = MessageTemplate("SOS! {user_name} needs help: {google_maps_link}")
+
+
+def nearby_help(location):
+    """Nearest hospital and police station for the location, or "" without a services dataset"""
+    services = get_emergency_services()
+    if services is None:
+        return ""
+    return services.describe(location['latitude'], location['longitude'])
+
+
+def sms_candidates(user_name, address, link, nearby):
+    """
+    Alert texts from the most to the least complete. The address is kept in
+    its own script while that fits; after that everything is GSM-7, which
+    fits 160 characters per segment instead of 70, and the address and
+    nearby help are shortened step by step. The Maps link is always kept.
+    """
+    yield SMS_MESSAGE.render(user_name=user_name, address=address, google_maps_link=link,
+                             nearby=f" Nearest help - {nearby}" if nearby else "")
+    user_name, address, nearby = to_gsm7(user_name), to_gsm7(address), to_gsm7(nearby)
+    yield SMS_MESSAGE.render(user_name=user_name, address=address, google_maps_link=link,
+                             nearby=f" Nearest help - {nearby}" if nearby else "")
+    # Nearest help is "Hospital: ... (1.2 km); Police: ... (0.8 km)"; then keep only the first
+    helps = [(f" {nearby}", 2), (f" {nearby.split('; ')[0]}", 1)] if nearby else []
+    for help_text, min_parts in helps:
+        for shorter in shorter_addresses(address, min_parts):
+            yield COMPACT_SMS_MESSAGE.render(user_name=user_name, address=shorter, google_maps_link=link,
+                                             nearby=help_text)
+    for shorter in shorter_addresses(address):
+        yield COMPACT_SMS_MESSAGE.render(user_name=user_name, address=shorter, google_maps_link=link, nearby="")
+    yield MINIMAL_SMS_MESSAGE.render(user_name=user_name, google_maps_link=link)
+
+
+def build_messages(user_name, location, max_segments=SMS_SEGMENTS):
+    """
+    Return the (call, SMS) alert texts for a user at a location. The SMS is
+    the most complete text that fits in max_segments segments.
+    """
+    # The call is read out by an English voice, which skips other scripts,
+    # so the name and address are romanized
+    call_message = CALL_MESSAGE.render(user_name=to_gsm7(user_name), address=to_gsm7(location['address']),
+                                       latitude=location['latitude'], longitude=location['longitude'])
+    sms_message = fit_segments(
+        sms_candidates(user_name, location['address'], location['google_maps_link'], nearby_help(location)),
+        max_segments)
+    return call_message, sms_message
+
+
+def normalize_contacts(rows):
+    """Clean contact rows from the settings editor or a profile: drop blank numbers, sort by priority"""
+    contacts = []
+    for row in rows:
+        number = str(row.get('number') or "").strip()
+        if not number or number == "nan":
+            continue
+        try:
+            priority = int(row.get('priority'))
+        except (TypeError, ValueError):
+            priority = len(contacts) + 1
+        name = row.get('name')
+        name = "" if name is None or str(name) == "nan" else str(name).strip()
+        contacts.append({'name': name, 'number': number, 'priority': priority})
+    return sorted(contacts, key=lambda contact: contact['priority'])
+
+
+def new_delivery_status(contacts):
+    """Per-contact delivery table, keyed by number, with every channel pending"""
+    return {
+        contact['number']: {'Contact': contact['name'] or contact['number'], 'Call': "⏳", 'SMS': "⏳"}
+        for contact in contacts
+    }
+
+
+def update_delivery_status(delivery_status, result):
+    if result.ok:
+        mark = "✅"
+    elif result.timed_out:
+        mark = "⏳ still sending"
+    else:
+        mark = f"❌ {result.error} (retrying)"
+    delivery_status[result.target]['Call' if result.channel == 'call' else 'SMS'] = mark
+
+
+def handoff_counts(delivery_status):
+    """(accepted, still sending, rejected) hand-offs to Twilio in a delivery table"""
+    marks = [row[column] for row in delivery_status.values() for column in ('Call', 'SMS')]
+    return (sum(mark == "✅" for mark in marks), sum(mark.startswith("⏳") for mark in marks),
+            sum(mark.startswith("❌") for mark in marks))
+
+
+def outbox_delivery_status(incident_id, delivery_status):
+    """
+    The delivery table with each alert's current state in the outbox, so
+    retries by the worker and sends that finished after their latency budget
+    show up. An alert stays accepted once any round of it was sent.
+    """
+    table = {number: dict(row) for number, row in delivery_status.items()}
+    sent = set()
+    for channel, number, status, attempts, sid, last_error in get_outbox().statuses(incident_id):
+        row = table.get(number)
+        if row is None or (channel, number) in sent:
+            continue
+        if status == 'sent':
+            mark = "✅"
+            sent.add((channel, number))
+        elif status == 'failed':
+            mark = f"❌ {last_error}"
+        elif status == 'sending':
+            mark = "⏳ still sending"
+        elif last_error:
+            mark = f"❌ {last_error} (retrying)"
+        else:
+            mark = "⏳"
+        row['Call' if channel == 'call' else 'SMS'] = mark
+    return table
+
+
+def panel_status(incident):
+    """
+    (level, message, rows) for the SOS panel: st.success/warning/error, what
+    to tell the user, and the per-contact delivery table. Help is only
+    promised once Twilio has taken an alert, and, when delivery is tracked,
+    once one has been delivered.
+    """
+    if incident is None or incident['duplicate']:
+        return 'warning', "SOS alert has been triggered.", []
+    rows, (delivered, failed, tracked), (accepted, sending) = [], (0, 0, 0), (0, 0)
+    if incident['delivery_status']:
+        table = outbox_delivery_status(incident['incident_id'], incident['delivery_status'])
+        rows, (delivered, failed, tracked) = live_delivery_status(incident['incident_id'], table)
+        accepted, sending, _ = handoff_counts(table)
+    if delivered:
+        return 'success', "SOS alert has been triggered. Help is on the way!", rows
+    if tracked and failed == tracked:
+        return 'error', "None of the alerts could be delivered. Call emergency services directly.", rows
+    if not accepted and not sending:
+        return 'error', "No alert could be sent. Call emergency services directly.", rows
+    if not accepted:
+        return 'warning', "Still sending the alerts. If this takes long, call emergency services directly.", rows
+    if STATUS_CALLBACK_URL:
+        return 'warning', "SOS alert sent; waiting for delivery to be confirmed.", rows
+    return 'success', "SOS alert has been sent to your contacts. Help is on the way!", rows
+
+
+def queue_incident(incident_id, credentials, contacts, call_message, sms_message, location=None, follow=None,
+                   handoff_grace=HANDOFF_GRACE):
+    """
+    Write a call and an SMS for every contact to the durable outbox and
+    return their keys. Keys are per incident, so queueing the same incident
+    again only adds what is missing. Unless they are claimed and sent first,
+    the outbox worker sends them once handoff_grace has passed. The incident
+    is escalated until a contact answers or it is reset. With
+    follow=(session_id, user_name), contacts are also texted the session's
+    position as it moves away from location, until the incident is reset.
+    """
+    outbox = get_outbox()
+    register_credentials(credentials)
+    numbers = [contact['number'] for contact in contacts]
+    messages = []
+    for number in numbers:
+        messages.append(('call', number, call_message))
+        messages.append(('sms', number, sms_message))
+    keys = outbox.enqueue(incident_id, credentials['twilio_account_sid'], messages, handoff_grace=handoff_grace)
+    log_event('dispatched', incident_id, contacts=numbers, location=location, call_message=call_message,
+              sms_message=sms_message)
+    # Re-alert, then widen the circle, if nobody picks up
+    get_escalator().start(incident_id, credentials['twilio_account_sid'], numbers, call_message, sms_message)
+    if follow is not None and location is not None and LIVE_UPDATES:
+        session_id, user_name = follow
+        get_live_updates().start(incident_id, session_id, credentials['twilio_account_sid'], numbers,
+                                 user_name, location)
+    return keys
+
+
+def dispatch_incident(incident_id, credentials, contacts, call_message, sms_message, location=None, follow=None):
+    """
+    Queue the incident's alerts (see queue_incident), send them all at once,
+    and yield a ChannelResult for each as it finishes. Failed sends are
+    retried by the outbox worker.
+    """
+    outbox = get_outbox()
+    keys = queue_incident(incident_id, credentials, contacts, call_message, sms_message, location, follow)
+    rows = outbox.claim(keys)
+    try:
+        yield from outbox.deliver(rows)
+    finally:
+        outbox.flush()
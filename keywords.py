@@ -0,0 +1,132 @@
+import threading
+import unicodedata
+from collections import deque
+
+# Emergency phrases per recognition language. The browser listens in these
+# languages and the server matches every language at once.
+DEFAULT_KEYWORDS = {
+    'en-US': ['help', 'emergency', 'sos', 'danger', 'accident', 'save me', 'help me'],
+    'hi-IN': ['मदद', 'आपातकाल', 'खतरा', 'बचाओ', 'सहायता', 'मुझे बचाओ'],
+    'ta-IN': ['உதவி', 'அவசரம்', 'ஆபத்து', 'காப்பாற்று', 'என்னை காப்பாற்று'],
+}
+CUSTOM_LANGUAGE = 'custom'
+
+
+def normalize(text):
+    """NFC-compose and casefold, so equivalent spellings of a phrase compare equal"""
+    return unicodedata.normalize('NFC', unicodedata.normalize('NFC', text).casefold())
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over normalized phrases. Scanning a transcript
+    walks it once, so the cost grows with the transcript's length and the
+    number of matches, not with how many phrases there are.
+    """
+
+    def __init__(self, phrases):
+        # phrases: iterable of (phrase, language)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for phrase, language in phrases:
+            key = normalize(phrase).strip()
+            if not key:
+                continue
+            state = 0
+            for char in key:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._out[state] += ((phrase, language, len(key)),)
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                # Fold the suffix state's matches in so scanning never walks output chains
+                self._out[child] += self._out[self._fail[child]]
+
+    def find(self, text):
+        """Return (phrase, language, start, end) for every match in the text"""
+        matches = []
+        state = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for index, char in enumerate(normalize(text)):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for phrase, language, length in out[state]:
+                matches.append((phrase, language, index + 1 - length, index + 1))
+        return matches
+
+
+class KeywordSpotter:
+    """
+    Matches transcripts against the built-in phrases plus each profile's
+    custom keywords. A profile's automaton is compiled once when its custom
+    keywords change, so adding keywords never slows down scanning.
+    """
+
+    def __init__(self, keywords=DEFAULT_KEYWORDS):
+        self._base = [(phrase, language) for language, phrases in keywords.items() for phrase in phrases]
+        self._default = KeywordAutomaton(self._base)
+        self._lock = threading.Lock()
+        self._profiles = {}   # profile_id -> (custom keywords tuple, automaton)
+
+    def set_custom_keywords(self, profile_id, keywords):
+        custom = tuple(sorted({k.strip() for k in keywords if k and k.strip()}))
+        with self._lock:
+            current = self._profiles.get(profile_id)
+            if current is not None and current[0] == custom:
+                return
+        automaton = self._default
+        if custom:
+            automaton = KeywordAutomaton(self._base + [(k, CUSTOM_LANGUAGE) for k in custom])
+        with self._lock:
+            self._profiles[profile_id] = (custom, automaton)
+
+    def _automaton(self, profile_id):
+        with self._lock:
+            entry = self._profiles.get(profile_id)
+        return entry[1] if entry is not None else self._default
+
+    def scan(self, transcript, profile_id=None):
+        """Return the first match in the transcript as (phrase, language, start, end), or None"""
+        matches = self._automaton(profile_id).find(transcript)
+        return min(matches, key=lambda match: match[3]) if matches else None
+
+    def scan_batch(self, transcripts, profile_id=None):
+        """Scan several transcripts (e.g. interim results) and return one result per transcript"""
+        automaton = self._automaton(profile_id)
+        results = []
+        for transcript in transcripts:
+            matches = automaton.find(transcript)
+            results.append(min(matches, key=lambda match: match[3]) if matches else None)
+        return results
+
+
+_spotter = None
+_spotter_lock = threading.Lock()
+
+
+def get_keyword_spotter():
+    """Return the keyword spotter shared by all sessions in this process"""
+    global _spotter
+    if _spotter is None:
+        with _spotter_lock:
+            if _spotter is None:
+                _spotter = KeywordSpotter()
+    return _spotter
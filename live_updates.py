@@ -0,0 +1,150 @@
+import math
+import os
+import threading
+import time
+
+from escalation import get_timer_wheel
+from incident_log import log_event
+from metrics import live_updates_total
+from outbox import get_outbox
+from services import haversine_km
+from sms import MessageTemplate, fit_segments, shorter_addresses, to_gsm7
+from tracking import FLUSH_SECONDS, describe_fix, get_track_store
+
+# Keep texting contacts the user's position while an SOS is active (set to 0
+# to send only the first alert)
+LIVE_UPDATES = os.environ.get('SOS_LIVE_UPDATES', '1') != '0'
+# An update goes out once the user has moved this far from the last position
+# sent, or this long after it if there is a newer fix
+MIN_DISTANCE_M = float(os.environ.get('SOS_LIVE_UPDATE_METRES', '200'))
+MAX_INTERVAL = float(os.environ.get('SOS_LIVE_UPDATE_SECONDS', '300'))
+# Fewest seconds between two updates to the same contacts, however fast the user moves
+MIN_INTERVAL = float(os.environ.get('SOS_LIVE_UPDATE_MIN_SECONDS', '60'))
+# Caps on each incident's updates, so a forgotten reset doesn't text contacts forever
+MAX_UPDATES = int(os.environ.get('SOS_LIVE_UPDATE_MAX', '30'))
+MAX_DURATION = float(os.environ.get('SOS_LIVE_UPDATE_DURATION', '3600'))
+
+LIVE_UPDATE_MESSAGE = MessageTemplate("SOS update: {user_name} is now at {address} {google_maps_link}")
+MINIMAL_LIVE_UPDATE_MESSAGE = MessageTemplate("SOS update: {user_name} is now at {google_maps_link}")
+
+
+def live_update_candidates(user_name, location):
+    """Update texts from the most to the least complete, all in GSM-7; the Maps link is always kept"""
+    user_name, address, link = to_gsm7(user_name), to_gsm7(location['address']), location['google_maps_link']
+    for shorter in shorter_addresses(address):
+        yield LIVE_UPDATE_MESSAGE.render(user_name=user_name, address=shorter, google_maps_link=link)
+    yield MINIMAL_LIVE_UPDATE_MESSAGE.render(user_name=user_name, google_maps_link=link)
+
+
+def distance_m(latitude, longitude, other_latitude, other_longitude):
+    return 1000 * float(haversine_km(math.radians(latitude), math.radians(longitude),
+                                     math.radians(other_latitude), math.radians(other_longitude)))
+
+
+class _Follow:
+    __slots__ = ('incident_id', 'session_id', 'account_sid', 'numbers', 'user_name', 'started_at',
+                 'sent_fix', 'sent_at', 'updates', 'timer')
+
+
+class LiveUpdates:
+    """
+    Texts an active incident's contacts where the user is now. Each incident
+    is checked on the shared timer wheel every time the browser uploads a
+    batch of fixes; every fix since the last update is coalesced into the
+    session's current best fix, and one SMS per contact goes out only when
+    that fix has moved far enough, or is newer and enough time has passed.
+    Updates go through the outbox as their own round, so they are retried
+    and rate limited per Twilio account like every other alert.
+    """
+
+    def __init__(self, wheel, min_distance=MIN_DISTANCE_M, max_interval=MAX_INTERVAL, min_interval=MIN_INTERVAL,
+                 max_updates=MAX_UPDATES, max_duration=MAX_DURATION, check_every=FLUSH_SECONDS):
+        self.wheel = wheel
+        self.min_distance = min_distance
+        self.max_interval = max_interval
+        self.min_interval = min_interval
+        self.max_updates = max_updates
+        self.max_duration = max_duration
+        self.check_every = check_every
+        self._lock = threading.Lock()
+        self._follows = {}   # incident_id -> _Follow
+
+    def start(self, incident_id, session_id, account_sid, numbers, user_name, location):
+        """Follow the session's track for an incident whose first alert gave contacts `location`"""
+        follow = _Follow()
+        follow.incident_id, follow.session_id, follow.account_sid = incident_id, session_id, account_sid
+        follow.numbers, follow.user_name = list(numbers), user_name
+        follow.started_at = follow.sent_at = time.time()
+        # The fix the first alert was built from; fixes up to it are already known to contacts
+        follow.sent_fix = (location.get('fixed_at') or follow.started_at, location['latitude'], location['longitude'])
+        follow.updates = 0
+        with self._lock:
+            if incident_id in self._follows:
+                return
+            self._follows[incident_id] = follow
+            follow.timer = self.wheel.schedule(self.check_every, self._check, incident_id)
+
+    def stop(self, incident_id):
+        with self._lock:
+            follow = self._follows.pop(incident_id, None)
+        if follow is not None:
+            self.wheel.cancel(follow.timer)
+
+    def status(self, incident_id):
+        """(updates sent, when the contacts were last told where the user is) or None when not following"""
+        with self._lock:
+            follow = self._follows.get(incident_id)
+            return None if follow is None else (follow.updates, follow.sent_at)
+
+    def _due(self, follow, fix, now):
+        """Why an update should go out for this fix now ('moved' or 'interval'), or None"""
+        if fix is None or fix[0] <= follow.sent_fix[0] or now - follow.sent_at < self.min_interval:
+            return None
+        _, sent_latitude, sent_longitude = follow.sent_fix
+        # Movement within the fix's own uncertainty is noise, not travel
+        moved = distance_m(sent_latitude, sent_longitude, fix[1], fix[2])
+        if moved >= max(self.min_distance, fix[3]):
+            return 'moved'
+        if now - follow.sent_at >= self.max_interval:
+            return 'interval'
+        return None
+
+    def _check(self, incident_id):
+        with self._lock:
+            follow = self._follows.get(incident_id)
+        if follow is None:
+            return
+        now = time.time()
+        if follow.updates >= self.max_updates or now - follow.started_at >= self.max_duration:
+            self.stop(incident_id)
+            return
+        fix = get_track_store().best(follow.session_id)
+        reason = self._due(follow, fix, now)
+        if reason is not None:
+            # The timer threads also run escalation, so never wait on Nominatim here
+            location = describe_fix(fix, wait=False)
+            message = fit_segments(live_update_candidates(follow.user_name, location))
+            follow.updates += 1
+            follow.sent_fix, follow.sent_at = fix[:3], now
+            get_outbox().enqueue(incident_id, follow.account_sid,
+                                 [('sms', number, message) for number in follow.numbers],
+                                 round=f"live{follow.updates}", handoff_grace=0)
+            live_updates_total.inc(reason=reason)
+            log_event('location_update', incident_id, reason=reason, latitude=location['latitude'],
+                      longitude=location['longitude'], address=location['address'], accuracy=location['accuracy'])
+        with self._lock:
+            if self._follows.get(incident_id) is follow:
+                follow.timer = self.wheel.schedule(self.check_every, self._check, incident_id)
+
+
+_live_updates = None
+_live_updates_lock = threading.Lock()
+
+
+def get_live_updates():
+    global _live_updates
+    if _live_updates is None:
+        with _live_updates_lock:
+            if _live_updates is None:
+                _live_updates = LiveUpdates(get_timer_wheel())
+    return _live_updates
@@ -0,0 +1,161 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+import sidecar
+
+# Seconds; wide enough for a cache hit (microseconds) and a slow Twilio call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_RECENT_SPANS = 2048
+
+# Trace id of the trigger being handled; spans recorded on this context carry it
+current_trace_id = contextvars.ContextVar('sos_trace_id', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in values)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}   # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {values[-1]}")
+        return lines
+
+
+alerts_total = Counter('sos_alerts_total', "SOS incidents triggered, by trigger source")
+channel_latency = Histogram('sos_channel_latency_seconds', "Time to hand one alert to Twilio, by channel")
+channel_failures = Counter('sos_channel_failures_total', "Alerts Twilio did not accept, by channel")
+stage_duration = Histogram('sos_stage_duration_seconds', "Duration of each traced stage of the SOS path")
+geocode_cache = Counter('sos_geocode_cache_requests_total', "Reverse geocode lookups, by cache result")
+sms_segments = Counter('sos_sms_segments_total', "Billed SMS segments sent, by encoding (GSM-7 or UCS-2)")
+status_callbacks = Counter('sos_status_callbacks_total', "Twilio delivery status callbacks, by channel and status")
+live_updates_total = Counter('sos_live_updates_total', "Live location updates texted to contacts, by reason")
+rerun_duration = Histogram('sos_rerun_duration_seconds', "Wall time of one full Streamlit script run")
+
+_metrics = [alerts_total, channel_latency, channel_failures, stage_duration, geocode_cache, sms_segments,
+            status_callbacks, live_updates_total, rerun_duration]
+_recent_alerts = deque(maxlen=10000)
+_recent_spans = deque(maxlen=MAX_RECENT_SPANS)
+
+
+def record_alert(source):
+    """Count a triggered incident; the source is reduced to voice/button to keep label values few"""
+    alerts_total.inc(source='voice' if source.startswith('Voice') else 'button')
+    _recent_alerts.append(time.time())
+
+
+@contextmanager
+def span(name, trace_id=None):
+    """Time a stage of the SOS path; the duration goes to the stage histogram and the recent-span log"""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        stage_duration.observe(duration, stage=name)
+        _recent_spans.append((trace_id or current_trace_id.get(), name, time.time() - duration,
+                              duration, error))
+
+
+def recent_spans(trace_id=None):
+    spans = list(_recent_spans)
+    if trace_id is not None:
+        spans = [s for s in spans if s[0] == trace_id]
+    return [
+        {'trace_id': t, 'name': n, 'start': start, 'duration_ms': round(d * 1000, 3), 'error': e}
+        for t, n, start, d, e in spans
+    ]
+
+
+def render():
+    """Prometheus text exposition of every metric plus a few derived gauges"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+
+    cutoff = time.time() - 60
+    lines += ["# HELP sos_alerts_last_minute SOS incidents triggered in the last 60 seconds",
+              "# TYPE sos_alerts_last_minute gauge",
+              f"sos_alerts_last_minute {sum(1 for t in list(_recent_alerts) if t >= cutoff)}"]
+
+    hits, misses = geocode_cache.value(result='hit'), geocode_cache.value(result='miss')
+    ratio = hits / (hits + misses) if hits + misses else 0.0
+    lines += ["# HELP sos_geocode_cache_hit_ratio Share of reverse geocode lookups served from cache",
+              "# TYPE sos_geocode_cache_hit_ratio gauge",
+              f"sos_geocode_cache_hit_ratio {ratio:.4f}"]
+    return '\n'.join(lines) + '\n'
+
+
+@sidecar.route('GET', '/metrics')
+def _serve_metrics(request):
+    return 200, {'Content-Type': 'text/plain; version=0.0.4'}, render().encode()
+
+
+@sidecar.route('GET', '/traces')
+def _serve_traces(request):
+    return sidecar.json_response(recent_spans(request.query.get('trace_id')))
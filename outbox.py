@@ -0,0 +1,314 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from delivery import track_alert
+from incident_log import log_event
+from dispatch import get_dispatch_engine, place_call, send_sms
+from profiles import get_profile_store
+
+OUTBOX_DB = os.environ.get('SOS_OUTBOX_DB', 'sos_outbox.db')
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+POLL_INTERVAL = 0.25
+# New alerts are sent straight away by the trigger path; the worker only
+# picks them up if they are still pending after this long
+HANDOFF_GRACE = 5.0
+# A claimed row is its process's to send for this long, and the process
+# renews the lease every LEASE_RENEW seconds while the send is in flight, so
+# a row left behind by a crash is requeued within about SEND_LEASE seconds
+SEND_LEASE = 30.0
+LEASE_RENEW = 10.0
+RECOVER_INTERVAL = 5.0
+# Seconds before looking again for the stored credentials of an account no profile uses
+CREDENTIALS_RETRY = 30.0
+
+SENDERS = {
+    'call': place_call,
+    'sms': send_sms,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    incident_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    to_number TEXT NOT NULL,
+    body TEXT NOT NULL,
+    account_sid TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    sid TEXT,
+    last_error TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_incident ON outbox (incident_id);
+"""
+
+# Credentials are kept in memory only, keyed by account SID, so the outbox
+# never stores auth tokens. Sessions register theirs when they start, and
+# the worker loads those of accounts with due alerts from the profile store,
+# so alerts left by a previous process don't wait for their user to return.
+_credentials = {}
+_missing_credentials = {}   # account SID -> when the profile store last had none
+
+
+def register_credentials(credentials):
+    if credentials.get('twilio_account_sid'):
+        _credentials[credentials['twilio_account_sid']] = dict(credentials)
+
+
+def registered_credentials(account_sid):
+    return _credentials.get(account_sid)
+
+
+def idempotency_key(incident_id, channel, to_number, round=0):
+    """Key of one alert; escalation rounds re-send to the same recipient under new keys"""
+    key = f"{incident_id}:{channel}:{to_number}"
+    return f"{key}:{round}" if round else key
+
+
+def backoff_delay(attempts):
+    """Exponential backoff with jitter for the given number of failed attempts"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Outbox:
+    """
+    Append-only SQLite outbox for alerts. Every alert is written, with an
+    idempotency key of incident, channel and recipient, before it is sent.
+    Rows move pending -> sending -> sent, or back to pending with a backoff
+    after a failure, so a rerun of the same incident never sends twice and a
+    restart picks up whatever was not confirmed sent. A claim is leased and
+    renewed while its send runs, so several processes can share one outbox
+    without requeueing each other's sends, and the sends of a process that
+    died are requeued soon after.
+    """
+
+    def __init__(self, path=OUTBOX_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if 'lease_until' not in columns:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+        self._lock = threading.Lock()
+        self._results = []
+        self._results_lock = threading.Lock()
+        self._sending = set()   # keys this process has claimed and not yet flushed
+
+    def enqueue(self, incident_id, account_sid, messages, round=0, handoff_grace=HANDOFF_GRACE):
+        """
+        Write (channel, to_number, body) alerts for an incident; keys already
+        present are kept as they are. The worker sends them once handoff_grace
+        has passed unless they are claimed first.
+        """
+        now = time.time()
+        rows = [
+            (idempotency_key(incident_id, channel, to_number, round), incident_id, channel,
+             to_number, body, account_sid, now + handoff_grace, now, now)
+            for channel, to_number, body in messages
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, incident_id, channel, to_number, body,"
+                " account_sid, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+            self._conn.execute("COMMIT")
+        return [row[0] for row in rows]
+
+    def load_credentials(self, now):
+        """Register stored credentials for accounts with due alerts that no session has registered"""
+        with self._lock:
+            accounts = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT account_sid FROM outbox WHERE status = 'pending' AND next_attempt_at <= ?", (now,))]
+        for account_sid in accounts:
+            missing_at = _missing_credentials.get(account_sid)
+            if account_sid in _credentials or (missing_at is not None and now - missing_at < CREDENTIALS_RETRY):
+                continue
+            credentials = get_profile_store().find_credentials(account_sid)
+            if credentials and credentials['twilio_auth_token']:
+                register_credentials(credentials)
+                _missing_credentials.pop(account_sid, None)
+            else:
+                _missing_credentials[account_sid] = now
+
+    def claim(self, keys=None, limit=100):
+        """
+        Atomically move due pending rows to 'sending' and return them. With
+        `keys`, only those rows are claimed, ignoring their backoff.
+        """
+        now = time.time()
+        if keys is None:
+            self.load_credentials(now)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if keys is not None:
+                placeholders = ",".join("?" * len(keys))
+                rows = self._conn.execute(
+                    f"SELECT idempotency_key, incident_id, channel, to_number, body, account_sid, attempts"
+                    f" FROM outbox WHERE status = 'pending' AND idempotency_key IN ({placeholders})",
+                    list(keys)).fetchall()
+            else:
+                # Rows for accounts with no credentials in memory or in any
+                # profile wait for them instead of burning retry attempts
+                accounts = list(_credentials)
+                placeholders = ",".join("?" * len(accounts))
+                rows = self._conn.execute(
+                    f"SELECT idempotency_key, incident_id, channel, to_number, body, account_sid, attempts"
+                    f" FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? AND account_sid IN ({placeholders})"
+                    f" ORDER BY id LIMIT ?",
+                    [now] + accounts + [limit]).fetchall()
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1, lease_until = ?, updated_at = ?"
+                " WHERE idempotency_key = ?",
+                [(now + SEND_LEASE, now, row[0]) for row in rows])
+            self._conn.execute("COMMIT")
+        with self._results_lock:
+            self._sending.update(row[0] for row in rows)
+        return [
+            {'key': key, 'incident_id': incident_id, 'channel': channel, 'to_number': to_number,
+             'body': body, 'account_sid': account_sid, 'attempts': attempts + 1}
+            for key, incident_id, channel, to_number, body, account_sid, attempts in rows
+        ]
+
+    def record(self, row, sid=None, error=None):
+        """Buffer the outcome of a send; buffered outcomes are written together by flush()"""
+        with self._results_lock:
+            self._results.append((row, sid, error))
+        log_event('alert', row['incident_id'], channel=row['channel'], target=row['to_number'],
+                  key=row['key'], attempt=row['attempts'], sid=sid, error=error)
+
+    def flush(self):
+        with self._results_lock:
+            results, self._results = self._results, []
+        if not results:
+            return
+        now = time.time()
+        updates = []
+        for row, sid, error in results:
+            if error is None:
+                updates.append(('sent', sid, None, now, now, row['key']))
+            elif row['attempts'] >= MAX_ATTEMPTS:
+                updates.append(('failed', None, error, now, now, row['key']))
+            else:
+                updates.append(('pending', None, error, now + backoff_delay(row['attempts']), now, row['key']))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "UPDATE outbox SET status = ?, sid = ?, last_error = ?, next_attempt_at = ?, updated_at = ?"
+                " WHERE idempotency_key = ?",
+                updates)
+            self._conn.execute("COMMIT")
+        with self._results_lock:
+            self._sending.difference_update(row['key'] for row, _, _ in results)
+
+    def renew(self):
+        """Extend the lease of every row this process is still sending"""
+        with self._results_lock:
+            keys = list(self._sending)
+        if not keys:
+            return
+        lease_until = time.time() + SEND_LEASE
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "UPDATE outbox SET lease_until = ? WHERE idempotency_key = ? AND status = 'sending'",
+                [(lease_until, key) for key in keys])
+            self._conn.execute("COMMIT")
+
+    def recover(self):
+        """
+        Requeue rows whose claim has outlived its lease: the process sending
+        them died before recording the outcome, and for an emergency alert a
+        possible repeat is safer than a dropped one. Rows a live process is
+        still sending keep their renewed lease.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'pending', next_attempt_at = ? WHERE status = 'sending' AND lease_until <= ?",
+                (now, now))
+
+    def statuses(self, incident_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT channel, to_number, status, attempts, sid, last_error FROM outbox"
+                " WHERE incident_id = ? ORDER BY id",
+                (incident_id,)).fetchall()
+
+    def deliver(self, rows):
+        """Send claimed rows concurrently, recording each outcome, and yield ChannelResults as they finish"""
+        def send(row):
+            credentials = _credentials.get(row['account_sid'])
+            try:
+                if credentials is None:
+                    raise RuntimeError("no credentials registered for this Twilio account")
+                sid = SENDERS[row['channel']](credentials, row['to_number'], row['body'])
+            except Exception as e:
+                self.record(row, error=str(e))
+                raise
+            self.record(row, sid=sid)
+            # Twilio's status callbacks for the SID update this alert from here on
+            track_alert(sid, row['incident_id'], row['channel'], row['to_number'])
+            return sid
+
+        tasks = [(row['channel'], row['to_number'], lambda row=row: send(row)) for row in rows]
+        return get_dispatch_engine().dispatch(tasks)
+
+
+class OutboxWorker(threading.Thread):
+    """Background thread that flushes outcomes and retries due alerts"""
+
+    def __init__(self, outbox):
+        super().__init__(name='sos-outbox', daemon=True)
+        self.outbox = outbox
+
+    def run(self):
+        recovered_at = renewed_at = time.monotonic()
+        while True:
+            try:
+                if time.monotonic() - renewed_at >= LEASE_RENEW:
+                    self.outbox.renew()
+                    renewed_at = time.monotonic()
+                if time.monotonic() - recovered_at >= RECOVER_INTERVAL:
+                    self.outbox.recover()
+                    recovered_at = time.monotonic()
+                self.outbox.flush()
+                rows = self.outbox.claim()
+                if rows:
+                    for _ in self.outbox.deliver(rows):
+                        pass
+                    self.outbox.flush()
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+            time.sleep(POLL_INTERVAL)
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """Return the process-wide outbox, starting its worker on first use"""
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                outbox = Outbox()
+                # Resume whatever the previous process left unconfirmed
+                outbox.recover()
+                OutboxWorker(outbox).start()
+                _outbox = outbox
+    return _outbox
@@ -0,0 +1,265 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+import sidecar
+
+# Share of full script runs to profile, e.g. 0.01 for 1% (0 turns profiling off)
+PROFILE_RATE = float(os.environ.get('SOS_PROFILE_RATE', '0'))
+# Milliseconds between stack samples of a profiled run
+PROFILE_INTERVAL_MS = float(os.environ.get('SOS_PROFILE_INTERVAL_MS', '5'))
+# Seconds of samples the reports cover
+PROFILE_WINDOW = float(os.environ.get('SOS_PROFILE_WINDOW', '900'))
+# The window rolls forward in buckets of this many seconds
+BUCKET_SECONDS = 60
+
+
+class _Run:
+    __slots__ = ('thread_id', 'root', 'started', 'last_sample', 'samples')
+
+
+class _Bucket:
+    __slots__ = ('start', 'stacks', 'runs', 'run_seconds')
+
+    def __init__(self, start):
+        self.start = start
+        self.stacks = {}      # (region, stack) -> [samples, seconds]
+        self.runs = 0
+        self.run_seconds = 0.0
+
+
+class RerunProfiler:
+    """
+    Statistical profiler for Streamlit script runs. A sampled run registers
+    its thread; while any run is registered, a background thread reads the
+    run's stack every interval, up to the script's own module frame, and
+    weighs each sample by the wall time since the previous one. Samples are
+    filed under the region the run is in, named by the next startup
+    checkpoint, and added to per-minute buckets; reports merge the buckets
+    still in the window. Runs that aren't sampled cost one random draw.
+    """
+
+    def __init__(self, rate=PROFILE_RATE, interval=PROFILE_INTERVAL_MS / 1000, window=PROFILE_WINDOW,
+                 bucket_seconds=BUCKET_SECONDS):
+        self.rate = rate
+        self.interval = interval
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self._lock = threading.Lock()
+        self._runs = {}       # thread id -> _Run
+        self._buckets = deque()
+        self._labels = {}     # code object -> frame label, filled in by reports
+        self._wake = threading.Event()
+        self._sampler = None
+
+    def start(self, root):
+        """Called first thing in a script run, with the script's module code; decides whether to profile it"""
+        thread_id = threading.get_ident()
+        if self._runs:
+            # A run cut short by st.rerun() or st.stop() never reaches finish()
+            with self._lock:
+                previous = self._runs.pop(thread_id, None)
+            if previous is not None:
+                self._commit(previous, 'unfinished', ended=True)
+        if self.rate <= 0 or random.random() >= self.rate:
+            return
+        run = _Run()
+        run.thread_id = thread_id
+        run.root = root
+        run.started = run.last_sample = time.perf_counter()
+        run.samples = []
+        with self._lock:
+            self._runs[thread_id] = run
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name='sos-profiler', daemon=True)
+                self._sampler.start()
+        self._wake.set()
+
+    def checkpoint(self, name):
+        """File the samples since the previous checkpoint under region `name`"""
+        if self._runs:
+            run = self._runs.get(threading.get_ident())
+            if run is not None:
+                self._commit(run, name)
+
+    def finish(self):
+        """Called last thing in a script run"""
+        if self._runs:
+            with self._lock:
+                run = self._runs.pop(threading.get_ident(), None)
+            if run is not None:
+                self._commit(run, 'rest_of_page', ended=True)
+
+    def _commit(self, run, region, ended=False):
+        with self._lock:
+            samples, run.samples = run.samples, []
+            bucket = self._bucket()
+            for stack, seconds in samples:
+                totals = bucket.stacks.get((region, stack))
+                if totals is None:
+                    totals = bucket.stacks[(region, stack)] = [0, 0.0]
+                totals[0] += 1
+                totals[1] += seconds
+            if ended:
+                bucket.runs += 1
+                bucket.run_seconds += time.perf_counter() - run.started
+
+    def _bucket(self):
+        """Bucket for the current time, dropping those that have left the window; call under the lock"""
+        now = time.time()
+        start = now - now % self.bucket_seconds
+        if not self._buckets or self._buckets[-1].start != start:
+            self._buckets.append(_Bucket(start))
+        while self._buckets[0].start + self.bucket_seconds < now - self.window:
+            self._buckets.popleft()
+        return self._buckets[-1]
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            # The shortest path that still names the module
+            for path in sorted(filter(None, sys.path), key=len, reverse=True):
+                if filename.startswith(path.rstrip(os.sep) + os.sep):
+                    filename = filename[len(path.rstrip(os.sep)) + 1:]
+                    break
+            label = self._labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ',')
+        return label
+
+    @staticmethod
+    def _stack(frame, root):
+        """Code objects from the script's module frame down to `frame`, or None outside the script"""
+        codes = []
+        while frame is not None:
+            code = frame.f_code
+            codes.append(code)
+            if code is root:
+                return tuple(reversed(codes))
+            frame = frame.f_back
+        return None
+
+    def _sample(self):
+        while True:
+            self._wake.clear()
+            with self._lock:
+                runs = list(self._runs.values())
+            if not runs:
+                self._wake.wait()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for run in runs:
+                frame = frames.get(run.thread_id)
+                if frame is None:
+                    # The thread ended without finishing the run
+                    with self._lock:
+                        ended = self._runs.get(run.thread_id) is run
+                        if ended:
+                            del self._runs[run.thread_id]
+                    if ended:
+                        self._commit(run, 'unfinished', ended=True)
+                    continue
+                # Fragment reruns and idle script threads have no module frame and aren't counted
+                stack = self._stack(frame, run.root)
+                with self._lock:
+                    if stack is not None:
+                        run.samples.append((stack, now - run.last_sample))
+                    run.last_sample = now
+            del frames, frame
+
+    def _merged(self, region=None):
+        """(stacks, runs, run seconds) over the window, optionally for one region"""
+        stacks, runs, run_seconds = {}, 0, 0.0
+        with self._lock:
+            self._bucket()
+            for bucket in self._buckets:
+                runs += bucket.runs
+                run_seconds += bucket.run_seconds
+                for key, (samples, seconds) in bucket.stacks.items():
+                    if region is not None and key[0] != region:
+                        continue
+                    totals = stacks.setdefault(key, [0, 0.0])
+                    totals[0] += samples
+                    totals[1] += seconds
+        return stacks, runs, run_seconds
+
+    def report(self, top=20, region=None):
+        """Time per region and the top functions by self time, per profiled run"""
+        stacks, runs, run_seconds = self._merged(region)
+        per_run = 1000 / max(1, runs)
+        regions, self_time, total_time = {}, {}, {}
+        total_samples = 0
+        for (name, stack), (samples, seconds) in stacks.items():
+            stack = tuple(map(self._label, stack))
+            total_samples += samples
+            totals = regions.setdefault(name, [0, 0.0])
+            totals[0] += samples
+            totals[1] += seconds
+            self_totals = self_time.setdefault(stack[-1], [0, 0.0])
+            self_totals[0] += samples
+            self_totals[1] += seconds
+            # A recursive function counts once per sample towards its total
+            for label in set(stack):
+                total_totals = total_time.setdefault(label, [0, 0.0])
+                total_totals[0] += samples
+                total_totals[1] += seconds
+        share = 1 / max(1, total_samples)
+        return {
+            'rate': self.rate,
+            'interval_ms': self.interval * 1000,
+            'window_seconds': self.window,
+            'profiled_runs': runs,
+            'mean_run_ms': round(run_seconds * per_run, 3),
+            'samples': total_samples,
+            'regions': [{'region': name, 'samples': samples, 'share': round(samples * share, 4),
+                         'ms_per_run': round(seconds * per_run, 3)}
+                        for name, (samples, seconds) in sorted(regions.items(), key=lambda item: -item[1][1])],
+            'top': [{'function': label, 'self_samples': samples, 'self_share': round(samples * share, 4),
+                     'self_ms_per_run': round(seconds * per_run, 3),
+                     'total_samples': total_time[label][0], 'total_ms_per_run': round(total_time[label][1] * per_run, 3)}
+                    for label, (samples, seconds) in sorted(self_time.items(), key=lambda item: -item[1][1])[:top]],
+        }
+
+    def folded(self, region=None):
+        """Samples as folded stacks (region;frame;...;frame count), as read by flamegraph.pl and speedscope"""
+        stacks, _, _ = self._merged(region)
+        lines = sorted(f"{name};{';'.join(map(self._label, stack))} {samples}"
+                       for (name, stack), (samples, _) in stacks.items())
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+_profiler = RerunProfiler()
+
+
+def get_profiler():
+    return _profiler
+
+
+def start_run():
+    _profiler.start(sys._getframe(1).f_code)
+
+
+def checkpoint(name):
+    _profiler.checkpoint(name)
+
+
+def finish_run():
+    _profiler.finish()
+
+
+@sidecar.route('GET', '/profile')
+def _serve_report(request):
+    try:
+        top = int(request.query.get('top', '20'))
+    except ValueError:
+        return sidecar.json_response({'error': 'top must be a number'}, 400)
+    return sidecar.json_response(_profiler.report(top, request.query.get('region')))
+
+
+@sidecar.route('GET', '/profile/folded')
+def _serve_folded(request):
+    return 200, {'Content-Type': 'text/plain; charset=utf-8'}, _profiler.folded(request.query.get('region')).encode()
@@ -0,0 +1,135 @@
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+
+PROFILES_DB = os.environ.get('SOS_PROFILES_DB', 'sos_profiles.db')
+DEFAULT_PROFILE = 'default'
+# Single-user settings file from before profiles; imported once as the default profile
+LEGACY_CREDENTIALS_FILE = "sos_credentials.pkl"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    profile_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def hash_access_key(access_key):
+    return hashlib.sha256(access_key.encode()).hexdigest()
+
+
+def new_access_key():
+    """(access key, its hash) for protecting a profile; only the hash is stored"""
+    access_key = secrets.token_urlsafe(16)
+    return access_key, hash_access_key(access_key)
+
+
+def access_allowed(profile, access_key):
+    """Whether access_key opens the profile; profiles never saved with an access key are open"""
+    expected = profile.get('access_key_hash')
+    if not expected:
+        return True
+    return bool(access_key) and hmac.compare_digest(hash_access_key(access_key), expected)
+
+
+class ProfileStore:
+    """
+    Per-user settings (Twilio credentials, contacts, name) in SQLite, looked
+    up by primary key. Profiles are loaded on first use and cached; the
+    cache is dropped whenever SQLite reports a commit from another
+    connection, so replicas sharing the file never serve stale settings.
+    """
+
+    def __init__(self, path=PROFILES_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._data_version = self._read_data_version()
+        self._import_legacy_file()
+
+    def _read_data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _import_legacy_file(self):
+        if not os.path.exists(LEGACY_CREDENTIALS_FILE):
+            return
+        if self._conn.execute("SELECT 1 FROM profiles WHERE profile_id = ?", (DEFAULT_PROFILE,)).fetchone():
+            return
+        try:
+            with open(LEGACY_CREDENTIALS_FILE, 'rb') as f:
+                credentials = pickle.load(f)
+        except Exception as e:
+            print(f"Could not import {LEGACY_CREDENTIALS_FILE}: {e}")
+            return
+        self._conn.execute(
+            "INSERT OR IGNORE INTO profiles (profile_id, data, version, updated_at) VALUES (?, ?, 1, ?)",
+            (DEFAULT_PROFILE, json.dumps(credentials), time.time()))
+
+    def get(self, profile_id):
+        """Return a copy of the profile's settings, or {} if it doesn't exist yet"""
+        with self._lock:
+            data_version = self._read_data_version()
+            if data_version != self._data_version:
+                # Another connection committed since we last looked
+                self._cache.clear()
+                self._data_version = data_version
+            cached = self._cache.get(profile_id)
+            if cached is None:
+                row = self._conn.execute(
+                    "SELECT data FROM profiles WHERE profile_id = ?", (profile_id,)).fetchone()
+                cached = json.loads(row[0]) if row else {}
+                self._cache[profile_id] = cached
+            return dict(cached)
+
+    def find_credentials(self, account_sid):
+        """Twilio credentials of the most recently saved profile on this account, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM profiles WHERE json_extract(data, '$.twilio_account_sid') = ?"
+                " ORDER BY updated_at DESC LIMIT 1", (account_sid,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        return {key: data.get(key, '') for key in ('twilio_account_sid', 'twilio_auth_token', 'twilio_phone_number')}
+
+    def put(self, profile_id, data):
+        """Replace the profile's settings in a single transaction"""
+        payload = json.dumps(data)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO profiles (profile_id, data, version, updated_at) VALUES (?, ?, 1, ?)"
+                    " ON CONFLICT (profile_id) DO UPDATE SET data = excluded.data,"
+                    " version = profiles.version + 1, updated_at = excluded.updated_at",
+                    (profile_id, payload, time.time()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._cache[profile_id] = json.loads(payload)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_profile_store():
+    """Return the profile store shared by all sessions in this process"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ProfileStore()
+    return _store
@@ -0,0 +1,170 @@
+import csv
+import math
+import os
+import threading
+
+import numpy as np
+
+from gazetteer import EARTH_RADIUS_KM
+from metrics import span
+
+# CSV of emergency services (category, name, latitude, longitude); the
+# nearest of each category are listed in the alert SMS
+SERVICES_CSV = os.environ.get('SOS_SERVICES', 'emergency_services.csv')
+SERVICES_PER_CATEGORY = int(os.environ.get('SOS_SERVICES_PER_CATEGORY', '1'))
+SEARCH_RADIUS_KM = float(os.environ.get('SOS_SERVICES_RADIUS_KM', '25'))
+# Grid cell size in degrees, about 5.5 km north-south
+CELL_DEGREES = 0.05
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+CATEGORY_LABELS = {'hospital': "Hospital", 'police': "Police"}
+
+# Cell keys pack (row, column) into one integer; the offset keeps columns positive
+_COLUMN_OFFSET = 1 << 20
+_KEY_STRIDE = 1 << 21
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Distance in km from one point (radians) to arrays of points (radians)"""
+    a = (np.sin((latitudes - latitude) / 2) ** 2
+         + math.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class ServiceIndex:
+    """
+    Uniform grid over one category of places. Places are sorted by grid cell
+    so each cell is one contiguous slice of the coordinate arrays. A query
+    scans rings of cells outward from the query's cell, ranking candidates
+    with vectorized haversine, and stops once no unscanned cell can hold
+    anything closer than the k-th best so far.
+    """
+
+    def __init__(self, names, latitudes, longitudes, cell_degrees=CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        keys = self._keys(latitudes, longitudes)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        self.names = np.asarray(names)[order]
+        self.latitudes = np.radians(latitudes[order])
+        self.longitudes = np.radians(longitudes[order])
+        cells, starts = np.unique(keys, return_index=True)
+        ends = np.append(starts[1:], len(keys))
+        self._cells = dict(zip(cells.tolist(), zip(starts.tolist(), ends.tolist())))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _keys(self, latitudes, longitudes):
+        rows = np.floor(latitudes / self.cell_degrees).astype(np.int64)
+        columns = np.floor(longitudes / self.cell_degrees).astype(np.int64) + _COLUMN_OFFSET
+        return rows * _KEY_STRIDE + columns
+
+    def _ring(self, row, column, radius):
+        """Slices of the cells on the square ring `radius` cells out from (row, column)"""
+        if radius == 0:
+            cells = [(row, column)]
+        else:
+            cells = [(row + dr, column + dc) for dr in (-radius, radius)
+                     for dc in range(-radius, radius + 1)]
+            cells += [(row + dr, column + dc) for dc in (-radius, radius)
+                      for dr in range(-radius + 1, radius)]
+        found = []
+        for r, c in cells:
+            entry = self._cells.get(r * _KEY_STRIDE + c + _COLUMN_OFFSET)
+            if entry is not None:
+                found.append(entry)
+        return found
+
+    def nearest(self, latitude, longitude, k=1, max_km=SEARCH_RADIUS_KM):
+        """Return up to k (name, distance in km) pairs within max_km, closest first"""
+        if not len(self) or k <= 0:
+            return []
+        row = math.floor(latitude / self.cell_degrees)
+        column = math.floor(longitude / self.cell_degrees)
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        # Any place outside ring r is at least this far away per ring; the
+        # east-west cell width shrinks with latitude, so use the narrowest
+        # cell within the search radius
+        widest_latitude = min(89.0, abs(latitude) + max_km / KM_PER_DEGREE)
+        km_per_ring = self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(widest_latitude))
+        max_rings = int(max_km / km_per_ring) + 1
+
+        indices, distances = [], []
+        count, kth = 0, math.inf
+        for radius in range(max_rings + 1):
+            cells = self._ring(row, column, radius)
+            for start, end in cells:
+                indices.append(np.arange(start, end))
+                distances.append(haversine_km(lat, lon, self.latitudes[start:end], self.longitudes[start:end]))
+                count += end - start
+            if cells and count >= k:
+                kth = float(np.partition(np.concatenate(distances), k - 1)[k - 1])
+            if kth <= radius * km_per_ring:
+                break
+        if not indices:
+            return []
+
+        indices, distances = np.concatenate(indices), np.concatenate(distances)
+        within = distances <= max_km
+        indices, distances = indices[within], distances[within]
+        if len(distances) > k:
+            best = np.argpartition(distances, k - 1)[:k]
+            indices, distances = indices[best], distances[best]
+        ranked = np.argsort(distances)
+        return [(str(self.names[indices[i]]), float(distances[i])) for i in ranked]
+
+
+class EmergencyServices:
+    """Nearest hospitals, police stations and other services, one grid index per category"""
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    @classmethod
+    def from_csv(cls, path):
+        rows = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    latitude, longitude = float(row['latitude']), float(row['longitude'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                names, latitudes, longitudes = rows.setdefault(row['category'].strip(), ([], [], []))
+                names.append(row['name'].strip())
+                latitudes.append(latitude)
+                longitudes.append(longitude)
+        return cls({category: ServiceIndex(*columns) for category, columns in rows.items()})
+
+    def nearby(self, latitude, longitude, k=SERVICES_PER_CATEGORY):
+        """Return {category: [(name, distance in km), ...]} for every category"""
+        with span('nearest_services'):
+            return {category: index.nearest(latitude, longitude, k)
+                    for category, index in self.indexes.items()}
+
+    def describe(self, latitude, longitude, k=SERVICES_PER_CATEGORY):
+        """One line for the alert, e.g. 'Hospital: AIIMS (1.2 km); Police: ... (0.8 km)'"""
+        parts = []
+        for category, places in self.nearby(latitude, longitude, k).items():
+            if places:
+                listed = ", ".join(f"{name} ({distance:.1f} km)" for name, distance in places)
+                parts.append(f"{CATEGORY_LABELS.get(category, category.title())}: {listed}")
+        return "; ".join(parts)
+
+
+_services = None
+_services_lock = threading.Lock()
+
+
+def get_emergency_services():
+    """Return the emergency services index shared by all sessions, or None without a dataset"""
+    global _services
+    if _services is None:
+        with _services_lock:
+            if _services is None:
+                if SERVICES_CSV and os.path.exists(SERVICES_CSV):
+                    _services = EmergencyServices.from_csv(SERVICES_CSV)
+                else:
+                    _services = EmergencyServices({})
+    return _services if _services.indexes else None
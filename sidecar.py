@@ -0,0 +1,136 @@
+import json
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Small HTTP server that runs next to Streamlit in the same process, for the
+# endpoints Streamlit itself can't serve (static assets with caching headers,
+# lightweight ingest routes). Browsers reach it on its own port, or through a
+# reverse proxy when SOS_SIDECAR_PUBLIC_URL is set.
+SIDECAR_HOST = os.environ.get('SOS_SIDECAR_HOST', '0.0.0.0')
+SIDECAR_PORT = int(os.environ.get('SOS_SIDECAR_PORT', '8502'))
+SIDECAR_PUBLIC_URL = os.environ.get('SOS_SIDECAR_PUBLIC_URL', '')
+
+_routes = {}
+_server = None
+_server_lock = threading.Lock()
+
+
+class Request:
+    """The parts of an incoming request that route handlers need"""
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b'{}')
+
+    def form(self):
+        return {k: v[0] for k, v in parse_qs(self.body.decode('utf-8')).items()}
+
+
+def route(method, path):
+    """Register a handler for METHOD /path; it returns (status, headers, body)"""
+    def decorator(fn):
+        _routes[(method, path)] = fn
+        return fn
+    return decorator
+
+
+def json_response(payload, status=200):
+    return status, {'Content-Type': 'application/json'}, json.dumps(payload).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle's
+    # algorithm holds the body back for a keep-alive client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        # HEAD is served by the GET handler without the body
+        handler = _routes.get(('GET' if method == 'HEAD' else method, url.path))
+        if handler is None:
+            status, headers, payload = 404, {'Content-Type': 'text/plain'}, b'Not found'
+        else:
+            request = Request(method, url.path,
+                              {k: v[0] for k, v in parse_qs(url.query).items()},
+                              self.headers, body)
+            try:
+                status, headers, payload = handler(request)
+            except Exception as e:
+                print(f"Error handling {method} {url.path}: {e}")
+                status, headers, payload = 500, {'Content-Type': 'text/plain'}, b'Internal error'
+
+        self.send_response(status)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if method != 'HEAD':
+            self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_HEAD(self):
+        self._handle('HEAD')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_OPTIONS(self):
+        # CORS preflight for fetch() calls from the component iframes
+        self.send_response(204)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Range')
+        self.send_header('Access-Control-Max-Age', '86400')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 resets connections during bursts, such as
+    # Twilio's status callbacks for a large fan-out
+    request_queue_size = socket.SOMAXCONN
+
+
+def ensure_started():
+    """Start the sidecar server once per process; safe to call on every rerun"""
+    global _server
+    if _server is not None:
+        return _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = _Server((SIDECAR_HOST, SIDECAR_PORT), _Handler)
+            except OSError as e:
+                print(f"Could not start sidecar server on port {SIDECAR_PORT}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name='sos-sidecar',
+                             daemon=True).start()
+    return _server
+
+
+def public_url_js():
+    """JavaScript expression for the sidecar base URL as seen by the browser"""
+    if SIDECAR_PUBLIC_URL:
+        return json.dumps(SIDECAR_PUBLIC_URL.rstrip('/'))
+    return ("(window.parent.location.protocol + '//' + "
+            f"window.parent.location.hostname + ':{SIDECAR_PORT}')")
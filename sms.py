@@ -0,0 +1,214 @@
+import math
+import os
+import re
+import string
+import unicodedata
+
+# Most segments one alert SMS may take. Each segment is billed, and long
+# messages can arrive out of order or in pieces, so by default the alert is
+# compacted until it fits one segment.
+SMS_SEGMENTS = int(os.environ.get('SOS_SMS_SEGMENTS', '1'))
+
+# GSM 03.38 default alphabet, and the extension table whose characters take
+# two septets (an escape and the character)
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+GSM7 = GSM7_BASIC | GSM7_EXTENDED
+
+# Septets or UTF-16 code units per single segment, and per segment once the
+# message is split (the user data header takes the difference)
+GSM7_SINGLE, GSM7_MULTI = 160, 153
+UCS2_SINGLE, UCS2_MULTI = 70, 67
+
+# Common characters that fall outside GSM-7 but have a close equivalent in it
+_REPLACEMENTS = {
+    '–': '-', '—': '-', '‐': '-', '‑': '-', '−': '-',
+    '‘': "'", '’': "'", '‚': "'", '′': "'", '`': "'", '´': "'",
+    '“': '"', '”': '"', '„': '"', '″': '"',
+    '…': '...', '•': '-', '·': '-', ' ': ' ', ' ': ' ', ' ': ' ',
+    '₹': 'Rs', '°': ' deg', '।': '.', '॥': '.',
+}
+
+
+class MessageTemplate:
+    """
+    A str.format-style template parsed once into literal text and field
+    names, so filling it in at trigger time is a single join. Field values
+    are passed through escape, e.g. for XML, when one is given.
+    """
+
+    def __init__(self, template, escape=None):
+        self.template = template
+        self.escape = escape
+        self._parts = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if spec or conversion:
+                raise ValueError(f"Format specs are not supported in message templates: {template!r}")
+            self._parts.append((literal, field))
+
+    def render(self, **fields):
+        escape = self.escape
+        pieces = []
+        for literal, field in self._parts:
+            pieces.append(literal)
+            if field is not None:
+                value = str(fields[field])
+                pieces.append(escape(value) if escape else value)
+        return ''.join(pieces)
+
+
+def is_gsm7(text):
+    return GSM7.issuperset(text)
+
+
+def encoding(text):
+    """'GSM-7' if the text can be sent in the GSM default alphabet, otherwise 'UCS-2'"""
+    return 'GSM-7' if is_gsm7(text) else 'UCS-2'
+
+
+def segments(text):
+    """Return (encoding, number of segments) the text is sent as"""
+    if is_gsm7(text):
+        units = len(text) + sum(1 for c in text if c in GSM7_EXTENDED)
+        single, multi, name = GSM7_SINGLE, GSM7_MULTI, 'GSM-7'
+    else:
+        units = len(text.encode('utf-16-le')) // 2
+        single, multi, name = UCS2_SINGLE, UCS2_MULTI, 'UCS-2'
+    return name, 1 if units <= single else math.ceil(units / multi)
+
+
+class _Abugida:
+    """
+    Romanizes one Indic script: consonants carry an inherent 'a' that a
+    vowel sign replaces and the virama removes.
+    """
+
+    def __init__(self, vowels, consonants, signs, modifiers, virama, ignore='', digits_from=None,
+                 drop_final_a=False):
+        self.vowels = vowels
+        self.consonants = consonants
+        self.signs = signs
+        self.modifiers = modifiers
+        self.virama = virama
+        self.ignore = set(ignore)
+        self.digits_from = digits_from
+        self.drop_final_a = drop_final_a
+
+    def romanize(self, word):
+        out = []
+        pending_a = False
+        for c in word:
+            if c in self.ignore:
+                continue
+            if c in self.consonants:
+                if pending_a:
+                    out.append('a')
+                out.append(self.consonants[c])
+                pending_a = True
+                continue
+            if c in self.signs:
+                out.append(self.signs[c])
+            elif c == self.virama:
+                pass
+            else:
+                if pending_a:
+                    out.append('a')
+                if c in self.vowels:
+                    out.append(self.vowels[c])
+                elif c in self.modifiers:
+                    out.append(self.modifiers[c])
+                elif self.digits_from is not None and 0 <= ord(c) - self.digits_from <= 9:
+                    out.append(str(ord(c) - self.digits_from))
+            pending_a = False
+        if pending_a and not self.drop_final_a:
+            out.append('a')
+        text = ''.join(out)
+        return text[:1].upper() + text[1:]
+
+
+_DEVANAGARI = _Abugida(
+    vowels=dict(zip("अआइईउऊऋएऐओऔऑ", ['a', 'aa', 'i', 'ee', 'u', 'oo', 'ri', 'e', 'ai', 'o', 'au', 'o'])),
+    consonants=dict(zip(
+        "कखगघङचछजझञटठडढणतथदधनपफबभमयरलळवशषसह",
+        ['k', 'kh', 'g', 'gh', 'n', 'ch', 'chh', 'j', 'jh', 'n', 't', 'th', 'd', 'dh', 'n',
+         't', 'th', 'd', 'dh', 'n', 'p', 'ph', 'b', 'bh', 'm', 'y', 'r', 'l', 'l', 'v', 'sh', 'sh', 's', 'h'])),
+    signs=dict(zip("ािीुूृेैोौॉ", ['aa', 'i', 'ee', 'u', 'oo', 'ri', 'e', 'ai', 'o', 'au', 'o'])),
+    modifiers={'ं': 'n', 'ँ': 'n', 'ः': 'h'},
+    virama='्',
+    ignore='़',   # nukta
+    digits_from=0x0966,
+    # Hindi drops the inherent vowel at the end of a word: Najafgarh, not Najafgarha
+    drop_final_a=True,
+)
+
+_TAMIL = _Abugida(
+    vowels=dict(zip("அஆஇஈஉஊஎஏஐஒஓஔ", ['a', 'aa', 'i', 'ee', 'u', 'oo', 'e', 'e', 'ai', 'o', 'o', 'au'])),
+    consonants=dict(zip(
+        "கஙசஞடணதநபமயரலவழளறனஜஷஸஹ",
+        ['k', 'ng', 'ch', 'nj', 't', 'n', 'th', 'n', 'p', 'm', 'y', 'r', 'l', 'v', 'zh', 'l', 'r', 'n',
+         'j', 'sh', 's', 'h'])),
+    signs=dict(zip("ாிீுூெேைொோௌ", ['aa', 'i', 'ee', 'u', 'oo', 'e', 'e', 'ai', 'o', 'o', 'au'])),
+    modifiers={'ஃ': 'h'},
+    virama='்',
+    digits_from=0x0BE6,
+)
+
+_SCRIPTS = [
+    (re.compile('[ऀ-ॿ]+'), _DEVANAGARI),
+    (re.compile('[஀-௿]+'), _TAMIL),
+]
+
+
+def _to_gsm7_char(c):
+    if c in GSM7_BASIC or c in GSM7_EXTENDED:
+        return c
+    if c in _REPLACEMENTS:
+        return _REPLACEMENTS[c]
+    # Accented Latin letters outside the alphabet lose their accents: ā -> a
+    stripped = ''.join(d for d in unicodedata.normalize('NFKD', c) if not unicodedata.combining(d))
+    return stripped if stripped and is_gsm7(stripped) else ''
+
+
+def to_gsm7(text):
+    """
+    Rewrite text in the GSM-7 alphabet: punctuation gets its ASCII
+    equivalent, Devanagari and Tamil are romanized, accents that GSM-7 lacks
+    are dropped, and anything else is removed.
+    """
+    if is_gsm7(text):
+        return text
+    for pattern, script in _SCRIPTS:
+        text = pattern.sub(lambda match: script.romanize(match.group()), text)
+    text = ''.join(_to_gsm7_char(c) for c in text)
+    # Tidy what removed characters leave behind
+    text = re.sub(r' {2,}', ' ', text)
+    text = re.sub(r'(?:\s*,)+\s*,', ',', text)
+    return text.strip(' ,')
+
+
+def shorter_addresses(address, min_parts=1):
+    """
+    The address, then versions with its least specific parts (country,
+    postcode, state...) dropped one at a time, down to min_parts parts
+    """
+    parts = [part.strip() for part in address.split(',') if part.strip()]
+    for count in range(len(parts), min(min_parts, len(parts)) - 1, -1):
+        yield ', '.join(parts[:count])
+
+
+def fit_segments(candidates, max_segments=SMS_SEGMENTS):
+    """
+    Return the first candidate text that fits in max_segments, or the one
+    with the fewest segments when none fit
+    """
+    best, best_segments = None, math.inf
+    for text in candidates:
+        _, count = segments(text)
+        if count <= max_segments:
+            return text
+        if count < best_segments:
+            best, best_segments = text, count
+    return best
@@ -0,0 +1,163 @@
+import importlib
+import os
+import threading
+import time
+
+import profiler
+import sidecar
+
+# Import heavy dependencies and build the shared indexes in a background
+# thread as soon as the first session starts (set to 0 to load them on first use)
+PREWARM = os.environ.get('SOS_PREWARM', '1') != '0'
+# Print the startup report once the first page has rendered
+PRINT_REPORT = os.environ.get('SOS_STARTUP_REPORT', '0') != '0'
+
+# Dependencies that are only needed by Settings or to send an alert
+HEAVY_MODULES = ('pandas', 'twilio.rest', 'requests')
+
+
+def _process_started_at():
+    """Wall-clock time the process started, from /proc where available"""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+PROCESS_STARTED_AT = _process_started_at()
+
+
+class StartupTimer:
+    """
+    Timings of the first script run in this process and of the prewarm
+    thread. Only the thread running the first script run records its
+    checkpoints; later runs and other sessions cost one attribute check.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = []   # (name, started, duration, thread), seconds since process start
+        self.first_render = None
+        self._owner = None
+        self._run_started = None
+        self._last = None
+        self.done = False
+
+    def _record(self, name, started, duration):
+        with self._lock:
+            self.phases.append((name, started - PROCESS_STARTED_AT, duration, threading.current_thread().name))
+
+    def checkpoint(self, name, run_started=None):
+        """Record the time since the previous checkpoint of the first script run as phase `name`"""
+        if self.done:
+            return
+        now = time.time()
+        with self._lock:
+            if self._owner is None:
+                self._owner = threading.get_ident()
+                # The run began before this first checkpoint; perf_counter gives how long ago
+                self._last = now - (time.perf_counter() - run_started) if run_started else now
+                self._run_started = self._last
+            elif self._owner != threading.get_ident():
+                return
+            last, self._last = self._last, now
+        self._record(name, last, now - last)
+
+    def finish(self):
+        """Close the first script run; returns True for the run that closed it"""
+        if self.done or self._owner != threading.get_ident():
+            return False
+        self.checkpoint('rest_of_page')
+        with self._lock:
+            # (script run duration, first paint after process start)
+            self.first_render = self._last - self._run_started, self._last - PROCESS_STARTED_AT
+            self.done = True
+        return True
+
+    def timed(self, name, fn, *args):
+        started = time.time()
+        try:
+            return fn(*args)
+        finally:
+            self._record(name, started, time.time() - started)
+
+    def report(self):
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        return {
+            'process_started_at': PROCESS_STARTED_AT,
+            'first_render_ms': None if self.first_render is None else round(self.first_render[0] * 1000, 1),
+            'first_paint_after_start_ms': None if self.first_render is None else round(self.first_render[1] * 1000, 1),
+            'phases': [{'name': name, 'started_ms': round(started * 1000, 1),
+                        'duration_ms': round(duration * 1000, 1), 'thread': thread}
+                       for name, started, duration, thread in phases],
+        }
+
+    def format_report(self):
+        report = self.report()
+        lines = [f"Startup: first page rendered {report['first_paint_after_start_ms']} ms after process start "
+                 f"(script run {report['first_render_ms']} ms)"]
+        for phase in report['phases']:
+            lines.append(f"  {phase['started_ms']:>9.1f} ms  {phase['duration_ms']:>8.1f} ms  "
+                         f"{phase['name']:<32} {phase['thread']}")
+        return "\n".join(lines)
+
+
+_timer = StartupTimer()
+
+
+def get_startup_timer():
+    return _timer
+
+
+def checkpoint(name, run_started=None):
+    _timer.checkpoint(name, run_started)
+    profiler.checkpoint(name)
+
+
+def finish_first_render():
+    if _timer.finish() and PRINT_REPORT:
+        print(_timer.format_report())
+
+
+def _warm_up():
+    # Imported here: these modules are what the prewarm thread loads
+    from geocode import get_geocoder
+    from services import get_emergency_services
+
+    # The indexes first: the location panel needs them for the first page
+    for name, fn in (('geocoder', get_geocoder), ('emergency_services', get_emergency_services)):
+        try:
+            _timer.timed(name, fn)
+        except Exception as e:
+            print(f"Prewarm of {name} failed: {e}")
+    for module in HEAVY_MODULES:
+        try:
+            _timer.timed(f"import {module}", importlib.import_module, module)
+        except ImportError as e:
+            print(f"Prewarm: {e}")
+
+
+_prewarm_started = False
+_prewarm_lock = threading.Lock()
+
+
+def prewarm():
+    """Load heavy dependencies and shared indexes in the background, once per process"""
+    global _prewarm_started
+    if _prewarm_started or not PREWARM:
+        return
+    with _prewarm_lock:
+        if _prewarm_started:
+            return
+        _prewarm_started = True
+    threading.Thread(target=_warm_up, name='sos-prewarm', daemon=True).start()
+
+
+@sidecar.route('GET', '/startup')
+def _serve_report(request):
+    return sidecar.json_response(_timer.report())
@@ -0,0 +1,201 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Where state shared between replicas lives:
+#   memory                  this process only (single replica)
+#   sqlite:///sos_state.db  replicas on one host sharing a file
+#   redis://host:6379/0     replicas anywhere; needs the redis package
+STATE_BACKEND = os.environ.get('SOS_STATE_BACKEND', 'memory')
+# A trigger for a user within this many seconds of their last one joins the
+# same incident. Each duplicate restarts the window.
+DEDUP_WINDOW = float(os.environ.get('SOS_DEDUP_WINDOW', '120'))
+# How long the user an incident belongs to is remembered, so API keys bound
+# to a profile can only see and reset that profile's incidents
+INCIDENT_OWNER_TTL = float(os.environ.get('SOS_INCIDENT_OWNER_TTL', str(7 * 24 * 3600)))
+
+
+class MemoryStateBackend:
+    """Claims held in this process; enough when there is a single replica"""
+
+    MIN_SWEEP = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claims = {}   # key -> (value, expires_at)
+        # Expired claims are swept once the table doubles, so claims stay amortized O(1)
+        self._sweep_at = self.MIN_SWEEP
+
+    def claim(self, key, value, window):
+        """
+        Atomically take key for value unless it is held and unexpired.
+        Returns (won, holder); a failed claim extends the holder's window.
+        """
+        now = time.time()
+        with self._lock:
+            held = self._claims.get(key)
+            if held is not None and held[1] > now:
+                self._claims[key] = (held[0], now + window)
+                return False, held[0]
+            self._claims[key] = (value, now + window)
+            if len(self._claims) > self._sweep_at:
+                self._claims = {key: held for key, held in self._claims.items() if held[1] > now}
+                self._sweep_at = max(self.MIN_SWEEP, 2 * len(self._claims))
+            return True, value
+
+    def get(self, key):
+        with self._lock:
+            held = self._claims.get(key)
+            return held[0] if held is not None and held[1] > time.time() else None
+
+    def release(self, key, value):
+        """Drop the claim if value still holds it"""
+        with self._lock:
+            held = self._claims.get(key)
+            if held is not None and held[0] == value:
+                del self._claims[key]
+
+
+class SQLiteStateBackend:
+    """Claims in a SQLite file shared by the replicas on one host"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS claims (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def claim(self, key, value, window):
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so the read and the
+            # write below are atomic across every process using the file
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM claims WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    self._conn.execute("UPDATE claims SET expires_at = ? WHERE key = ?", (now + window, key))
+                    won, holder = False, row[0]
+                else:
+                    self._conn.execute("INSERT OR REPLACE INTO claims (key, value, expires_at) VALUES (?, ?, ?)",
+                                       (key, value, now + window))
+                    won, holder = True, value
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return won, holder
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM claims WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def release(self, key, value):
+        with self._lock:
+            self._conn.execute("DELETE FROM claims WHERE key = ? AND value = ?", (key, value))
+
+
+class RedisStateBackend:
+    """Claims in Redis (or any server speaking its protocol), for replicas on several hosts"""
+
+    # GET-then-SET as one server-side step, so two replicas can't both win
+    CLAIM_SCRIPT = """
+    local held = redis.call('GET', KEYS[1])
+    if held then
+        redis.call('PEXPIRE', KEYS[1], ARGV[2])
+        return {0, held}
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return {1, ARGV[1]}
+    """
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SOS_STATE_BACKEND is a Redis URL but the redis package is not installed")
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._claim = self._client.register_script(self.CLAIM_SCRIPT)
+        self._release = self._client.register_script(self.RELEASE_SCRIPT)
+
+    def claim(self, key, value, window):
+        won, holder = self._claim(keys=[key], args=[value, max(1, int(window * 1000))])
+        return bool(won), holder
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def release(self, key, value):
+        self._release(keys=[key], args=[value])
+
+
+def create_backend(url):
+    if url == 'memory':
+        return MemoryStateBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteStateBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStateBackend(url)
+    raise ValueError(f"Unknown SOS_STATE_BACKEND: {url}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_state_backend():
+    """Return the shared state backend configured for this process"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(STATE_BACKEND)
+    return _backend
+
+
+def claim_trigger(user_id, incident_id, window=DEDUP_WINDOW):
+    """
+    Deduplicate triggers for a user across every replica. Returns the
+    incident id that owns the trigger: incident_id if this call won,
+    otherwise the incident already in progress for the user.
+    """
+    _, holder = get_state_backend().claim(f"sos:trigger:{user_id}", incident_id, window)
+    return holder
+
+
+def release_trigger(user_id, incident_id):
+    """Let the user trigger a new incident straight away, e.g. after resetting SOS"""
+    get_state_backend().release(f"sos:trigger:{user_id}", incident_id)
+
+
+def active_incident(user_id):
+    """The incident id holding the user's trigger window, if any"""
+    return get_state_backend().get(f"sos:trigger:{user_id}")
+
+
+def record_incident_owner(incident_id, user_id):
+    """Remember which user an incident belongs to, for INCIDENT_OWNER_TTL seconds"""
+    get_state_backend().claim(f"sos:incident:{incident_id}", user_id, INCIDENT_OWNER_TTL)
+
+
+def incident_owner(incident_id):
+    """The user an incident belongs to, or None once forgotten or for an unknown incident"""
+    return get_state_backend().get(f"sos:incident:{incident_id}")
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_serve_with_several_processes(tmp_path):
+    port = free_port()
+    env = dict(os.environ,
+               SOS_API_KEYS='test-key',
+               SOS_STATE_BACKEND=f"sqlite:///{tmp_path / 'state.db'}",
+               SOS_OUTBOX_DB=str(tmp_path / 'outbox.db'),
+               SOS_PROFILES_DB=str(tmp_path / 'profiles.db'),
+               SOS_INCIDENT_LOG=str(tmp_path / 'incidents.log'),
+               PYTHONUNBUFFERED='1')
+    server = subprocess.Popen([sys.executable, '-m', 'api', 'serve', '--port', str(port), '--processes', '2'],
+                              cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                              start_new_session=True)
+    try:
+        # The processes' lines can interleave, so look for their pids anywhere in the output
+        output = ''
+        deadline = time.monotonic() + 60
+        while len(set(re.findall(r'listening on \S+ \(pid (\d+)\)', output))) < 2 and time.monotonic() < deadline:
+            line = server.stdout.readline()
+            assert line, "the server exited before both processes were listening:\n" + output
+            output += line
+            assert 'Traceback' not in output, output
+        listening = set(re.findall(r'listening on \S+ \(pid (\d+)\)', output))
+        assert len(listening) == 2
+
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/v1/alerts/unknown",
+                                         headers={'Authorization': 'Bearer test-key'})
+        for _ in range(10):
+            try:
+                urllib.request.urlopen(request)
+            except urllib.error.HTTPError as e:
+                assert e.code == 404
+                assert json.load(e) == {'error': "unknown incident 'unknown'"}
+    finally:
+        os.killpg(server.pid, 9)
+        server.wait()
+
+
+def test_bound_keys_only_reach_their_own_incidents(monkeypatch):
+    import api
+    from state import record_incident_owner
+
+    record_incident_owner('alice-incident', 'alice')
+    record_incident_owner('bob-incident', 'bob')
+    monkeypatch.setattr(api, 'alert_status', lambda incident_id: {'incident_id': incident_id})
+    resets = []
+    monkeypatch.setattr(api, 'reset_alert', lambda profile_id, incident_id: resets.append(incident_id))
+    server = api.ApiServer(keys={'alice-key': 'alice'})
+    headers = {'authorization': 'Bearer alice-key'}
+
+    async def call(method, path):
+        try:
+            return await server.route(method, path, headers, b'')
+        except api.AlertError as e:
+            return e.status, str(e)
+
+    assert asyncio.run(call('GET', '/v1/alerts/alice-incident')) == (200, {'incident_id': 'alice-incident'})
+    assert asyncio.run(call('GET', '/v1/alerts/bob-incident'))[0] == 404
+    assert asyncio.run(call('POST', '/v1/alerts/bob-incident/reset'))[0] == 404
+    assert asyncio.run(call('POST', '/v1/alerts/alice-incident/reset'))[0] == 200
+    assert resets == ['alice-incident']
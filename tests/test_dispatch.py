@@ -0,0 +1,24 @@
+import pytest
+
+from dispatch import DEFAULT_BUDGET, DispatchEngine, positive_setting
+from ratelimit import TokenBucket
+
+
+@pytest.mark.parametrize('value', ['0', '-1', 'nan', 'inf', 'ten'])
+def test_rates_and_budgets_must_be_positive(monkeypatch, value):
+    monkeypatch.setenv('SOS_TWILIO_SMS_PER_SECOND', value)
+    with pytest.raises(ValueError, match='SOS_TWILIO_SMS_PER_SECOND'):
+        positive_setting('SOS_TWILIO_SMS_PER_SECOND', '10')
+    monkeypatch.setenv('SOS_BUDGET_CALL', value)
+    with pytest.raises(ValueError, match='SOS_BUDGET_CALL'):
+        DispatchEngine(max_workers=1)
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_budgets_default_to_the_same_value(monkeypatch):
+    monkeypatch.setenv('SOS_BUDGET_SMS', '2.5')
+    monkeypatch.delenv('SOS_BUDGET_CALL', raising=False)
+    engine = DispatchEngine(max_workers=1)
+    assert engine.budget_for('sms') == 2.5
+    assert engine.budget_for('call') == engine.budget_for('whatsapp') == DEFAULT_BUDGET
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+import escalation
+import incident_log
+from escalation import Escalator, EscalationStore, TimerWheel
+
+
+class RecordingOutbox:
+    def __init__(self):
+        self.enqueued = []
+
+    def enqueue(self, incident_id, account_sid, messages, round=0, handoff_grace=0):
+        self.enqueued.append((incident_id, messages, round))
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    monkeypatch.setattr(incident_log, 'INCIDENT_LOG', '')
+    outbox = RecordingOutbox()
+    monkeypatch.setattr(escalation, 'get_outbox', lambda: outbox)
+    return outbox
+
+
+def test_step_saved_under_more_steps_ends_the_escalation(tmp_path, outbox):
+    store = EscalationStore(str(tmp_path / 'outbox.db'))
+    wheel = TimerWheel()
+    store.create('incident', 'AC1', ['+15550000000'], "call", "sms", time.time() + 60)
+    # The last step, alerting escalation contacts, in a process that had some
+    store.advance('incident', 2, time.time() + 60)
+
+    escalator = Escalator(store, wheel, after=60, escalation_contacts=[])
+    escalator.recover()
+    assert escalator.status('incident')[:2] == ('done', None)
+    escalator._fire('incident')
+    assert outbox.enqueued == []
+    assert store.get('incident')['state'] == 'done'
+
+
+def test_steps_run_in_order_until_the_last(tmp_path, outbox):
+    store = EscalationStore(str(tmp_path / 'outbox.db'))
+    escalator = Escalator(store, TimerWheel(), after=60, escalation_contacts=['+15550000009'])
+    escalator.start('incident', 'AC1', ['+15550000001', '+15550000002'], "call", "sms")
+    assert escalator.status('incident')[:2] == ('active', 'call_again')
+
+    for _ in escalation.STEPS:
+        escalator._fire('incident')
+    assert [(round, [(channel, number) for channel, number, _ in messages])
+            for _, messages, round in outbox.enqueued] == [
+        (1, [('call', '+15550000001'), ('call', '+15550000002')]),
+        (2, [('sms', '+15550000001'), ('sms', '+15550000002')]),
+        (3, [('call', '+15550000009'), ('sms', '+15550000009')]),
+    ]
+    assert escalator.status('incident')[0] == 'done'
+
+
+def test_acknowledged_incidents_stop_escalating(tmp_path, outbox):
+    store = EscalationStore(str(tmp_path / 'outbox.db'))
+    escalator = Escalator(store, TimerWheel(), after=60, escalation_contacts=[])
+    escalator.start('incident', 'AC1', ['+15550000001'], "call", "sms")
+    escalator.acknowledge('incident')
+    escalator._fire('incident')
+    assert outbox.enqueued == []
+    assert escalator.status('incident')[0] == 'acknowledged'
+
+
+def test_timer_wheel_fires_due_timers_and_skips_cancelled_ones():
+    wheel = TimerWheel(tick=0.01, slots=8)
+    fired = []
+    done = threading.Event()
+    cancelled = wheel.schedule(0.05, fired.append, 'cancelled')
+    # Past one full turn of the wheel, so it waits a round in its bucket
+    wheel.schedule(0.15, lambda: (fired.append('late'), done.set()))
+    wheel.schedule(0.02, fired.append, 'early')
+    assert wheel.cancel(cancelled)
+    assert not wheel.cancel(cancelled)
+    assert done.wait(5)
+    assert fired == ['early', 'late']
+    assert len(wheel) == 0
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+from gazetteer import KDTree, chord_to_km, load_gazetteer, unit_vector, unit_vectors
+
+
+def test_nearest_matches_a_brute_force_search():
+    rng = np.random.default_rng(0)
+    latitudes, longitudes = rng.uniform(8, 35, 2000), rng.uniform(68, 97, 2000)
+    points = unit_vectors(latitudes, longitudes)
+    tree = KDTree(np.ascontiguousarray(points[KDTree.build_order(points)]))
+    for latitude, longitude in zip(rng.uniform(8, 35, 50), rng.uniform(68, 97, 50)):
+        index, squared_chord = tree.nearest(unit_vector(latitude, longitude))
+        squared_chords = ((points - unit_vector(latitude, longitude)) ** 2).sum(axis=1)
+        assert np.isclose(squared_chord, squared_chords.min())
+        assert np.allclose(tree.points[index], points[squared_chords.argmin()])
+
+
+def test_chord_distance_is_great_circle_distance():
+    # One degree of latitude is about 111.2 km
+    squared_chord = sum((a - b) ** 2 for a, b in zip(unit_vector(28.0, 77.0), unit_vector(29.0, 77.0)))
+    assert abs(chord_to_km(squared_chord) - 111.2) < 0.1
+
+
+def test_index_is_built_once_then_memory_mapped(tmp_path):
+    path = tmp_path / 'places.csv'
+    path.write_text("name,region,latitude,longitude\n"
+                    "Najafgarh,South West Delhi,28.6092,76.9798\n"
+                    "Connaught Place,New Delhi,28.6315,77.2167\n"
+                    "Broken,,not a number,77\n", encoding='utf-8')
+    built = load_gazetteer(str(path))
+    assert len(built) == 2 and built.build_seconds > 0
+    assert os.path.exists(f"{path}.index.npy") and os.path.exists(f"{path}.labels.npy")
+
+    loaded = load_gazetteer(str(path))
+    assert loaded.build_seconds == 0 and loaded.load_seconds > 0
+    place, distance = loaded.nearest(28.61, 76.98)
+    assert place == "Najafgarh, South West Delhi" and distance < 1
+    assert loaded.describe(28.63, 77.22).startswith("Near Connaught Place, New Delhi (")
+    assert load_gazetteer(str(tmp_path / 'missing.csv')) is None
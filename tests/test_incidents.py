@@ -0,0 +1,73 @@
+import pytest
+
+import incident_log
+import incidents
+import outbox
+from incidents import build_messages, new_delivery_status, panel_status, update_delivery_status
+from outbox import Outbox
+
+
+@pytest.fixture(autouse=True)
+def no_incident_log(monkeypatch):
+    monkeypatch.setattr(incident_log, 'INCIDENT_LOG', '')
+
+
+def test_panel_shows_a_retry_that_succeeded(tmp_path, monkeypatch):
+    pending = Outbox(str(tmp_path / 'outbox.db'))
+    monkeypatch.setattr(incidents, 'get_outbox', lambda: pending)
+    monkeypatch.setattr(outbox, '_credentials', {})
+    monkeypatch.setattr(outbox, 'BACKOFF_BASE', 0.0)
+    outbox.register_credentials({'twilio_account_sid': 'AC1', 'twilio_auth_token': 'token',
+                                 'twilio_phone_number': '+15550000000'})
+    attempts = []
+
+    def send_sms(credentials, to_number, message):
+        attempts.append(to_number)
+        if len(attempts) == 1:
+            raise RuntimeError("Twilio is down")
+        return 'SM1'
+
+    monkeypatch.setattr(outbox, 'SENDERS', {'sms': send_sms})
+    contacts = [{'name': "Mum", 'number': '+15550000001', 'priority': 1}]
+    incident = {'incident_id': 'incident', 'duplicate': False, 'delivery_status': new_delivery_status(contacts)}
+    incident['delivery_status']['+15550000001']['Call'] = "✅"
+
+    # The first dispatch: Twilio rejects the SMS
+    keys = pending.enqueue('incident', 'AC1', [('sms', '+15550000001', "help")], handoff_grace=0)
+    for result in pending.deliver(pending.claim(keys)):
+        update_delivery_status(incident['delivery_status'], result)
+    pending.flush()
+    _, _, rows = panel_status(incident)
+    assert rows[0]['SMS'] == "❌ Twilio is down (retrying)"
+
+    # What the outbox worker does on its next pass
+    for _ in pending.deliver(pending.claim()):
+        pass
+    pending.flush()
+    level, message, rows = panel_status(incident)
+    assert rows[0]['SMS'] == "✅"
+    assert level == 'success' and "Help is on the way" in message
+
+
+def test_panel_waits_for_a_send_past_its_budget(tmp_path, monkeypatch):
+    pending = Outbox(str(tmp_path / 'outbox.db'))
+    monkeypatch.setattr(incidents, 'get_outbox', lambda: pending)
+    contacts = [{'name': "", 'number': '+15550000001', 'priority': 1}]
+    incident = {'incident_id': 'incident', 'duplicate': False, 'delivery_status': new_delivery_status(contacts)}
+    keys = pending.enqueue('incident', 'AC1', [('call', '+15550000001', "help"), ('sms', '+15550000001', "help")],
+                           handoff_grace=0)
+    rows = pending.claim(keys)
+    assert panel_status(incident)[0] == 'warning'
+
+    for row in rows:
+        pending.record(row, sid='SID')
+    pending.flush()
+    assert panel_status(incident)[0] == 'success'
+
+
+def test_call_message_is_romanized(monkeypatch):
+    monkeypatch.setattr(incidents, 'nearby_help', lambda location: "")
+    location = {'address': "दिल्ली", 'latitude': 28.6, 'longitude': 77.2,
+                'google_maps_link': "https://maps.google.com/?q=28.600000,77.200000"}
+    call_message, _ = build_messages("मदद", location)
+    assert call_message.startswith("Madad needs immediate assistance. Location: Dillee.")
@@ -0,0 +1,24 @@
+from keywords import KeywordAutomaton, KeywordSpotter
+
+
+def test_every_language_is_matched_in_one_pass():
+    automaton = KeywordAutomaton([('help', 'en-US'), ('help me', 'en-US'), ('मदद', 'hi-IN'), ('உதவி', 'ta-IN')])
+    assert automaton.find("please HELP me") == [('help', 'en-US', 7, 11), ('help me', 'en-US', 7, 14)]
+    assert automaton.find("मुझे मदद चाहिए") == [('मदद', 'hi-IN', 5, 8)]
+    assert automaton.find("எனக்கு உதவி வேண்டும்") == [('உதவி', 'ta-IN', 7, 11)]
+    assert automaton.find("all fine here") == []
+
+
+def test_phrases_inside_other_phrases_are_found():
+    # 'he' fails over from 'she' without rescanning
+    automaton = KeywordAutomaton([('she', 'x'), ('he', 'x'), ('hers', 'x')])
+    assert sorted(match[0] for match in automaton.find("ushers")) == ['he', 'hers', 'she']
+
+
+def test_custom_keywords_only_apply_to_their_profile():
+    spotter = KeywordSpotter({'en-US': ['help']})
+    spotter.set_custom_keywords('user', ['Pineapple', ' ', ''])
+    assert spotter.scan("pineapple now", 'user') == ('Pineapple', 'custom', 0, 9)
+    assert spotter.scan("pineapple now", 'other') is None
+    # The earliest match wins, and a batch gets one result per transcript
+    assert spotter.scan_batch(["help, pineapple", "nothing"], 'user') == [('help', 'en-US', 0, 4), None]
@@ -0,0 +1,47 @@
+import incident_log
+import outbox
+from outbox import Outbox
+
+
+def test_leases_run_out_unless_their_sender_renews_them(tmp_path, monkeypatch):
+    path = str(tmp_path / 'outbox.db')
+    crashed, sender = Outbox(path), Outbox(path)
+    monkeypatch.setattr(outbox, 'SEND_LEASE', 0.0)
+    crashed.claim(crashed.enqueue('crashed', 'AC1', [('sms', '+15550000000', 'help')], handoff_grace=0))
+    sender.claim(sender.enqueue('live', 'AC1', [('sms', '+15550000000', 'help')], handoff_grace=0))
+
+    # The live process renews its claims; the crashed one no longer can
+    monkeypatch.setattr(outbox, 'SEND_LEASE', 30.0)
+    sender.renew()
+    Outbox(path).recover()
+    assert [status for _, _, status, *_ in sender.statuses('crashed')] == ['pending']
+    assert [status for _, _, status, *_ in sender.statuses('live')] == ['sending']
+
+
+def test_flushed_rows_are_no_longer_renewed(tmp_path, monkeypatch):
+    monkeypatch.setattr(incident_log, 'INCIDENT_LOG', '')
+    sender = Outbox(str(tmp_path / 'outbox.db'))
+    rows = sender.claim(sender.enqueue('incident', 'AC1', [('sms', '+15550000000', 'help')], handoff_grace=0))
+    assert sender._sending == {rows[0]['key']}
+    sender.record(rows[0], sid='SM1')
+    sender.flush()
+    assert not sender._sending
+    assert [status for _, _, status, *_ in sender.statuses('incident')] == ['sent']
+
+
+def test_claim_loads_credentials_of_stored_profiles(tmp_path, monkeypatch):
+    from profiles import ProfileStore
+    profiles = ProfileStore(str(tmp_path / 'profiles.db'))
+    profiles.put('user', {'twilio_account_sid': 'AC2', 'twilio_auth_token': 'token',
+                          'twilio_phone_number': '+15550000000'})
+    monkeypatch.setattr(outbox, 'get_profile_store', lambda: profiles)
+    monkeypatch.setattr(outbox, '_credentials', {})
+    monkeypatch.setattr(outbox, '_missing_credentials', {})
+
+    # Left pending by a previous process; no session has registered either account
+    pending = Outbox(str(tmp_path / 'outbox.db'))
+    pending.enqueue('stored', 'AC2', [('sms', '+15550000001', 'help')], handoff_grace=0)
+    pending.enqueue('unknown', 'AC3', [('sms', '+15550000001', 'help')], handoff_grace=0)
+
+    assert [row['incident_id'] for row in pending.claim()] == ['stored']
+    assert outbox.registered_credentials('AC2')['twilio_auth_token'] == 'token'
@@ -0,0 +1,14 @@
+from profiles import ProfileStore, access_allowed, new_access_key
+
+
+def test_saved_profiles_only_open_with_their_access_key(tmp_path):
+    store = ProfileStore(str(tmp_path / 'profiles.db'))
+    access_key, access_key_hash = new_access_key()
+    store.put('user', {'twilio_auth_token': 'secret', 'access_key_hash': access_key_hash})
+    profile = store.get('user')
+    assert access_key not in str(profile)
+    assert access_allowed(profile, access_key)
+    assert not access_allowed(profile, None)
+    assert not access_allowed(profile, access_key[:-1])
+    # Profiles saved before access keys, or never saved, stay open until they are saved
+    assert access_allowed(store.get('new'), None)
@@ -0,0 +1,35 @@
+import math
+
+import numpy as np
+
+from services import EmergencyServices, ServiceIndex, haversine_km
+
+
+def test_nearest_matches_a_brute_force_ranking():
+    rng = np.random.default_rng(0)
+    latitudes, longitudes = rng.uniform(28.3, 28.9, 500), rng.uniform(76.8, 77.5, 500)
+    names = [f"place {i}" for i in range(500)]
+    index = ServiceIndex(names, latitudes, longitudes)
+    for latitude, longitude in zip(rng.uniform(28.3, 28.9, 20), rng.uniform(76.8, 77.5, 20)):
+        distances = haversine_km(math.radians(latitude), math.radians(longitude),
+                                 np.radians(latitudes), np.radians(longitudes))
+        expected = [(names[i], distances[i]) for i in np.argsort(distances)[:3]]
+        found = index.nearest(latitude, longitude, k=3)
+        assert [name for name, _ in found] == [name for name, _ in expected]
+        assert np.allclose([distance for _, distance in found], [distance for _, distance in expected])
+
+
+def test_places_beyond_the_radius_are_left_out():
+    index = ServiceIndex(["near", "far"], [28.60, 29.50], [77.20, 77.20])
+    assert [name for name, _ in index.nearest(28.61, 77.20, k=2, max_km=25)] == ["near"]
+    assert index.nearest(10.0, 70.0, k=1, max_km=25) == []
+    assert ServiceIndex([], [], []).nearest(28.6, 77.2) == []
+
+
+def test_describe_lists_each_category(tmp_path):
+    path = tmp_path / 'services.csv'
+    path.write_text("category,name,latitude,longitude\n"
+                    "hospital,City Hospital,28.6100,77.2000\n"
+                    "police,Central Station,28.6200,77.2000\n", encoding='utf-8')
+    services = EmergencyServices.from_csv(str(path))
+    assert services.describe(28.61, 77.20) == "Hospital: City Hospital (0.0 km); Police: Central Station (1.1 km)"
@@ -0,0 +1,30 @@
+from sms import MessageTemplate, fit_segments, segments, shorter_addresses, to_gsm7
+
+
+def test_segments_follow_the_gsm7_and_ucs2_limits():
+    assert segments("a" * 160) == ('GSM-7', 1)
+    assert segments("a" * 161) == ('GSM-7', 2)
+    # Extension characters take two septets each
+    assert segments("€" * 80) == ('GSM-7', 1)
+    assert segments("€" * 81) == ('GSM-7', 2)
+    assert segments("मदद" + "a" * 67) == ('UCS-2', 1)
+    assert segments("मदद" + "a" * 68) == ('UCS-2', 2)
+
+
+def test_indic_scripts_are_romanized_into_gsm7():
+    assert to_gsm7("मदद, दिल्ली") == "Madad, Dillee"
+    assert to_gsm7("சென்னை") == "Chennai"
+    assert to_gsm7("Café – “Main” Road") == "Café - \"Main\" Road"
+    assert to_gsm7("Near 😀 the park") == "Near the park"
+
+
+def test_the_first_candidate_that_fits_is_chosen():
+    assert list(shorter_addresses("A, B, C", min_parts=2)) == ["A, B, C", "A, B"]
+    assert fit_segments(["x" * 200, "y" * 150, "z"], max_segments=1) == "y" * 150
+    # None fit: the one with the fewest segments
+    assert fit_segments(["x" * 400, "y" * 200], max_segments=1) == "y" * 200
+
+
+def test_templates_escape_their_fields():
+    template = MessageTemplate("<Say>{message}</Say>", escape=lambda value: value.replace("&", "&amp;"))
+    assert template.render(message="A & B") == "<Say>A &amp; B</Say>"
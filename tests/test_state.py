@@ -0,0 +1,22 @@
+import time
+
+from state import MemoryStateBackend
+
+
+def test_memory_backend_sweeps_expired_claims(monkeypatch):
+    backend = MemoryStateBackend()
+    monkeypatch.setattr(backend, 'MIN_SWEEP', 8)
+    monkeypatch.setattr(backend, '_sweep_at', 8)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    assert backend.claim('held', 'a', 60) == (True, 'a')
+    for number in range(20):
+        backend.claim(f'short{number}', 'a', 1)
+    assert backend.claim('held', 'b', 60) == (False, 'a')
+
+    monkeypatch.setattr(time, 'time', lambda: now + 2)
+    for number in range(20):
+        backend.claim(f'later{number}', 'b', 60)
+    assert not any(key.startswith('short') for key in backend._claims)
+    assert backend.get('held') == 'a'
+    assert backend.claim('short0', 'b', 60) == (True, 'b')
@@ -0,0 +1,32 @@
+import math
+import threading
+import time
+
+from geocode import ReverseGeocoder
+from tracking import TrackStore
+
+
+def test_bad_timestamps_are_rejected_and_leave_the_track_usable():
+    store = TrackStore()
+    now = time.time()
+    assert store.add_fixes('session', [[now - 10, 28.5, 77.0, 20]]) == 1
+    rejected = [[math.nan, 28.6, 77.1, 20], [math.inf, 28.6, 77.1, 20],
+                [now + 3600, 28.6, 77.1, 20], [now, 28.6, 77.1, math.inf]]
+    assert store.add_fixes('session', rejected) == 0
+    assert store.add_fixes('session', [[now, 28.5001, 77.0001, 20]]) == 1
+    assert all(math.isfinite(value) for value in store.best('session'))
+
+
+def test_lookup_without_wait_answers_while_nominatim_is_slow(monkeypatch):
+    geocoder = ReverseGeocoder(min_interval=0.0)
+    release = threading.Event()
+
+    def fetch(latitude, longitude):
+        release.wait(5)
+        return "Connaught Place, New Delhi"
+
+    monkeypatch.setattr(geocoder, '_fetch', fetch)
+    assert geocoder.lookup(28.6315, 77.2167, wait=False) == "28.63150, 77.21670"
+    release.set()
+    geocoder._refiner.shutdown(wait=True)
+    assert geocoder.lookup(28.6315, 77.2167, wait=False) == "Connaught Place, New Delhi"
@@ -0,0 +1,46 @@
+import time
+from types import SimpleNamespace
+
+import triggers
+from triggers import TriggerRegistry
+
+
+def test_sessions_not_seen_within_the_ttl_are_forgotten(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(triggers, 'time', SimpleNamespace(monotonic=lambda: now[0], time=time.time))
+    registry = TriggerRegistry(ttl=60, max_sessions=10)
+    registry.register_session('closed', {'credentials': {'twilio_auth_token': 'secret'}})
+    registry.register_session('open', {})
+    registry._incidents['closed'] = {'incident_id': 'incident'}
+
+    now[0] += 30
+    registry.touch('open')
+    now[0] += 40
+    registry.register_session('new', {})
+    assert registry.session('closed') is None and registry.incident('closed') is None
+    assert registry.session('open') == {}
+
+
+def test_least_recently_seen_sessions_are_dropped_beyond_the_cap():
+    registry = TriggerRegistry(ttl=3600, max_sessions=2)
+    for session_id in ('a', 'b', 'c'):
+        registry.register_session(session_id, {})
+    assert [registry.session(session_id) for session_id in ('a', 'b', 'c')] == [None, {}, {}]
+    # Touching an unknown session doesn't register it
+    registry.touch('a')
+    assert registry.session('a') is None and 'a' not in registry._seen
+
+
+def test_trigger_endpoints_reject_bodies_that_are_not_objects(monkeypatch):
+    from sidecar import Request
+    for body in (b'[]', b'"help"', b'3', b'null'):
+        for route in (triggers._ingest_trigger, triggers._scan_transcripts):
+            status, _, response = route(Request('POST', '/trigger', {}, {}, body))
+            assert status == 400 and b'expected a JSON object' in response
+
+    registry = TriggerRegistry()
+    registry.register_session('session', {'profile_id': 'user'})
+    monkeypatch.setattr(triggers, '_registry', registry)
+    status, _, _ = triggers._scan_transcripts(Request('POST', '/transcripts', {}, {},
+                                                      b'{"session_id": "session", "transcripts": "help"}'))
+    assert status == 400
@@ -0,0 +1,43 @@
+from twilio_pool import TwilioClientPool
+
+CREDENTIALS = {'twilio_account_sid': 'AC' + '0' * 32, 'twilio_auth_token': 'token'}
+
+
+def closed_flags(pool):
+    pooled = pool._clients[CREDENTIALS['twilio_account_sid']]
+    closed = []
+    pooled.close = lambda: closed.append(True)
+    return closed
+
+
+def test_invalidated_client_closes_when_its_last_lease_returns():
+    pool = TwilioClientPool()
+    with pool.lease(CREDENTIALS) as client:
+        closed = closed_flags(pool)
+        with pool.lease(CREDENTIALS) as same:
+            assert same is client
+            pool.invalidate(CREDENTIALS['twilio_account_sid'])
+        assert not closed
+        # New sends get a new client while the old one is still in use
+        with pool.lease(CREDENTIALS) as fresh:
+            assert fresh is not client
+        assert not closed
+    assert closed == [True]
+
+
+def test_rotated_token_retires_the_old_client():
+    pool = TwilioClientPool()
+    with pool.lease(CREDENTIALS) as client:
+        closed = closed_flags(pool)
+        with pool.lease(dict(CREDENTIALS, twilio_auth_token='rotated')) as rotated:
+            assert rotated is not client
+        assert not closed
+    assert closed == [True]
+
+
+def test_idle_client_closes_at_once():
+    pool = TwilioClientPool()
+    with pool.lease(CREDENTIALS):
+        closed = closed_flags(pool)
+    pool.invalidate(CREDENTIALS['twilio_account_sid'])
+    assert closed == [True]
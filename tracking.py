@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import sidecar
+from geocode import get_geocoder
+
+# Fixes kept per session: 128 fixes of (timestamp, lat, lon, accuracy) is 4 KB
+TRACK_CAPACITY = int(os.environ.get('SOS_TRACK_CAPACITY', '128'))
+MAX_TRACKS = int(os.environ.get('SOS_MAX_TRACKS', '10000'))
+# How often the browser uploads its buffered fixes
+FLUSH_SECONDS = float(os.environ.get('SOS_TRACK_FLUSH_SECONDS', '5'))
+# Where to place the user until the browser has sent a fix
+DEFAULT_LATITUDE = float(os.environ.get('SOS_DEFAULT_LATITUDE', '28.5796481'))
+DEFAULT_LONGITUDE = float(os.environ.get('SOS_DEFAULT_LONGITUDE', '76.9759274'))
+# How fast the user may be moving, in metres per second, for the Kalman
+# filter. Vehicle speed, so a user in a car isn't smoothed into the past.
+PROCESS_NOISE = float(os.environ.get('SOS_TRACK_SPEED', '15'))
+MIN_ACCURACY = 5.0
+MAX_ACCURACY = 5000.0
+# How far ahead of our clock a fix timestamp may be before it is rejected
+MAX_CLOCK_SKEW = float(os.environ.get('SOS_TRACK_MAX_SKEW', '300'))
+
+
+class LocationTrack:
+    """
+    Fixed-size ring buffer of one session's recent fixes with a Kalman filter
+    over them. Each fix updates the smoothed position as it arrives, so the
+    current best fix is a stored tuple and reading it never touches the buffer.
+    """
+
+    def __init__(self, capacity=TRACK_CAPACITY):
+        self._fixes = np.zeros((capacity, 4))   # timestamp, latitude, longitude, accuracy (m)
+        self._next = 0
+        self._count = 0
+        self._variance = None
+        self.best = None   # (timestamp, latitude, longitude, accuracy) after smoothing
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, latitude, longitude, accuracy):
+        accuracy = min(max(accuracy, MIN_ACCURACY), MAX_ACCURACY)
+        self._fixes[self._next] = (timestamp, latitude, longitude, accuracy)
+        self._next = (self._next + 1) % len(self._fixes)
+        self._count = min(self._count + 1, len(self._fixes))
+
+        if self.best is None:
+            self._variance = accuracy ** 2
+            self.best = (timestamp, latitude, longitude, accuracy)
+            return
+        last_timestamp, last_latitude, last_longitude, _ = self.best
+        if timestamp < last_timestamp:
+            # Late fix from an earlier batch: keep it in the track, don't move backwards
+            return
+        # Uncertainty grows while the user may have moved, then the fix pulls it back in
+        variance = self._variance + (PROCESS_NOISE * (timestamp - last_timestamp)) ** 2
+        gain = variance / (variance + accuracy ** 2)
+        self._variance = (1 - gain) * variance
+        self.best = (timestamp,
+                     last_latitude + gain * (latitude - last_latitude),
+                     last_longitude + gain * (longitude - last_longitude),
+                     self._variance ** 0.5)
+
+    def recent(self, n=None):
+        """The last n raw fixes (all by default), oldest first, as an (n, 4) array"""
+        n = self._count if n is None else min(n, self._count)
+        indices = (self._next - n + np.arange(n)) % len(self._fixes)
+        return self._fixes[indices]
+
+
+class TrackStore:
+    """Location tracks for every session, least recently updated dropped first beyond max_tracks"""
+
+    def __init__(self, capacity=TRACK_CAPACITY, max_tracks=MAX_TRACKS):
+        self.capacity = capacity
+        self.max_tracks = max_tracks
+        self._lock = threading.Lock()
+        self._tracks = OrderedDict()
+
+    def add_fixes(self, session_id, fixes):
+        """Append [(timestamp, lat, lon, accuracy), ...]; returns how many were accepted"""
+        accepted = 0
+        latest = time.time() + MAX_CLOCK_SKEW
+        with self._lock:
+            track = self._tracks.get(session_id)
+            if track is None:
+                track = self._tracks[session_id] = LocationTrack(self.capacity)
+                while len(self._tracks) > self.max_tracks:
+                    self._tracks.popitem(last=False)
+            self._tracks.move_to_end(session_id)
+            for fix in fixes:
+                try:
+                    timestamp, latitude, longitude, accuracy = (float(value) for value in fix)
+                except (TypeError, ValueError):
+                    continue
+                # NaN fails every comparison; one bad timestamp would poison the filter for good
+                if (0 <= timestamp <= latest and -90 <= latitude <= 90 and -180 <= longitude <= 180
+                        and 0 <= accuracy < float('inf')):
+                    track.append(timestamp, latitude, longitude, accuracy)
+                    accepted += 1
+        return accepted
+
+    def track(self, session_id):
+        with self._lock:
+            return self._tracks.get(session_id)
+
+    def best(self, session_id):
+        """The session's smoothed current fix, or None before its first fix"""
+        track = self._tracks.get(session_id)
+        return track.best if track is not None else None
+
+
+def describe_fix(fix, wait=True):
+    """
+    Location dict used for alerts: coordinates, address, map link, accuracy and age.
+    Without wait, an address not yet cached is looked up in the background.
+    """
+    if fix is None:
+        timestamp, latitude, longitude, accuracy = None, DEFAULT_LATITUDE, DEFAULT_LONGITUDE, None
+    else:
+        timestamp, latitude, longitude, accuracy = fix
+    return {
+        'latitude': round(latitude, 6),
+        'longitude': round(longitude, 6),
+        'address': get_geocoder().lookup(latitude, longitude, wait=wait),
+        'google_maps_link': f"https://maps.google.com/?q={latitude:.6f},{longitude:.6f}",
+        'accuracy': None if accuracy is None else round(accuracy),
+        'fixed_at': timestamp,
+    }
+
+
+_store = TrackStore()
+
+
+def get_track_store():
+    return _store
+
+
+def current_location(session_id, wait=True):
+    """Location dict from the session's best fix, or the default location before one arrives"""
+    return describe_fix(_store.best(session_id), wait=wait)
+
+
+@sidecar.route('POST', '/locations')
+def _ingest_locations(request):
+    """
+    Accept {"session_id", "fixes": [[timestamp, lat, lon, accuracy], ...]}
+    batched by the browser, as text/plain JSON to skip the CORS preflight
+    """
+    try:
+        payload = request.json()
+    except ValueError:
+        return sidecar.json_response({'error': 'invalid JSON'}, 400)
+    if not isinstance(payload, dict):
+        return sidecar.json_response({'error': 'expected a JSON object'}, 400)
+    session_id = payload.get('session_id')
+    fixes = payload.get('fixes')
+    if not isinstance(session_id, str) or not 0 < len(session_id) <= 64 or not isinstance(fixes, list):
+        return sidecar.json_response({'error': 'session_id and fixes are required'}, 400)
+    accepted = _store.add_fixes(session_id, fixes[:_store.capacity])
+    return sidecar.json_response({'accepted': accepted, 'best': _store.best(session_id),
+                                  'server_time': time.time()})
@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import sidecar
+from dispatch import credentials_missing
+from escalation import get_escalator
+from incident_log import log_event
+from incidents import build_messages, dispatch_incident, new_delivery_status, update_delivery_status
+from keywords import get_keyword_spotter
+from live_updates import get_live_updates
+from metrics import current_trace_id, record_alert
+from state import claim_trigger, record_incident_owner, release_trigger
+from tracking import describe_fix, get_track_store
+
+# A session not seen for this many seconds is taken to have ended, and its
+# snapshot (with its Twilio credentials) and incident are dropped. Open pages
+# are seen on every SOS panel refresh.
+SESSION_TTL = float(os.environ.get('SOS_SESSION_TTL', '900'))
+MAX_SESSIONS = int(os.environ.get('SOS_MAX_SESSIONS', '10000'))
+
+
+class TriggerRegistry:
+    """
+    Server-side view of each browser session and its active incident, so a
+    trigger can start dispatch without waiting for the page to rerun. Pages
+    register a snapshot of their settings and location on every rerun; at
+    most one incident is active per session until it is reset.
+
+    Triggers are also deduplicated per user through the shared state
+    backend, so a repeated trigger from another tab or replica joins the
+    incident already in progress instead of dispatching again.
+
+    Sessions not seen for `ttl` seconds are forgotten with their incident,
+    least recently seen first beyond max_sessions. Forgetting an incident
+    doesn't stop its escalation; only a reset does.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # Serializes incident starts so the shared claim and the local record agree
+        self._start_lock = threading.Lock()
+        self._sessions = {}
+        self._incidents = {}
+        self._seen = OrderedDict()   # session_id -> when it was last seen, oldest first
+
+    def _touch(self, session_id):
+        """Mark the session as seen now and forget ended sessions; call under the lock"""
+        now = time.monotonic()
+        self._seen[session_id] = now
+        self._seen.move_to_end(session_id)
+        while len(self._seen) > self.max_sessions or next(iter(self._seen.values())) <= now - self.ttl:
+            ended, _ = self._seen.popitem(last=False)
+            self._sessions.pop(ended, None)
+            self._incidents.pop(ended, None)
+
+    def touch(self, session_id):
+        """Keep a registered session from being taken as ended, e.g. while its page is open"""
+        with self._lock:
+            if session_id in self._seen:
+                self._touch(session_id)
+
+    def register_session(self, session_id, snapshot):
+        """snapshot: user_name, credentials, contacts and location for the session"""
+        with self._lock:
+            self._sessions[session_id] = snapshot
+            self._touch(session_id)
+
+    def session(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def start(self, session_id, source, incident_id=None, user_id=None):
+        """
+        Open an incident for the session; returns (incident, created), reusing
+        an active one. When another trigger for the same user holds the dedup
+        window, the incident is created as a duplicate of that one and must
+        not be dispatched.
+        """
+        with self._start_lock:
+            with self._lock:
+                incident = self._incidents.get(session_id)
+                if incident is not None:
+                    return incident, False
+            incident_id = incident_id or uuid.uuid4().hex
+            owner = claim_trigger(user_id, incident_id) if user_id is not None else incident_id
+            if user_id is not None and owner == incident_id:
+                record_incident_owner(incident_id, user_id)
+            incident = {
+                'incident_id': owner,
+                'user_id': user_id,
+                'duplicate': owner != incident_id,
+                'source': source,
+                'started_at': time.time(),
+                'delivery_status': {},
+                'completed': owner != incident_id,
+                'error': None,
+            }
+            with self._lock:
+                self._incidents[session_id] = incident
+                self._touch(session_id)
+            log_event('triggered', owner, user_id, source=source, session_id=session_id,
+                      duplicate=incident['duplicate'])
+            return incident, True
+
+    def incident(self, session_id):
+        with self._lock:
+            return self._incidents.get(session_id)
+
+    def clear(self, session_id):
+        with self._lock:
+            incident = self._incidents.pop(session_id, None)
+        if incident is None or incident['duplicate']:
+            return
+        log_event('reset', incident['incident_id'])
+        # Resetting SOS means the user is safe: stop escalating and sharing their location
+        get_escalator().acknowledge(incident['incident_id'])
+        get_live_updates().stop(incident['incident_id'])
+        if incident['user_id'] is not None:
+            release_trigger(incident['user_id'], incident['incident_id'])
+
+
+_registry = TriggerRegistry()
+_runner = ThreadPoolExecutor(max_workers=8, thread_name_prefix='sos-trigger')
+
+
+def get_trigger_registry():
+    return _registry
+
+
+def run_incident(incident, snapshot, fix=None, session_id=None):
+    """
+    Dispatch an incident opened outside the Streamlit script, recording
+    progress on it. fix is the session's best location fix at trigger time;
+    without one the location the page last registered is used. session_id
+    is followed for live location updates.
+    """
+    trace_token = current_trace_id.set(incident['incident_id'])
+    record_alert(incident['source'])
+    try:
+        credentials = snapshot['credentials']
+        contacts = snapshot['contacts']
+        if credentials_missing(credentials):
+            incident['error'] = "Twilio credentials are missing. Please configure them in settings."
+            return
+        if not contacts:
+            incident['error'] = "No emergency contacts configured. Please add them in settings."
+            return
+        location = describe_fix(fix) if fix is not None else snapshot['location']
+        call_message, sms_message = build_messages(snapshot['user_name'], location)
+        incident['delivery_status'] = new_delivery_status(contacts)
+        follow = (session_id, snapshot['user_name']) if session_id is not None else None
+        for result in dispatch_incident(incident['incident_id'], credentials, contacts,
+                                        call_message, sms_message, location, follow):
+            update_delivery_status(incident['delivery_status'], result)
+    except Exception as e:
+        incident['error'] = f"Error during SOS process: {e}"
+    finally:
+        incident['completed'] = True
+        current_trace_id.reset(trace_token)
+
+
+def trigger_session(session_id, source):
+    """Open an incident for a registered session and dispatch it in the background"""
+    snapshot = _registry.session(session_id)
+    if snapshot is None:
+        return None, False
+    incident, created = _registry.start(session_id, source, user_id=snapshot.get('profile_id'))
+    if created and not incident['duplicate']:
+        _runner.submit(run_incident, incident, snapshot, get_track_store().best(session_id), session_id)
+    return incident, created
+
+
+@sidecar.route('POST', '/trigger')
+def _ingest_trigger(request):
+    """
+    Accept {"session_id", "keyword", "source"} and acknowledge straight away;
+    dispatch runs on a background thread. Bodies are sent as text/plain JSON
+    so browsers skip the CORS preflight round-trip.
+    """
+    try:
+        payload = request.json()
+    except ValueError:
+        return sidecar.json_response({'error': 'invalid JSON'}, 400)
+    if not isinstance(payload, dict):
+        return sidecar.json_response({'error': 'expected a JSON object'}, 400)
+
+    if payload.get('source') == 'voice':
+        source = f"Voice Command: '{payload.get('keyword', 'unknown')}'"
+    else:
+        source = "SOS Button"
+    incident, created = trigger_session(payload.get('session_id'), source)
+    if incident is None:
+        return sidecar.json_response({'error': 'unknown session'}, 404)
+    return sidecar.json_response({'incident_id': incident['incident_id'], 'created': created}, 202)
+
+
+@sidecar.route('POST', '/transcripts')
+def _scan_transcripts(request):
+    """
+    Accept {"session_id", "transcripts": [...]} with final or interim speech
+    results, match them against the session profile's keywords and trigger
+    on the first hit
+    """
+    try:
+        payload = request.json()
+    except ValueError:
+        return sidecar.json_response({'error': 'invalid JSON'}, 400)
+    if not isinstance(payload, dict):
+        return sidecar.json_response({'error': 'expected a JSON object'}, 400)
+
+    session_id = payload.get('session_id')
+    snapshot = _registry.session(session_id)
+    if snapshot is None:
+        return sidecar.json_response({'error': 'unknown session'}, 404)
+
+    transcripts = payload.get('transcripts', [])
+    if not isinstance(transcripts, list):
+        return sidecar.json_response({'error': 'transcripts must be a list'}, 400)
+    transcripts = [t for t in transcripts if isinstance(t, str)]
+    for match in get_keyword_spotter().scan_batch(transcripts, snapshot.get('profile_id')):
+        if match is not None:
+            incident, created = trigger_session(session_id, f"Voice Command: '{match[0]}'")
+            return sidecar.json_response({'keyword': match[0], 'language': match[1],
+                                          'incident_id': incident['incident_id'], 'created': created}, 202)
+    return sidecar.json_response({'keyword': None})
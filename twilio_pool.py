@@ -0,0 +1,161 @@
+import functools
+import os
+import threading
+from contextlib import contextmanager
+
+from metrics import span
+
+# Concurrent requests allowed per Twilio account. This is also the size of
+# the keep-alive connection pool, so a burst never opens more sockets.
+MAX_CONCURRENCY = 16
+REQUEST_TIMEOUT = 10
+# Send API requests somewhere other than api.twilio.com, e.g. a local stand-in
+# for benchmarks: SOS_TWILIO_BASE_URL=http://127.0.0.1:8600
+TWILIO_BASE_URL = os.environ.get('SOS_TWILIO_BASE_URL', '')
+TWILIO_API_ORIGIN = 'https://api.twilio.com'
+
+
+@functools.lru_cache(maxsize=None)
+def _twilio_sdk():
+    """
+    Import the Twilio SDK on first use rather than at startup; it is only
+    needed to send, and the prewarm thread usually has it loaded by then.
+    Returns (Client, HTTP client class, HTTPAdapter).
+    """
+    from requests.adapters import HTTPAdapter
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+
+    class RedirectingHttpClient(TwilioHttpClient):
+        """TwilioHttpClient that rewrites the API origin to TWILIO_BASE_URL"""
+
+        def request(self, method, url, *args, **kwargs):
+            if url.startswith(TWILIO_API_ORIGIN):
+                url = TWILIO_BASE_URL.rstrip('/') + url[len(TWILIO_API_ORIGIN):]
+            return super().request(method, url, *args, **kwargs)
+
+    return Client, RedirectingHttpClient if TWILIO_BASE_URL else TwilioHttpClient, HTTPAdapter
+
+
+class _PooledClient:
+    def __init__(self, account_sid, auth_token):
+        self.auth_token = auth_token
+        Client, http_client_class, HTTPAdapter = _twilio_sdk()
+        http_client = http_client_class(pool_connections=True, timeout=REQUEST_TIMEOUT)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY)
+        http_client.session.mount('https://', adapter)
+        http_client.session.mount('http://', adapter)
+        # requests reads proxy and CA settings from the environment on every
+        # request, scanning all of os.environ each time; read them once here
+        from requests.utils import get_environ_proxies
+        http_client.session.proxies.update(get_environ_proxies(TWILIO_BASE_URL or TWILIO_API_ORIGIN))
+        ca_bundle = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE')
+        if ca_bundle:
+            http_client.session.verify = ca_bundle
+        http_client.session.trust_env = False
+        self.client = Client(account_sid, auth_token, http_client=http_client)
+        self.slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+        self.leases = 0        # sends holding the client; changed under the pool's lock
+        self.retired = False   # replaced or invalidated; closed once the last lease is returned
+
+    def close(self):
+        self.client.http_client.session.close()
+
+
+class TwilioClientPool:
+    """
+    Process-wide Twilio clients keyed by account SID. Each client keeps a
+    persistent requests session, so after the first request (or warm-up) sends
+    reuse an open TLS connection instead of handshaking on every alert. A
+    client that is replaced or invalidated while sends hold it is retired:
+    new sends get a new client, and the old one is closed by the last send
+    to return it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    @staticmethod
+    def _retire(pooled):
+        """Mark a client retired; returns True if nothing holds it and it can be closed now. Call under the lock"""
+        pooled.retired = True
+        return pooled.leases == 0
+
+    def _get(self, account_sid, auth_token):
+        """The account's client, with a lease taken on it; returns (client, retired client to close)"""
+        retired = None
+        with self._lock:
+            pooled = self._clients.get(account_sid)
+            if pooled is not None and pooled.auth_token != auth_token:
+                # Token was rotated; the old session is authenticated with stale credentials
+                if self._retire(pooled):
+                    retired = pooled
+                pooled = None
+            if pooled is None:
+                with span('twilio_client_create'):
+                    pooled = _PooledClient(account_sid, auth_token)
+                self._clients[account_sid] = pooled
+            pooled.leases += 1
+        return pooled, retired
+
+    def _release(self, pooled):
+        with self._lock:
+            pooled.leases -= 1
+            close = pooled.retired and pooled.leases == 0
+        if close:
+            pooled.close()
+
+    @contextmanager
+    def lease(self, credentials):
+        """Borrow the client for these credentials, waiting if the account is at its concurrency limit"""
+        pooled, retired = self._get(credentials['twilio_account_sid'], credentials['twilio_auth_token'])
+        if retired is not None:
+            retired.close()
+        try:
+            with pooled.slots:
+                yield pooled.client
+        finally:
+            self._release(pooled)
+
+    def invalidate(self, account_sid):
+        """Drop the pooled client for an account, e.g. after its settings changed"""
+        with self._lock:
+            pooled = self._clients.pop(account_sid, None)
+            close = pooled is not None and self._retire(pooled)
+        if close:
+            pooled.close()
+
+    def warm_up(self, credentials):
+        """Open the connection for an account in the background so the first alert skips the handshake"""
+        def _warm():
+            try:
+                with self.lease(credentials) as client:
+                    client.api.v2010.accounts(credentials['twilio_account_sid']).fetch()
+            except Exception as e:
+                # Twilio's errors quote the account's URL; keep the SID out of the logs
+                print(f"Twilio warm-up failed: {str(e).replace(credentials['twilio_account_sid'], '<account>')}")
+
+        account_sid = credentials.get('twilio_account_sid')
+        auth_token = credentials.get('twilio_auth_token')
+        if not account_sid or not auth_token:
+            return
+        with self._lock:
+            pooled = self._clients.get(account_sid)
+            if pooled is not None and pooled.auth_token == auth_token:
+                return
+        threading.Thread(target=_warm, name='twilio-warm-up', daemon=True).start()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_twilio_pool():
+    """Return the Twilio client pool shared by all sessions in this process"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = TwilioClientPool()
+    return _pool